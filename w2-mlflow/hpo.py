@@ -1,60 +1,222 @@
 import argparse
 import os
-import pickle
+from concurrent.futures import ProcessPoolExecutor
 
 import mlflow
 import numpy as np
-from hyperopt import STATUS_OK, Trials, fmin, hp, tpe
+from hyperopt import STATUS_OK, JOB_STATE_DONE, Domain, Trials, hp, space_eval, tpe
 from hyperopt.pyll import scope
+from hyperopt.pyll.stochastic import sample
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
 
+from batch_logging import BatchLogger
+from model_cache import dataset_digest, load_model, model_key, model_path, save_model
+from sparse_store import load_dataset
+
+EXPERIMENT_NAME = "random-forest-hyperopt"
+
 mlflow.set_tracking_uri("http://127.0.0.1:5000")
-mlflow.set_experiment("random-forest-hyperopt")
+mlflow.set_experiment(EXPERIMENT_NAME)
 
+SEARCH_SPACE = {
+    'max_depth': scope.int(hp.quniform('max_depth', 1, 20, 1)),
+    'n_estimators': scope.int(hp.quniform('n_estimators', 10, 50, 1)),
+    'min_samples_split': scope.int(hp.quniform('min_samples_split', 2, 10, 1)),
+    'min_samples_leaf': scope.int(hp.quniform('min_samples_leaf', 1, 4, 1)),
+    'random_state': 42
+}
+# successive halving: each rung keeps the best 1/ETA of the candidates and
+# trains them on ETA times more rows, up to the whole training set
+ETA = 3
+MIN_TRAIN_FRACTION = 1 / 9
 
-def load_pickle(filename):
-    with open(filename, "rb") as f_in:
-        return pickle.load(f_in)
+# filled once per pool worker by init_worker, rather than sent with every
+# trial; the arrays are memory-mapped, so all workers share one copy
+_data = {}
 
 
-def run(data_path, num_trials):
+def init_worker(data_path):
+    _data['train'] = load_dataset(data_path, "train")
+    _data['valid'] = load_dataset(data_path, "valid")
 
-    X_train, y_train = load_pickle(os.path.join(data_path, "train.pkl"))
-    X_valid, y_valid = load_pickle(os.path.join(data_path, "valid.pkl"))
 
-    def objective(params):
-        with mlflow.start_run():
-            mlflow.set_tag('model', 'random-forest-regressor')
-            # log only the hyperparameters passed
-            mlflow.log_params(params)
+def evaluate(params, n_jobs, train_fraction=1.0, cache_path=None):
+    '''
+    fits one trial in a pool worker, on at most n_jobs cores; with
+    cache_path, the model is saved there, or loaded instead of fitted if
+    an earlier search already trained it
+    '''
+    X_train, y_train = _data['train']
+    X_valid, y_valid = _data['valid']
+    rf = load_model(cache_path) if cache_path else None
+    if rf is not None:
+        return mean_squared_error(y_valid, rf.predict(X_valid), squared=False)
+
+    if train_fraction < 1:
+        # a fixed permutation, so every rung's rows include the previous rung's
+        n_rows = max(1, int(len(y_train) * train_fraction))
+        rows = np.random.default_rng(42).permutation(len(y_train))[:n_rows]
+        rows.sort()
+        X_train, y_train = X_train[rows], y_train[rows]
+    rf = RandomForestRegressor(**params, n_jobs=n_jobs)
+    rf.fit(X_train, y_train)
+    if cache_path:
+        save_model(rf, cache_path)
+    y_pred = rf.predict(X_valid)
+    return mean_squared_error(y_valid, y_pred, squared=False)
 
 
-            rf = RandomForestRegressor(**params)
-            rf.fit(X_train, y_train)
-            y_pred = rf.predict(X_valid)
-            rmse = mean_squared_error(y_valid, y_pred, squared=False)
-            mlflow.log_metric("rmse", rmse)
+def suggest_batch(domain, trials, rstate, n_trials):
+    '''
+    asks TPE for n_trials points, one at a time as fmin does; the points
+    already suggested are in trials without a loss, which TPE counts as
+    bad ones, so the batch does not pile up on a single point
+    '''
+    docs = []
+    for _ in range(n_trials):
+        new_ids = trials.new_trial_ids(1)
+        trials.refresh()
+        new_docs = tpe.suggest(new_ids, domain, trials, rstate.integers(2**31 - 1))
+        trials.insert_trial_docs(new_docs)
+        trials.refresh()
+        docs.extend(trials.trials[-len(new_docs):])
+    return docs
 
-        return {'loss': rmse, 'status': STATUS_OK}
 
-    search_space = {
-        'max_depth': scope.int(hp.quniform('max_depth', 1, 20, 1)),
-        'n_estimators': scope.int(hp.quniform('n_estimators', 10, 50, 1)),
-        'min_samples_split': scope.int(hp.quniform('min_samples_split', 2, 10, 1)),
-        'min_samples_leaf': scope.int(hp.quniform('min_samples_leaf', 1, 4, 1)),
-        'random_state': 42
-    }
+def trial_point(doc):
+    return {label: vals[0] for label, vals in doc['misc']['vals'].items() if vals}
 
+
+def tpe_search(pool, logger, num_trials, parallelism, n_jobs_per_trial, data_digest):
+    # trials are evaluated by the pool, never through the domain
+    domain = Domain(lambda params: None, SEARCH_SPACE)
+    trials = Trials()
     rstate = np.random.default_rng(42)  # for reproducible results
-    fmin(
-        fn=objective,
-        space=search_space,
-        algo=tpe.suggest,
-        max_evals=num_trials,
-        trials=Trials(),
-        rstate=rstate
-    )
+
+    # batches of `parallelism` trials: TPE sees every result of a batch
+    # before suggesting the next one, so the search only depends on the
+    # seed and parallelism, not on which trial finishes first;
+    # with parallelism=1 it suggests the same points as fmin
+    while len(trials) < num_trials:
+        n_batch = min(parallelism, num_trials - len(trials))
+        docs = suggest_batch(domain, trials, rstate, n_batch)
+        batch = [space_eval(SEARCH_SPACE, trial_point(doc)) for doc in docs]
+        keys = [model_key(params, data_digest) for params in batch]
+        futures = [
+            pool.submit(evaluate, params, n_jobs_per_trial, 1.0, model_path(key))
+            for params, key in zip(batch, keys)
+        ]
+
+        # runs are logged from here, in trial order
+        for doc, params, key, future in zip(docs, batch, keys, futures):
+            rmse = future.result()
+            run = logger.start_run(
+                tags={'model': 'random-forest-regressor', 'model_key': key}
+            )
+            # log only the hyperparameters passed
+            logger.log_params(run, params)
+            logger.log_metric(run, "rmse", rmse)
+            logger.end_run(run)
+
+            doc['state'] = JOB_STATE_DONE
+            doc['result'] = {'loss': rmse, 'status': STATUS_OK}
+        trials.refresh()
+
+    best = trials.best_trial
+    return space_eval(SEARCH_SPACE, trial_point(best)), best['result']['loss']
+
+
+def rung_fractions(min_fraction=MIN_TRAIN_FRACTION, eta=ETA):
+    '''training set fraction of every rung, e.g. [1/9, 1/3, 1] for eta=3'''
+    n_rungs = 1 + int(np.floor(np.log(1 / min_fraction) / np.log(eta) + 1e-9))
+    return [float(eta) ** (rung - n_rungs + 1) for rung in range(n_rungs)]
+
+
+def halving_search(
+    pool,
+    logger,
+    num_trials,
+    n_jobs_per_trial,
+    data_digest,
+    eta=ETA,
+    min_fraction=MIN_TRAIN_FRACTION
+):
+    '''
+    successive halving: num_trials random candidates are fitted on a
+    subsample of the training rows, and only the best 1/eta of each rung
+    are fitted again on eta times more rows. Each candidate has one MLflow
+    run, with its rung scores as the steps of `rung_rmse`; `rmse` is only
+    logged for the candidates that reach the full training set
+    '''
+    rng = np.random.default_rng(42)  # for reproducible results
+    candidates = [sample(SEARCH_SPACE, rng=rng) for _ in range(num_trials)]
+    keys = [model_key(params, data_digest) for params in candidates]
+    runs = [None] * num_trials
+    scores = {}
+
+    alive = list(range(num_trials))
+    for rung, fraction in enumerate(rung_fractions(min_fraction, eta)):
+        # only the models trained on all rows are worth keeping
+        cache_paths = {i: model_path(keys[i]) if fraction == 1 else None for i in alive}
+        futures = [
+            pool.submit(
+                evaluate, candidates[i], n_jobs_per_trial, fraction, cache_paths[i]
+            )
+            for i in alive
+        ]
+        for i, future in zip(alive, futures):
+            scores[i] = future.result()
+            if runs[i] is None:
+                runs[i] = logger.start_run(tags={
+                    'model': 'random-forest-regressor',
+                    'search': 'successive-halving'
+                })
+                logger.log_params(runs[i], candidates[i])
+            logger.log_metrics(
+                runs[i], {'train_fraction': fraction, 'rung_rmse': scores[i]}, step=rung
+            )
+            if fraction == 1:
+                logger.set_tags(runs[i], {'model_key': keys[i]})
+                logger.log_metric(runs[i], 'rmse', scores[i])
+        print(
+            f'rung {rung}: {len(alive)} candidates on {fraction:.0%} of the rows,'
+            f' best rmse {min(scores[i] for i in alive):.4f}'
+        )
+        n_promoted = max(1, int(np.ceil(len(alive) / eta)))
+        ranked = sorted(alive, key=scores.get)
+        alive = ranked[:n_promoted]
+        for i in ranked[n_promoted:]:
+            logger.end_run(runs[i])
+
+    for i in alive:
+        logger.end_run(runs[i])
+
+    best = alive[0]
+    return candidates[best], scores[best]
+
+
+def run(data_path, num_trials, parallelism=1, n_jobs_per_trial=None, search='tpe'):
+
+    if n_jobs_per_trial is None:
+        # split the machine between the concurrent trials
+        n_jobs_per_trial = max(1, (os.cpu_count() or 1) // parallelism)
+
+    # fitted models are cached under their params and this hash, where
+    # register_model.py finds them again; runs are tagged with the key
+    data_digest = dataset_digest(data_path, "train")
+
+    # runs are sent to MLflow in batches, from a background thread
+    with BatchLogger(EXPERIMENT_NAME) as logger, ProcessPoolExecutor(
+        max_workers=parallelism, initializer=init_worker, initargs=(data_path,)
+    ) as pool:
+        if search == 'halving':
+            return halving_search(
+                pool, logger, num_trials, n_jobs_per_trial, data_digest
+            )
+        return tpe_search(
+            pool, logger, num_trials, parallelism, n_jobs_per_trial, data_digest
+        )
 
 
 if __name__ == '__main__':
@@ -68,8 +230,33 @@ if __name__ == '__main__':
     parser.add_argument(
         "--max_evals",
         default=50,
+        type=int,
         help="the number of parameter evaluations for the optimizer to explore."
     )
+    parser.add_argument(
+        "--parallelism",
+        default=1,
+        type=int,
+        help="the number of trials evaluated at the same time."
+    )
+    parser.add_argument(
+        "--n_jobs_per_trial",
+        default=None,
+        type=int,
+        help="the cores for each trial's random forest, by default the cores split between the parallel trials."
+    )
+    parser.add_argument(
+        "--search",
+        default="tpe",
+        choices=["tpe", "halving"],
+        help="TPE on the full training set, or successive halving over random candidates."
+    )
     args = parser.parse_args()
 
-    run(args.data_path, args.max_evals)
+    run(
+        args.data_path,
+        args.max_evals,
+        args.parallelism,
+        args.n_jobs_per_trial,
+        args.search
+    )
@@ -0,0 +1,51 @@
+"""
+Fitted models stored under a key made of their hyperparameters and a hash
+of the training split, so a model trained once during the search can be
+loaded again by register_model.py, or by a later search suggesting the
+same point, instead of being retrained.
+"""
+import hashlib
+import json
+import os
+import pickle
+
+MODEL_CACHE_DIR = os.getenv('MODEL_CACHE_DIR', './model_cache')
+
+
+def dataset_digest(data_path: str, name: str = 'train') -> str:
+    '''sha256 over the files of a split saved by sparse_store'''
+    digest = hashlib.sha256()
+    path = os.path.join(data_path, name)
+    for filename in sorted(os.listdir(path)):
+        digest.update(filename.encode())
+        with open(os.path.join(path, filename), 'rb') as f_in:
+            for chunk in iter(lambda: f_in.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_key(params: dict, data_digest: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    digest.update(data_digest.encode())
+    return digest.hexdigest()
+
+
+def model_path(key: str, cache_dir: str = MODEL_CACHE_DIR) -> str:
+    return os.path.join(cache_dir, f'{key}.pkl')
+
+
+def save_model(model, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # renamed into place, so an interrupted write is never loaded
+    with open(f'{path}.tmp', 'wb') as f_out:
+        pickle.dump(model, f_out)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_model(path: str):
+    '''the cached model, or None if there is none'''
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f_in:
+        return pickle.load(f_in)
@@ -2,9 +2,17 @@ import argparse
 import os
 import pickle
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.feature_extraction import DictVectorizer
 
+from sparse_store import save_dataset
+from trip_cleaning import clean_trips, read_trips
+
+# TLC taxi zones are numbered 1..265; PU_DO pairs are encoded on this grid
+N_ZONES = 265
+
 
 def dump_pickle(obj, filename):
     with open(filename, "wb") as f_out:
@@ -12,27 +20,109 @@ def dump_pickle(obj, filename):
 
 
 def read_dataframe(filename: str):
-    df = pd.read_parquet(filename)
+    df = read_trips(filename)
+    # location ids stay integers; transform_pu_do encodes them directly
+    df = clean_trips(df, categorical=None)
 
-    df['duration'] = df.lpep_dropoff_datetime - df.lpep_pickup_datetime
-    df.duration = df.duration.apply(lambda td: td.total_seconds() / 60)
-    df = df[(df.duration >= 1) & (df.duration <= 60)]
+    return df
 
-    categorical = ['PULocationID', 'DOLocationID']
-    df[categorical] = df[categorical].astype(str)
 
-    return df
+def zone_ids(values: pd.Series) -> np.ndarray:
+    """Location ids as floats, NaN where missing; only str-cast ids
+    are parsed"""
+    if not pd.api.types.is_numeric_dtype(values):
+        values = pd.to_numeric(values, errors='coerce')
+    return values.to_numpy(dtype=float, na_value=np.nan)
+
+
+def pu_do_codes(df: pd.DataFrame):
+    """Maps each (PULocationID, DOLocationID) pair to a cell of the
+    N_ZONES x N_ZONES grid; -1 for missing or out-of-range zones
+    """
+    pu = zone_ids(df['PULocationID'])
+    do = zone_ids(df['DOLocationID'])
+    valid = (pu >= 1) & (pu <= N_ZONES) & (do >= 1) & (do <= N_ZONES)
+    codes = np.full(len(df), -1, dtype=np.int64)
+    pu = pu[valid].astype(np.int64) - 1
+    do = do[valid].astype(np.int64) - 1
+    codes[valid] = pu * N_ZONES + do
+    return codes
+
+
+def fit_pu_do_vectorizer(df: pd.DataFrame):
+    """Builds a DictVectorizer with the same vocabulary that fitting it on
+    the PU_DO/trip_distance dicts would produce, without the dicts
+    """
+    codes = np.unique(pu_do_codes(df))
+    codes = codes[codes >= 0]
+    feature_names = [
+        f'PU_DO={pu}_{do}'
+        for pu, do in zip(codes // N_ZONES + 1, codes % N_ZONES + 1)
+    ]
+    feature_names.append('trip_distance')
+    # DictVectorizer keeps its features in sorted (string) order
+    feature_names.sort()
+
+    dv = DictVectorizer()
+    dv.feature_names_ = feature_names
+    dv.vocabulary_ = {name: i for i, name in enumerate(feature_names)}
+    return dv
+
+
+def pu_do_lookup(dv: DictVectorizer):
+    """Column index of every grid cell in the vectorizer; -1 if unseen"""
+    lookup = np.full(N_ZONES * N_ZONES, -1, dtype=np.int64)
+    for name, col in dv.vocabulary_.items():
+        if not name.startswith('PU_DO='):
+            continue
+        pu, do = name[len('PU_DO='):].split('_')
+        try:
+            pu, do = int(pu), int(do)
+        except ValueError:
+            continue
+        if 1 <= pu <= N_ZONES and 1 <= do <= N_ZONES:
+            lookup[(pu - 1) * N_ZONES + (do - 1)] = col
+    return lookup
+
+
+def transform_pu_do(df: pd.DataFrame, dv: DictVectorizer):
+    """Columnar equivalent of dv.transform(dicts) for PU_DO + trip_distance;
+    pairs unseen by the vectorizer are dropped, as DictVectorizer does
+    """
+    n_rows = len(df)
+    codes = pu_do_codes(df)
+    pu_do_cols = np.full(n_rows, -1, dtype=np.int64)
+    known = codes >= 0
+    pu_do_cols[known] = pu_do_lookup(dv)[codes[known]]
+    has_pu_do = pu_do_cols >= 0
+
+    distance_col = dv.vocabulary_['trip_distance']
+    distance = df['trip_distance'].to_numpy(dtype=np.float64)
+
+    # each row holds its PU_DO entry (if known) followed by trip_distance;
+    # PU_DO columns always sort before 'trip_distance'
+    nnz_per_row = has_pu_do.astype(np.int64) + 1
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(nnz_per_row, out=indptr[1:])
+
+    indices = np.empty(indptr[-1], dtype=np.int64)
+    data = np.empty(indptr[-1], dtype=np.float64)
+    distance_pos = indptr[1:] - 1
+    indices[distance_pos] = distance_col
+    data[distance_pos] = distance
+    pu_do_pos = indptr[:-1][has_pu_do]
+    indices[pu_do_pos] = pu_do_cols[has_pu_do]
+    data[pu_do_pos] = 1.0
+
+    return sparse.csr_matrix(
+        (data, indices, indptr), shape=(n_rows, len(dv.feature_names_))
+    )
 
 
 def preprocess(df: pd.DataFrame, dv: DictVectorizer, fit_dv: bool = False):
-    df['PU_DO'] = df['PULocationID'] + '_' + df['DOLocationID']
-    categorical = ['PU_DO']
-    numerical = ['trip_distance']
-    dicts = df[categorical + numerical].to_dict(orient='records')
     if fit_dv:
-        X = dv.fit_transform(dicts)
-    else:
-        X = dv.transform(dicts)
+        dv = fit_pu_do_vectorizer(df)
+    X = transform_pu_do(df, dv)
     return X, dv
 
 
@@ -65,9 +155,10 @@ def run(raw_data_path: str, dest_path: str, dataset: str = "green"):
 
     # save dictvectorizer and datasets
     dump_pickle(dv, os.path.join(dest_path, "dv.pkl"))
-    dump_pickle((X_train, y_train), os.path.join(dest_path, "train.pkl"))
-    dump_pickle((X_valid, y_valid), os.path.join(dest_path, "valid.pkl"))
-    dump_pickle((X_test, y_test), os.path.join(dest_path, "test.pkl"))
+    # as memory-mappable arrays; train is column-major, which tree fitting uses
+    save_dataset(X_train, y_train, dest_path, "train", layout='csc')
+    save_dataset(X_valid, y_valid, dest_path, "valid")
+    save_dataset(X_test, y_test, dest_path, "test")
 
 
 if __name__ == '__main__':
@@ -1,6 +1,4 @@
 import argparse
-import os
-import pickle
 
 import mlflow
 from hyperopt import hp, space_eval
@@ -10,12 +8,16 @@ from mlflow.tracking import MlflowClient
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
 
+from model_cache import dataset_digest, load_model, model_key, model_path
+from sparse_store import load_dataset
+
 HPO_EXPERIMENT_NAME = "random-forest-hyperopt"
 EXPERIMENT_NAME = "random-forest-best-models"
 
 mlflow.set_tracking_uri("http://127.0.0.1:5000")
 mlflow.set_experiment(EXPERIMENT_NAME)
-mlflow.sklearn.autolog()
+# the model is logged explicitly, whether it was loaded or trained here
+mlflow.sklearn.autolog(log_models=False)
 
 SPACE = {
     'max_depth': scope.int(hp.quniform('max_depth', 1, 20, 1)),
@@ -26,26 +28,30 @@ SPACE = {
 }
 
 
-def load_pickle(filename):
-    with open(filename, "rb") as f_in:
-        return pickle.load(f_in)
-
-
-def train_and_log_model(data_path, params):
-    X_train, y_train = load_pickle(os.path.join(data_path, "train.pkl"))
-    X_valid, y_valid = load_pickle(os.path.join(data_path, "valid.pkl"))
-    X_test, y_test = load_pickle(os.path.join(data_path, "test.pkl"))
+def train_and_log_model(data_path, params, data_digest):
+    X_valid, y_valid = load_dataset(data_path, "valid")
+    X_test, y_test = load_dataset(data_path, "test")
 
     with mlflow.start_run():
         params = space_eval(SPACE, params)
-        rf = RandomForestRegressor(**params)
-        rf.fit(X_train, y_train)
+        # hpo.py cached the model under the same key, unless the
+        # training data has changed since
+        key = model_key(params, data_digest)
+        rf = load_model(model_path(key))
+        if rf is None:
+            X_train, y_train = load_dataset(data_path, "train")
+            rf = RandomForestRegressor(**params)
+            rf.fit(X_train, y_train)
+        else:
+            mlflow.log_params(params)
+            mlflow.set_tag('model_key', key)
 
         # evaluate model on the validation and test sets
         valid_rmse = mean_squared_error(y_valid, rf.predict(X_valid), squared=False)
         mlflow.log_metric("valid_rmse", valid_rmse)
         test_rmse = mean_squared_error(y_test, rf.predict(X_test), squared=False)
         mlflow.log_metric("test_rmse", test_rmse)
+        mlflow.sklearn.log_model(rf, artifact_path='model')
 
 
 def run(data_path, log_top):
@@ -60,8 +66,11 @@ def run(data_path, log_top):
         max_results=log_top,
         order_by=["metrics.rmse ASC"]
     )
+    data_digest = dataset_digest(data_path, "train")
     for run in runs:
-        train_and_log_model(data_path=data_path, params=run.data.params)
+        train_and_log_model(
+            data_path=data_path, params=run.data.params, data_digest=data_digest
+        )
 
     # select the model with the lowest test RMSE
     experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
@@ -71,12 +80,12 @@ def run(data_path, log_top):
         experiment_ids=experiment.experiment_id,
         run_view_type=ViewType.ACTIVE_ONLY,
         max_results=1,
-        order_by=["metrics.rmse ASC"]
+        order_by=["metrics.test_rmse ASC"]
     )
 
     # register the best model
-    # I think the '/sklearn-model' part is just decided by user
-    model_uri = f'runs:/{best_run[0].info.run_id}/sklearn-model'
+    # the artifact_path given to log_model above
+    model_uri = f'runs:/{best_run[0].info.run_id}/model'
     mlflow.register_model(
         model_uri,
         # this part is definitely user-defined.
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.feature_extraction import DictVectorizer
+
+import preprocess_data
+
+
+def write_trips(path, rides):
+    """rides: (PULocationID, DOLocationID, trip_distance, duration minutes)"""
+    pickup = datetime(2021, 1, 1, 8)
+    df = pd.DataFrame(
+        {
+            'lpep_pickup_datetime': [pickup] * len(rides),
+            'lpep_dropoff_datetime': [
+                pickup + timedelta(minutes=ride[3]) for ride in rides
+            ],
+            'PULocationID': [ride[0] for ride in rides],
+            'DOLocationID': [ride[1] for ride in rides],
+            'trip_distance': [ride[2] for ride in rides],
+        }
+    )
+    df.to_parquet(path, index=False)
+    return str(path)
+
+
+def dict_features(df):
+    """The PU_DO/trip_distance dicts the DictVectorizer was fitted on"""
+    df = df.astype({'PULocationID': str, 'DOLocationID': str})
+    df['PU_DO'] = df['PULocationID'] + '_' + df['DOLocationID']
+    return df[['PU_DO', 'trip_distance']].to_dict(orient='records')
+
+
+@pytest.fixture
+def train_file(tmp_path):
+    rides = [
+        (1, 2, 1.5, 10),
+        (43, 151, 2.0, 12),
+        (1, 2, 0.8, 5),
+        (265, 1, 12.3, 35),
+        (74, 75, 0.5, 0.5),  # too short, filtered out
+        (166, 166, 3.1, 14),
+        (10, 100, 7.7, 25),
+    ]
+    return write_trips(tmp_path / 'train.parquet', rides)
+
+
+@pytest.fixture
+def valid_file(tmp_path):
+    rides = [
+        (1, 2, 2.5, 11),
+        # pairs the training month does not have
+        (2, 1, 1.1, 6),
+        (200, 201, 4.2, 20),
+        (166, 166, 0.0, 3),
+    ]
+    return write_trips(tmp_path / 'valid.parquet', rides)
+
+
+def test_read_dataframe_keeps_integer_locations(train_file):
+    df = preprocess_data.read_dataframe(train_file)
+
+    assert pd.api.types.is_integer_dtype(df['PULocationID'])
+    assert pd.api.types.is_integer_dtype(df['DOLocationID'])
+    assert len(df) == 6
+
+
+def test_transform_matches_dict_vectorizer(train_file, valid_file):
+    df_train = preprocess_data.read_dataframe(train_file)
+    df_valid = preprocess_data.read_dataframe(valid_file)
+
+    X_train, dv = preprocess_data.preprocess(df_train, None, fit_dv=True)
+    X_valid, _ = preprocess_data.preprocess(df_valid, dv)
+
+    expected_dv = DictVectorizer()
+    expected_train = expected_dv.fit_transform(dict_features(df_train))
+    expected_valid = expected_dv.transform(dict_features(df_valid))
+
+    assert dv.feature_names_ == expected_dv.feature_names_
+    assert dv.vocabulary_ == expected_dv.vocabulary_
+    for X, expected in [(X_train, expected_train), (X_valid, expected_valid)]:
+        assert X.shape == expected.shape
+        np.testing.assert_array_equal(X.toarray(), expected.toarray())
+
+
+def test_str_locations_give_the_same_matrix(train_file):
+    df = preprocess_data.read_dataframe(train_file)
+    X, dv = preprocess_data.preprocess(df, None, fit_dv=True)
+
+    str_df = df.astype({'PULocationID': str, 'DOLocationID': str})
+    str_X, str_dv = preprocess_data.preprocess(str_df, None, fit_dv=True)
+
+    assert str_dv.vocabulary_ == dv.vocabulary_
+    np.testing.assert_array_equal(str_X.toarray(), X.toarray())
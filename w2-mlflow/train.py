@@ -1,21 +1,16 @@
 import argparse
-import os
-import pickle
 import mlflow
 
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
 
-
-def load_pickle(filename: str):
-    with open(filename, "rb") as f_in:
-        return pickle.load(f_in)
+from sparse_store import load_dataset
 
 
 def run(data_path, tracking_uri):
 
-    X_train, y_train = load_pickle(os.path.join(data_path, "train.pkl"))
-    X_valid, y_valid = load_pickle(os.path.join(data_path, "valid.pkl"))
+    X_train, y_train = load_dataset(data_path, "train")
+    X_valid, y_valid = load_dataset(data_path, "valid")
 
     if tracking_uri:
         mlflow.set_tracking_uri(tracking_uri)
@@ -1,5 +1,6 @@
 # Copying the training pipeline from duration-prediction.ipynb in week 2
 
+import numpy as np
 import pandas as pd
 import pickle
 
@@ -12,6 +13,7 @@ import xgboost as xgb
 
 from hyperopt import fmin, tpe, hp, STATUS_OK, Trials
 from hyperopt.pyll import scope
+from hyperopt.pyll.stochastic import sample
 # pipeline will not need plotting
 # import seaborn as sns
 # import matplotlib.pyplot as plt
@@ -23,6 +25,11 @@ import mlflow
 from prefect import flow, task
 from prefect.task_runners import SequentialTaskRunner
 
+from batch_logging import BatchLogger
+from trip_cleaning import clean_trips, read_trips
+
+EXPERIMENT_NAME = "nyc-taxi-experiment"
+
 @task
 def read_dataframe(filename):
     """Reads NYC green cab trip data from 2021
@@ -34,16 +41,10 @@ def read_dataframe(filename):
         df.lpep_pickup_datetime = pd.to_datetime(df.lpep_pickup_datetime)
         
     elif filename.endswith('.parquet'):
-        df = pd.read_parquet(filename)
-
-    df['duration'] = df.lpep_dropoff_datetime - df.lpep_pickup_datetime
-    df.duration = df.duration.apply(lambda td: td.total_seconds() / 60)
+        df = read_trips(filename)
 
-    df = df[(df.duration >= 1) & (df.duration <= 60)]
+    df = clean_trips(df)
 
-    categorical = ['PULocationID', 'DOLocationID']
-    df[categorical] = df[categorical].astype(str)
-    
     return df
 
 @task
@@ -108,23 +109,86 @@ def add_features(df_train, df_val):
     
 # xgboost and hyperopt
 
-# @task
-def train_model_search(train, valid, y_val):
-
-    def objective(params):
-        with mlflow.start_run():
-            mlflow.set_tag("model", "xgboost")
-            mlflow.log_params(params)
-            booster = xgb.train(
-                params=params,
+# successive halving over boosting rounds: each rung keeps the best
+# 1/HALVING_ETA of the boosters and trains them HALVING_ETA times longer
+NUM_BOOST_ROUND = 50
+HALVING_ETA = 3
+HALVING_RUNGS = 3
+
+def halving_search(train, valid, y_val, search_space, n_candidates, logger):
+    """Successive halving over n_candidates random points of search_space.
+    Promoted boosters continue training instead of starting over, so a
+    candidate reaching the last rung costs NUM_BOOST_ROUND rounds in total.
+    Each candidate has one MLflow run, with its rung scores as the steps
+    (boosting rounds) of `rung_rmse`; only the last rung logs `rmse`
+    """
+    rng = np.random.default_rng(42)
+    candidates = [sample(search_space, rng=rng) for _ in range(n_candidates)]
+    boosters = [None] * n_candidates
+    runs = [None] * n_candidates
+    scores = {}
+
+    alive = list(range(n_candidates))
+    for rung in range(HALVING_RUNGS):
+        num_rounds = int(np.ceil(
+            NUM_BOOST_ROUND / HALVING_ETA ** (HALVING_RUNGS - 1 - rung)
+        ))
+        for i in alive:
+            done_rounds = 0
+            if boosters[i] is not None:
+                done_rounds = boosters[i].num_boosted_rounds()
+            if runs[i] is None:
+                runs[i] = logger.start_run(
+                    tags={"model": "xgboost", "search": "successive-halving"}
+                )
+                logger.log_params(runs[i], candidates[i])
+            boosters[i] = xgb.train(
+                params=candidates[i],
                 dtrain=train,
-                num_boost_round=50,
+                num_boost_round=num_rounds - done_rounds,
                 evals=[(valid, 'validation')],
-                early_stopping_rounds=50
+                xgb_model=boosters[i],
+                verbose_eval=False
             )
-            y_pred = booster.predict(valid)
-            rmse = mean_squared_error(y_val, y_pred, squared=False)
-            mlflow.log_metric("rmse", rmse)
+            y_pred = boosters[i].predict(valid)
+            scores[i] = mean_squared_error(y_val, y_pred, squared=False)
+            logger.log_metric(runs[i], "rung_rmse", scores[i], step=num_rounds)
+            if num_rounds == NUM_BOOST_ROUND:
+                logger.log_metric(runs[i], "rmse", scores[i])
+
+        n_promoted = max(1, int(np.ceil(len(alive) / HALVING_ETA)))
+        ranked = sorted(alive, key=scores.get)
+        alive = ranked[:n_promoted]
+        # the other boosters are not trained any further
+        for i in ranked[n_promoted:]:
+            boosters[i] = None
+            logger.end_run(runs[i])
+
+    for i in alive:
+        logger.end_run(runs[i])
+
+    best = alive[0]
+    return candidates[best], scores[best]
+
+# @task
+def train_model_search(train, valid, y_val, search='tpe', max_evals=1):
+    # trial runs are sent to MLflow in batches, from a background thread
+    logger = BatchLogger(EXPERIMENT_NAME)
+
+    def objective(params):
+        run = logger.start_run(tags={"model": "xgboost"})
+        logger.log_params(run, params)
+        booster = xgb.train(
+            params=params,
+            dtrain=train,
+            num_boost_round=NUM_BOOST_ROUND,
+            evals=[(valid, 'validation')],
+            early_stopping_rounds=50
+        )
+        y_pred = booster.predict(valid)
+        rmse = mean_squared_error(y_val, y_pred, squared=False)
+        logger.log_metric(run, "rmse", rmse)
+        logger.end_run(run)
 
         return {'loss': rmse, 'status': STATUS_OK}
 
@@ -138,13 +202,19 @@ def train_model_search(train, valid, y_val):
         'seed': 42
     }
 
-    best_result = fmin(
-        fn=objective,
-        space=search_space,
-        algo=tpe.suggest,
-        max_evals=1, # set to a low val for testing
-        trials=Trials()
-    )
+    with logger:
+        if search == 'halving':
+            return halving_search(
+                train, valid, y_val, search_space, max_evals, logger
+            )
+
+        best_result = fmin(
+            fn=objective,
+            space=search_space,
+            algo=tpe.suggest,
+            max_evals=max_evals, # set to a low val for testing
+            trials=Trials()
+        )
     return
 
 # not needed for orchestraion demo
@@ -190,7 +260,7 @@ def main(train_path: str = '../data/green_tripdata_2021-01.parquet',
          val_path: str = '../data/green_tripdata_2021-02.parquet'):
     
     mlflow.set_tracking_uri("sqlite:///mlflow.db")
-    mlflow.set_experiment("nyc-taxi-experiment")
+    mlflow.set_experiment(EXPERIMENT_NAME)
     X_train = read_dataframe(train_path)
     X_val = read_dataframe(val_path)
     # consolidating the code where we invoke our newly defined functions
@@ -199,6 +269,8 @@ def main(train_path: str = '../data/green_tripdata_2021-01.parquet',
     train = xgb.DMatrix(X_train, label=y_train)
     valid = xgb.DMatrix(X_val, label=y_val)    
     # train_model_search(train, valid, y_val)
+    # or, with early stopping of the weaker candidates:
+    # train_model_search(train, valid, y_val, search='halving', max_evals=27)
     train_best_model(train, valid, y_val, dv)
     
 main()
\ No newline at end of file
@@ -8,6 +8,8 @@ import os
 import uuid
 import argparse
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from sklearn.feature_extraction import DictVectorizer
 from sklearn.ensemble import RandomForestRegressor
@@ -16,30 +18,35 @@ from sklearn.pipeline import make_pipeline
 
 import mlflow
 
+from trip_cleaning import clean_trips, iter_trips, read_trips, resolve_filesystem
+
 # Use .env to parametrize our script
 # RUN_ID = os.getenv(key='RUN_ID', default='815e49bd6e69425d977f2042f7f74c97')
 MLFLOW_HOST = os.getenv(key='MLFLOW_HOST', default='13.215.46.159')
 EVAL_S3_STORE = os.getenv(key='EVAL_S3_STORE', 
                           default='s3://nyc-duration-predict-vk')
 
+MODEL_URI_PATTERN = os.getenv(
+    key='MODEL_URI_PATTERN',
+    default='s3://mlflow-artifacts-remote-1212/3/{run_id}/artifacts/model',
+)
+
 MLFLOW_URI = f'http://{MLFLOW_HOST}:5000'
-mlflow.set_tracking_uri(MLFLOW_URI)
-mlflow.set_experiment("green-taxi-duration")
 
 def load_model(run_id):
-    logged_model = f's3://mlflow-artifacts-remote-1212/3/{run_id}/artifacts/model'
+    logged_model = MODEL_URI_PATTERN.format(run_id=run_id)
     model = mlflow.pyfunc.load_model(logged_model)
     return model
 
 def read_dataframe(filename: str):
-    df = pd.read_parquet(filename)
+    # only the model's columns are read, and rides outside 1-60 minutes
+    # are dropped by pyarrow before the frame is built
+    df = read_trips(filename)
 
     # In this usage example, the target variable is usually
     # not present if we're simply applying the model,
     # vs training the model
-    df['duration'] = df.lpep_dropoff_datetime - df.lpep_pickup_datetime
-    df.duration = df.duration.dt.total_seconds() / 60
-    df = df[(df.duration >= 1) & (df.duration <= 60)]
+    df = clean_trips(df, categorical=None)
     
     return df
 
@@ -54,20 +61,9 @@ def prepare_dictionaries(df: pd.DataFrame):
     dicts = df[categorical + numerical].to_dict(orient='records')
     return dicts
 
-def apply_model(input_file, run_id, output_file):
-    # df = read_dataframe('../../data/green_tripdata_2021-01.parquet')
-    df = read_dataframe(input_file)
-
-    # applying model, not training
-    # df_val = read_dataframe('../../data/green_tripdata_2021-02.parquet')
-    # target = 'duration'
-    # y_train = df[target].values
-    # y_val = df_val[target].values
-
+def score_dataframe(df: pd.DataFrame, model, run_id):
     dicts = prepare_dictionaries(df)
     # dict_val = prepare_dictionaries(df_val)
-    model = load_model(run_id)
-
     y_pred = model.predict(dicts)
 
     df_result = pd.DataFrame()
@@ -79,9 +75,47 @@ def apply_model(input_file, run_id, output_file):
     df_result['predicted_duration'] = y_pred
     df_result['diff'] = df_result['actual_duration'] - df_result['predicted_duration']
     df_result['model_version'] = run_id
-    
+    return df_result
+
+def apply_model(input_file, run_id, output_file):
+    # df = read_dataframe('../../data/green_tripdata_2021-01.parquet')
+    df = read_dataframe(input_file)
+
+    # applying model, not training
+    # df_val = read_dataframe('../../data/green_tripdata_2021-02.parquet')
+    # target = 'duration'
+    # y_train = df[target].values
+    # y_val = df_val[target].values
+
+    model = load_model(run_id)
+    df_result = score_dataframe(df, model, run_id)
+
     df_result.to_parquet(output_file, index=False)
 
+def apply_model_chunked(input_file, run_id, output_file, chunk_rows):
+    '''
+    Streaming version of apply_model: the input is scored chunk_rows rides
+    at a time and each chunk is appended to the output parquet file,
+    so memory is bounded by the chunk size rather than the month
+    '''
+    model = load_model(run_id)
+    filesystem, output_path = resolve_filesystem(output_file)
+
+    writer = None
+    try:
+        for df in iter_trips(input_file, chunk_rows):
+            df = clean_trips(df, categorical=None)
+            df_result = score_dataframe(df, model, run_id)
+            table = pa.Table.from_pandas(df_result, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    output_path, table.schema, filesystem=filesystem
+                )
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -104,13 +138,28 @@ if __name__ == '__main__':
         type=str,
         default='815e49bd6e69425d977f2042f7f74c97'
     )
+    parser.add_argument(
+        '--chunk-rows', '-c',
+        type=int,
+        default=None,
+        help='stream the month in chunks of this many rides; defaults to reading it whole',
+    )
     args = parser.parse_args()
+    mlflow.set_tracking_uri(MLFLOW_URI)
+    mlflow.set_experiment("green-taxi-duration")
+
     input_file = f's3://nyc-tlc/trip data/{args.taxi_type}_tripdata_{args.year:04d}-{args.month:02d}.parquet'
     if not os.path.exists('./output'):
         os.mkdir('./output')
         
     # output_file = f'./output/{args.taxi_type}-{args.year:04d}-{args.month:02d}.parquet'
     output_file = f'{EVAL_S3_STORE}/{args.taxi_type}_tripdata_{args.year:04d}-{args.month:02d}.parquet'
-    apply_model(input_file=input_file,
-                run_id=args.run_id,
-                output_file=output_file)
\ No newline at end of file
+    if args.chunk_rows:
+        apply_model_chunked(input_file=input_file,
+                            run_id=args.run_id,
+                            output_file=output_file,
+                            chunk_rows=args.chunk_rows)
+    else:
+        apply_model(input_file=input_file,
+                    run_id=args.run_id,
+                    output_file=output_file)
\ No newline at end of file
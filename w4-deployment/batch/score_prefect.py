@@ -3,12 +3,11 @@
 '''
 Batch scoring script to compare actual ride duration to predicted duration
 '''
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import os
-import uuid
 import argparse
-import pandas as pd
 
 from sklearn.feature_extraction import DictVectorizer
 from sklearn.ensemble import RandomForestRegressor
@@ -21,42 +20,28 @@ from prefect import get_run_logger
 from prefect import flow
 from prefect.context import get_run_context
 
+# the scoring steps are shared with the plain script
+from score import MLFLOW_URI, load_model, read_dataframe, score_dataframe
+
 # Use .env to parametrize our script
 # RUN_ID = os.getenv(key='RUN_ID', default='815e49bd6e69425d977f2042f7f74c97')
-MLFLOW_HOST = os.getenv(key='MLFLOW_HOST', default='13.215.46.159')
 EVAL_S3_STORE = os.getenv(key='EVAL_S3_STORE', 
                           default='s3://nyc-duration-predict-vk')
 
-MLFLOW_URI = f'http://{MLFLOW_HOST}:5000'
-mlflow.set_tracking_uri(MLFLOW_URI)
-mlflow.set_experiment("green-taxi-duration")
-
-def load_model(run_id):
-    logged_model = f's3://mlflow-artifacts-remote-1212/3/{run_id}/artifacts/model'
-    model = mlflow.pyfunc.load_model(logged_model)
-    return model
-
-def read_dataframe(filename: str):
-    df = pd.read_parquet(filename)
-
-    # In this usage example, the target variable is usually
-    # not present if we're simply applying the model,
-    # vs training the model
-    df['duration'] = df.lpep_dropoff_datetime - df.lpep_pickup_datetime
-    df.duration = df.duration.dt.total_seconds() / 60
-    df = df[(df.duration >= 1) & (df.duration <= 60)]
-    df['ride_id'] = [str(uuid.uuid4()) for _ in range(len(df))]
-    return df
-
-def prepare_dictionaries(df: pd.DataFrame):
-    categorical = ['PULocationID', 'DOLocationID']
-    df[categorical] = df[categorical].astype(str)
-
-    df['PU_DO'] = df['PULocationID'] + '_' + df['DOLocationID']
-    categorical = ['PU_DO']
-    numerical = ['trip_distance']
-    dicts = df[categorical + numerical].to_dict(orient='records')
-    return dicts
+# input/output locations; point these at local files to run without S3
+INPUT_FILE_PATTERN = os.getenv(
+    key='INPUT_FILE_PATTERN',
+    default='https://d37ci6vzurychx.cloudfront.net/trip-data/{taxi_type}_tripdata_{year:04d}-{month:02d}.parquet',
+)
+OUTPUT_FILE_PATTERN = os.getenv(
+    key='OUTPUT_FILE_PATTERN',
+    default=EVAL_S3_STORE + '/{taxi_type}_tripdata_{year:04d}-{month:02d}.parquet',
+)
+
+def get_paths(taxi_type, year, month):
+    input_file = INPUT_FILE_PATTERN.format(taxi_type=taxi_type, year=year, month=month)
+    output_file = OUTPUT_FILE_PATTERN.format(taxi_type=taxi_type, year=year, month=month)
+    return input_file, output_file
 
 @task
 def apply_model(input_file, run_id, output_file):
@@ -72,23 +57,11 @@ def apply_model(input_file, run_id, output_file):
     # y_train = df[target].values
     # y_val = df_val[target].values
 
-    dicts = prepare_dictionaries(df)
-    # dict_val = prepare_dictionaries(df_val)
     logger.info(f'loading the model with RUN_ID={run_id}...')
     model = load_model(run_id)
 
     logger.info(f'applying the model...')
-    y_pred = model.predict(dicts)
-
-    df_result = pd.DataFrame()
-    df_result['ride_id'] = df['ride_id']
-    df_result['lpep_pickup_datetime'] = df['lpep_pickup_datetime']
-    df_result['PULocationID'] = df['PULocationID']
-    df_result['DOLocationID'] = df['DOLocationID']
-    df_result['actual_duration'] = df['duration']
-    df_result['predicted_duration'] = y_pred
-    df_result['diff'] = df_result['actual_duration'] - df_result['predicted_duration']
-    df_result['model_version'] = run_id
+    df_result = score_dataframe(df, model, run_id)
     
     logger.info(f'saving the result to {output_file}...')
     df_result.to_parquet(output_file, index=False)
@@ -110,17 +83,72 @@ def ride_duration_prediction(
     year = prev_month.year
     month = prev_month.month
     # input_file = f's3://nyc-tlc/trip data/{taxi_type}_tripdata_{year:04d}-{month:02d}.parquet'
-    input_file = f'https://d37ci6vzurychx.cloudfront.net/trip-data/{taxi_type}_tripdata_{year:04d}-{month:02d}.parquet'
     # if not os.path.exists('./output'):
     #     os.mkdir('./output')
         
     # output_file = f'./output/{args.taxi_type}-{args.year:04d}-{args.month:02d}.parquet'
     
-    output_file = f'{EVAL_S3_STORE}/{taxi_type}_tripdata_{year:04d}-{month:02d}.parquet'
+    input_file, output_file = get_paths(taxi_type, year, month)
     apply_model(input_file=input_file,
                 run_id=run_id,
                 output_file=output_file)
 
+# model loaded by each backfill worker process, see init_backfill_worker
+_worker_model = None
+
+def init_backfill_worker(run_id):
+    global _worker_model
+    _worker_model = load_model(run_id)
+
+def score_month(taxi_type, year, month, run_id):
+    """Runs in a backfill worker; reuses the model loaded at worker start"""
+    input_file, output_file = get_paths(taxi_type, year, month)
+    df = read_dataframe(input_file)
+    df_result = score_dataframe(df, _worker_model, run_id)
+    df_result.to_parquet(output_file, index=False)
+    return output_file
+
+def month_range(start_date: datetime, end_date: datetime):
+    """(year, month) for every month from start_date to end_date, inclusive"""
+    current = datetime(start_date.year, start_date.month, 1)
+    while current <= end_date:
+        yield current.year, current.month
+        current += relativedelta(months=1)
+
+@flow
+def ride_duration_backfill(
+    taxi_type: str,
+    run_id: str,
+    start_date: datetime,
+    end_date: datetime,
+    max_workers: int=None):
+    """
+    Scores every month from start_date to end_date (inclusive, not shifted
+    by a month like ride_duration_prediction) over a process pool.
+    Each worker loads the model once and each month is written to its
+    own output file
+    """
+    logger = get_run_logger()
+    months = list(month_range(start_date, end_date))
+    logger.info(f'backfilling {len(months)} months with RUN_ID={run_id}...')
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=init_backfill_worker,
+        initargs=(run_id,),
+    ) as executor:
+        futures = {
+            executor.submit(score_month, taxi_type, year, month, run_id): (year, month)
+            for year, month in months
+        }
+        output_files = []
+        for future, (year, month) in futures.items():
+            output_file = future.result()
+            logger.info(f'{year:04d}-{month:02d} saved to {output_file}')
+            output_files.append(output_file)
+
+    return output_files
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -143,9 +171,38 @@ if __name__ == '__main__':
         type=str,
         default='815e49bd6e69425d977f2042f7f74c97'
     )
+    parser.add_argument(
+        '--end-year',
+        type=int,
+        default=None,
+        help='backfill every month from --year/--month up to --end-year/--end-month',
+    )
+    parser.add_argument(
+        '--end-month',
+        type=int,
+        default=12,
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        default=None,
+        help='backfill worker processes; defaults to the number of CPUs',
+    )
     args = parser.parse_args()
-    ride_duration_prediction(
-        taxi_type=args.taxi_type, 
-        run_id=args.run_id, 
-        run_date=datetime(year=args.year, month=args.month, day=1),
-    )
\ No newline at end of file
+    mlflow.set_tracking_uri(MLFLOW_URI)
+    mlflow.set_experiment("green-taxi-duration")
+
+    if args.end_year:
+        ride_duration_backfill(
+            taxi_type=args.taxi_type,
+            run_id=args.run_id,
+            start_date=datetime(year=args.year, month=args.month, day=1),
+            end_date=datetime(year=args.end_year, month=args.end_month, day=1),
+            max_workers=args.workers,
+        )
+    else:
+        ride_duration_prediction(
+            taxi_type=args.taxi_type, 
+            run_id=args.run_id, 
+            run_date=datetime(year=args.year, month=args.month, day=1),
+        )
\ No newline at end of file
@@ -0,0 +1,48 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+TRIP_COLUMNS = [
+    'lpep_pickup_datetime',
+    'lpep_dropoff_datetime',
+    'PULocationID',
+    'DOLocationID',
+    'trip_distance',
+]
+
+
+def dt(month, hour, minute, second=0):
+    return datetime(2021, month, 1, hour, minute, second)
+
+
+class FakeModel:
+    """Stands in for the pyfunc pipeline; predicts twice the distance"""
+
+    def predict(self, dicts):
+        return [2 * d['trip_distance'] for d in dicts]
+
+
+@pytest.fixture
+def fake_model():
+    return FakeModel()
+
+
+@pytest.fixture
+def write_trips():
+    """Writes a small green taxi month with 4 valid rides out of 7"""
+
+    def write(path, month=1):
+        data = [
+            (dt(month, 1, 2), dt(month, 1, 10), 1, 2, 1.5),
+            (dt(month, 1, 2), dt(month, 1, 2, 50), 1, 2, 0.1),  # < 1 min duration
+            (dt(month, 1, 5), dt(month, 1, 25), 3, None, 2.0),  # no drop off location
+            (dt(month, 2, 0), dt(month, 2, 30), 4, 5, 7.0),
+            (dt(month, 3, 0), dt(month, 4, 30), 4, 5, 30.0),  # > 60 min duration
+            (dt(month, 5, 0), dt(month, 5, 12), 6, 7, 3.2),
+            (dt(month, 6, 0), dt(month, 6, 9), 8, 9, 2.4),
+        ]
+        pd.DataFrame(data, columns=TRIP_COLUMNS).to_parquet(path, index=False)
+        return str(path)
+
+    return write
@@ -0,0 +1,21 @@
+import pandas as pd
+
+import score
+
+
+def test_chunked_output_matches_whole_file(
+    write_trips, fake_model, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(score, 'load_model', lambda run_id: fake_model)
+    trips_file = write_trips(tmp_path / 'green_tripdata_2021-01.parquet')
+    whole_file = str(tmp_path / 'whole.parquet')
+    chunked_file = str(tmp_path / 'chunked.parquet')
+
+    score.apply_model(trips_file, 'run-1', whole_file)
+    score.apply_model_chunked(trips_file, 'run-1', chunked_file, chunk_rows=2)
+
+    # ride ids are random uuids, everything else must match
+    expected = pd.read_parquet(whole_file).drop(columns='ride_id')
+    actual = pd.read_parquet(chunked_file).drop(columns='ride_id')
+    assert len(actual) == 4
+    pd.testing.assert_frame_equal(actual, expected)
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pandas as pd
+
+import score_prefect
+
+
+def test_backfill_worker_scores_local_months(
+    write_trips, fake_model, tmp_path, monkeypatch
+):
+    loaded = []
+
+    def load_model(run_id):
+        loaded.append(run_id)
+        return fake_model
+
+    monkeypatch.setattr(score_prefect, 'load_model', load_model)
+    monkeypatch.setattr(
+        score_prefect,
+        'INPUT_FILE_PATTERN',
+        str(tmp_path / 'input-{taxi_type}-{year:04d}-{month:02d}.parquet'),
+    )
+    monkeypatch.setattr(
+        score_prefect,
+        'OUTPUT_FILE_PATTERN',
+        str(tmp_path / 'output-{taxi_type}-{year:04d}-{month:02d}.parquet'),
+    )
+    for month in (1, 2):
+        write_trips(tmp_path / f'input-green-2021-{month:02d}.parquet', month)
+
+    score_prefect.init_backfill_worker('run-1')
+    output_files = [
+        score_prefect.score_month('green', 2021, month, 'run-1')
+        for _, month in score_prefect.month_range(
+            datetime(2021, 1, 15), datetime(2021, 2, 1)
+        )
+    ]
+
+    # the model is loaded once per worker, not once per month
+    assert loaded == ['run-1']
+    assert output_files == [
+        str(tmp_path / 'output-green-2021-01.parquet'),
+        str(tmp_path / 'output-green-2021-02.parquet'),
+    ]
+    for month, output_file in enumerate(output_files, start=1):
+        df_result = pd.read_parquet(output_file)
+        assert len(df_result) == 4
+        assert (df_result['lpep_pickup_datetime'].dt.month == month).all()
+        assert df_result['predicted_duration'].tolist() == [3.0, 14.0, 6.4, 4.8]
+        assert (df_result['model_version'] == 'run-1').all()
+        assert df_result['ride_id'].is_unique
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[3]
+# every week deploys its own copy of these modules, see their docstrings;
+# (source, copy) pairs
+COPIES = [
+    ('w4-deployment/batch/trip_cleaning.py', 'w2-mlflow/trip_cleaning.py'),
+    ('w4-deployment/batch/trip_cleaning.py', 'w3-prefect/trip_cleaning.py'),
+    (
+        'w4-deployment/batch/trip_cleaning.py',
+        'w5-monitor/evidently_service/trip_cleaning.py',
+    ),
+    ('w2-mlflow/batch_logging.py', 'w3-prefect/batch_logging.py'),
+    (
+        'w2-mlflow/batch_logging.py',
+        'w4-deployment/web-service-mlflow/batch_logging.py',
+    ),
+    (
+        'w2-mlflow/sparse_store.py',
+        'w4-deployment/web-service-mlflow/sparse_store.py',
+    ),
+]
+
+
+@pytest.mark.parametrize('source,copy', COPIES)
+def test_copies_are_in_sync(source, copy):
+    assert (REPO_ROOT / copy).read_text() == (REPO_ROOT / source).read_text()
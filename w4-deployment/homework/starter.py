@@ -8,8 +8,13 @@ import os
 
 import pandas as pd
 
+# the fhv files carry dispatching/affiliation columns the model never uses
+COLUMNS = ['pickup_datetime', 'dropOff_datetime', 'PUlocationID', 'DOlocationID']
+
 def read_data(filename, year, month):
-    df = pd.read_parquet(filename)
+    # rows are not filtered while reading: ride_id is built from the
+    # row position in the original file
+    df = pd.read_parquet(filename, columns=COLUMNS)
     
     df['duration'] = df.dropOff_datetime - df.pickup_datetime
     df['duration'] = df.duration.dt.total_seconds() / 60
@@ -1,2 +1,3 @@
 #!/bin/sh
-docker build -t $1 .
+# parent folder as context, so the shared model_loading.py is included
+docker build -t $1 -f Dockerfile ..
@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 # import argparse
 import logging
@@ -10,7 +11,6 @@ from pathlib import Path
 
 from flask import Flask, request, jsonify
 
-import mlflow
 # from mlflow.tracking import MlflowClient
 
 # pub client to send to a push topic that triggers a cloud function
@@ -29,12 +29,23 @@ from google.cloud import pubsub_v1
 dotenv_path = Path(__file__).resolve().parents[1] / '.env'
 load_dotenv(dotenv_path)
 
+# model_loading.py sits one level up in the repo,
+# and next to this file in the docker image
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import model_loading
+
 # load env var from .env file as if it was actually EXPORTed
 # TRACKING_IP = os.getenv('TRACKING_IP')
 # EXP_NAME = os.getenv('EXP_NAME')
 
 # only RUN_ID necessary if we're pulling directly from S3
 RUN_ID = os.getenv('RUN_ID')
+# defaults to the run's S3 artifacts, see model_loading.py;
+# can be pointed at a local model directory instead
+MODEL_URI = os.getenv('MODEL_URI')
+# optional; keeps a local copy of the model artifacts per RUN_ID so
+# restarts skip the S3 download while the run id is unchanged
+MODEL_CACHE_DIR = os.getenv('MODEL_CACHE_DIR')
 
 # pub/sub info
 PROJECT_ID = os.getenv('PROJECT_ID')
@@ -54,16 +65,17 @@ def prepare_features(ride):
     features['trip_distance'] = ride['trip_distance']
     return features
 
+def load_model():
+    return model_loading.load_model(RUN_ID, MODEL_URI, MODEL_CACHE_DIR)
+
+
 def predict(features):
     '''
     Model is now a sklearn pipeline object which combines the dict_vect
     as well as the random forest model
     '''
 
-    # full s3 path: s3://bucket_name/<exp_id>/run_id/artifacts/model
-    model_uri = f's3://mlflow-artifacts-remote-1212/3/{RUN_ID}/artifacts/model/'
-    print('loading model')
-    model = mlflow.pyfunc.load_model(model_uri=model_uri)
+    model = load_model()
     preds = model.predict(features)
     # casts from numpy to regular python type
     # to allow serialization
@@ -106,6 +118,9 @@ def receive():
 # name of our flask app
 app = Flask('duration-prediction')
 
+# warm the model before the first request arrives
+load_model()
+
 # name our route something different than our app
 # i.e. what actions it's doing
 @app.route('/predict', methods=['POST'])
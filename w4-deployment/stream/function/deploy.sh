@@ -1,4 +1,8 @@
 #!/usr/bin/env bash
+# only this folder is uploaded, so bring the shared model loading along
+cp ../model_loading.py .
+trap 'rm -f model_loading.py' EXIT
+
 gcloud functions deploy predict_duration \
     --trigger-topic $BACKEND_PUSH_STREAM \
     --env-vars-file=".env.yaml" \
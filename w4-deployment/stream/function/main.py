@@ -1,10 +1,10 @@
 import os
+import sys
 from pathlib import Path
 import json
 import base64
 from dotenv import load_dotenv
 
-import mlflow
 from google.cloud import pubsub_v1
 
 # relies on env vars being set
@@ -12,6 +12,11 @@ from google.cloud import pubsub_v1
 dotenv_path = Path(__file__).resolve().parents[1] / '.env'
 load_dotenv(dotenv_path)
 
+# model_loading.py sits one level up in the repo,
+# and is copied next to this file by deploy.sh
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import model_loading
+
 # GCP 
 PROJECT_ID = os.getenv("PROJECT_ID")
 TOPIC_NAME = os.getenv("BACKEND_PULL_STREAM")
@@ -19,6 +24,12 @@ TOPIC_NAME = os.getenv("BACKEND_PULL_STREAM")
 
 # MLflow
 RUN_ID = os.getenv('RUN_ID')
+# defaults to the run's S3 artifacts, see model_loading.py;
+# can be pointed at a local model directory instead
+MODEL_URI = os.getenv('MODEL_URI')
+# optional; keeps a local copy of the model artifacts per RUN_ID so
+# cold starts skip the S3 download while the run id is unchanged
+MODEL_CACHE_DIR = os.getenv('MODEL_CACHE_DIR')
 
 
 def prepare_features(ride):
@@ -28,16 +39,17 @@ def prepare_features(ride):
     return features
 
 
+def load_model():
+    return model_loading.load_model(RUN_ID, MODEL_URI, MODEL_CACHE_DIR)
+
+
 def predict(features):
     '''
     Model is now a sklearn pipeline object which combines the dict_vect
     as well as the random forest model
     '''
 
-    # full s3 path: s3://bucket_name/<exp_id>/run_id/artifacts/model
-    model_uri = f's3://mlflow-artifacts-remote-1212/3/{RUN_ID}/artifacts/model/'
-    print('loading model')
-    model = mlflow.pyfunc.load_model(model_uri=model_uri)
+    model = load_model()
     preds = model.predict(features)
     # casts from numpy to regular python type
     # to allow serialization
@@ -0,0 +1,67 @@
+'''
+Model loading shared by the stream backend (backend/predict.py) and the
+cloud function (function/main.py). Each deploy copies this file next to
+its entry point, see backend/Dockerfile and function/deploy.sh
+'''
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import mlflow
+
+# full s3 path: s3://bucket_name/<exp_id>/run_id/artifacts/model
+S3_MODEL_URI = 's3://mlflow-artifacts-remote-1212/3/{run_id}/artifacts/model/'
+
+
+def cache_model_artifacts(model_uri, run_id, cache_dir):
+    '''
+    Downloads the model artifacts to cache_dir/run_id unless they are
+    already there, and returns the local model path
+    '''
+    if not run_id:
+        raise ValueError('RUN_ID must be set to cache the model artifacts')
+    local_path = Path(cache_dir) / run_id
+    if local_path.exists():
+        return str(local_path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # download next to the cache entry, then rename so a partial
+    # download is never mistaken for a cached model
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        downloaded = mlflow.artifacts.download_artifacts(
+            artifact_uri=model_uri, dst_path=tmp_dir
+        )
+        try:
+            os.rename(downloaded, local_path)
+        except OSError:
+            # another process cached the same run first
+            if not local_path.exists():
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return str(local_path)
+
+
+_model = None
+
+
+def load_model(run_id, model_uri=None, cache_dir=None):
+    '''
+    Loads the model once per process (or function instance); later calls
+    reuse it. model_uri defaults to the run's S3 artifacts, and with
+    cache_dir the artifacts are kept in cache_dir/run_id so restarts skip
+    the S3 download while the run id is unchanged
+    '''
+    global _model
+    if _model is None:
+        if model_uri is None:
+            if not run_id:
+                raise ValueError('RUN_ID or MODEL_URI must be set to load the model')
+            model_uri = S3_MODEL_URI.format(run_id=run_id)
+        if cache_dir:
+            model_uri = cache_model_artifacts(model_uri, run_id, cache_dir)
+        print(f'loading model from {model_uri}')
+        _model = mlflow.pyfunc.load_model(model_uri=model_uri)
+    return _model
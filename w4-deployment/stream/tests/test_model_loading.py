@@ -0,0 +1,77 @@
+import mlflow
+import pytest
+
+import model_loading
+
+
+@pytest.fixture
+def artifact_dir(tmp_path):
+    """Stands in for the run's S3 artifacts"""
+    model_dir = tmp_path / 'artifacts' / 'model'
+    model_dir.mkdir(parents=True)
+    (model_dir / 'MLmodel').write_text('flavors: {}\n')
+    (model_dir / 'model.pkl').write_bytes(b'model')
+    return model_dir
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    calls = []
+    download_artifacts = mlflow.artifacts.download_artifacts
+
+    def counting_download(**kwargs):
+        calls.append(kwargs['artifact_uri'])
+        return download_artifacts(**kwargs)
+
+    monkeypatch.setattr(mlflow.artifacts, 'download_artifacts', counting_download)
+    return calls
+
+
+@pytest.fixture
+def no_model(monkeypatch):
+    monkeypatch.setattr(model_loading, '_model', None)
+
+
+def test_cache_skips_second_download(artifact_dir, downloads, tmp_path):
+    cache_dir = tmp_path / 'cache'
+
+    first = model_loading.cache_model_artifacts(str(artifact_dir), 'run-1', cache_dir)
+    second = model_loading.cache_model_artifacts(str(artifact_dir), 'run-1', cache_dir)
+
+    assert first == second == str(cache_dir / 'run-1')
+    assert downloads == [str(artifact_dir)]
+    assert (cache_dir / 'run-1' / 'model.pkl').read_bytes() == b'model'
+    # the temporary download folder is cleaned up
+    assert [path.name for path in cache_dir.iterdir()] == ['run-1']
+
+
+def test_load_model_once_from_cache(
+    artifact_dir, downloads, tmp_path, monkeypatch, no_model
+):
+    loaded = []
+
+    def load_model(model_uri):
+        loaded.append(model_uri)
+        return object()
+
+    # mlflow.pyfunc is lazily imported; load it first so the patch is not
+    # overwritten when it is
+    assert callable(mlflow.pyfunc.load_model)
+    monkeypatch.setattr(mlflow.pyfunc, 'load_model', load_model)
+    cache_dir = tmp_path / 'cache'
+
+    model = model_loading.load_model('run-1', str(artifact_dir), cache_dir)
+
+    assert model_loading.load_model('run-1', str(artifact_dir), cache_dir) is model
+    assert loaded == [str(cache_dir / 'run-1')]
+    assert downloads == [str(artifact_dir)]
+
+
+def test_load_model_needs_run_id(no_model):
+    with pytest.raises(ValueError, match='RUN_ID'):
+        model_loading.load_model(None)
+
+
+def test_cache_needs_run_id(artifact_dir, tmp_path):
+    with pytest.raises(ValueError, match='RUN_ID'):
+        model_loading.cache_model_artifacts(str(artifact_dir), None, tmp_path)
@@ -0,0 +1,221 @@
+"""
+Asynchronous, batched MLflow tracking for many small runs.
+
+The fluent API (mlflow.start_run, log_params, log_metric, set_tag, ...)
+makes one synchronous request to the tracking server per call, which for
+quick trials costs about as much as the training. BatchLogger queues the
+calls instead, and a background thread sends each run's params, metrics
+and tags with a single MlflowClient.log_batch request per flush:
+
+    logger = BatchLogger("random-forest-hyperopt")
+    run = logger.start_run(tags={'model': 'random-forest-regressor'})
+    logger.log_params(run, params)
+    logger.log_metric(run, 'rmse', rmse)
+    logger.end_run(run)
+    ...
+    logger.close()  # waits until everything is sent
+
+log_artifact_once uploads a file once per content hash; later runs logging
+the same file get a tag pointing at the first upload instead.
+
+Each week's folder is deployed on its own, so identical copies of this
+file live in w2-mlflow, w3-prefect and w4-deployment/web-service-mlflow;
+keep them in sync, w4-deployment/batch/tests/test_trip_cleaning.py checks
+they match.
+"""
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from mlflow.entities import Metric, Param, RunTag
+from mlflow.tracking import MlflowClient
+
+# log_batch limits of the tracking server
+MAX_PARAMS = 100
+MAX_TAGS = 100
+MAX_ENTITIES = 1000
+# seconds a queued call may wait for a batch to fill up
+FLUSH_INTERVAL = 1.0
+
+
+def new_batch():
+    return {'metrics': [], 'params': [], 'tags': []}
+
+
+class QueuedRun:
+    """Handle of a run whose creation may still be queued"""
+
+    def __init__(self):
+        self.run_id = None
+
+
+class BatchLogger:
+    def __init__(
+        self, experiment_name, client=None, flush_interval=FLUSH_INTERVAL
+    ):
+        self.client = client or MlflowClient()
+        experiment = self.client.get_experiment_by_name(experiment_name)
+        if experiment is None:
+            self.experiment_id = self.client.create_experiment(experiment_name)
+        else:
+            self.experiment_id = experiment.experiment_id
+        self.flush_interval = flush_interval
+        # content hash -> uri of the first upload
+        self._artifacts = {}
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def start_run(self, tags=None):
+        run = QueuedRun()
+        self._put('create', run, tags or {})
+        return run
+
+    def log_params(self, run, params):
+        self._put('params', run, [Param(k, str(v)) for k, v in params.items()])
+
+    def log_metric(self, run, key, value, step=0):
+        metric = Metric(key, float(value), int(time.time() * 1000), step)
+        self._put('metrics', run, [metric])
+
+    def log_metrics(self, run, metrics, step=0):
+        timestamp = int(time.time() * 1000)
+        self._put(
+            'metrics',
+            run,
+            [Metric(k, float(v), timestamp, step) for k, v in metrics.items()]
+        )
+
+    def set_tags(self, run, tags):
+        self._put('tags', run, [RunTag(k, str(v)) for k, v in tags.items()])
+
+    def log_artifact_once(self, run, local_path, artifact_path=None):
+        """Uploads local_path to the run, unless a file with the same content
+        was uploaded before; the run is then tagged with that file's uri,
+        under `artifact_uri.<name>`"""
+        digest = hashlib.sha256()
+        with open(local_path, 'rb') as f_in:
+            for chunk in iter(lambda: f_in.read(1 << 20), b''):
+                digest.update(chunk)
+        payload = (local_path, artifact_path, digest.hexdigest())
+        self._put('artifact', run, payload)
+
+    def log_model(self, run, flavor, model, artifact_path='model'):
+        """flavor.log_model without blocking: the model is saved and uploaded
+        by the background thread, e.g. log_model(run, mlflow.sklearn, rf)"""
+        self._put('model', run, (flavor, model, artifact_path))
+
+    def end_run(self, run, status='FINISHED'):
+        self._put('end', run, status)
+
+    def flush(self):
+        """Blocks until every queued call is sent"""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Sends every queued call and stops the background thread, then
+        raises the error that stopped the sending, if any"""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _put(self, kind, run, payload):
+        self._raise_error()
+        self._queue.put((kind, run, payload))
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            calls = [self._queue.get()]
+            # wait a little for more calls, so they share the requests
+            deadline = time.monotonic() + self.flush_interval
+            while calls[-1] is not None:
+                try:
+                    timeout = max(0, deadline - time.monotonic())
+                    calls.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if calls[-1] is None:
+                stopped = True
+            try:
+                if self._error is None:
+                    self._send([call for call in calls if call is not None])
+            except Exception as error:
+                # raised by the next call in the logging thread; nothing
+                # is sent after it
+                self._error = error
+            finally:
+                for _ in calls:
+                    self._queue.task_done()
+
+    def _send(self, calls):
+        # params, metrics and tags per run, in the order of the calls
+        pending = {}
+        for kind, run, payload in calls:
+            if kind == 'create':
+                run.run_id = self.client.create_run(
+                    self.experiment_id, tags=payload
+                ).info.run_id
+            elif kind in ('metrics', 'params', 'tags'):
+                pending.setdefault(run, new_batch())[kind].extend(payload)
+            elif kind == 'artifact':
+                tag = self._send_artifact(run, *payload)
+                if tag is not None:
+                    pending.setdefault(run, new_batch())['tags'].append(tag)
+            else:
+                # models and the end of the run go after the data logged before
+                self._log_batch(run, pending.pop(run, None))
+                if kind == 'model':
+                    self._send_model(run, *payload)
+                elif kind == 'end':
+                    self.client.set_terminated(run.run_id, payload)
+        for run, batch in pending.items():
+            self._log_batch(run, batch)
+
+    def _log_batch(self, run, batch):
+        if not batch:
+            return
+        metrics, params, tags = batch['metrics'], batch['params'], batch['tags']
+        while metrics or params or tags:
+            n_params = min(len(params), MAX_PARAMS)
+            n_tags = min(len(tags), MAX_TAGS)
+            n_metrics = min(len(metrics), MAX_ENTITIES - n_params - n_tags)
+            self.client.log_batch(
+                run.run_id,
+                metrics=metrics[:n_metrics],
+                params=params[:n_params],
+                tags=tags[:n_tags]
+            )
+            metrics = metrics[n_metrics:]
+            params = params[n_params:]
+            tags = tags[n_tags:]
+
+    def _send_artifact(self, run, local_path, artifact_path, digest):
+        """Uploads the file if it is new, else returns the tag referencing it"""
+        name = os.path.basename(local_path)
+        if digest in self._artifacts:
+            return RunTag(f'artifact_uri.{name}', self._artifacts[digest])
+        self.client.log_artifact(run.run_id, local_path, artifact_path)
+        path = f'{artifact_path}/{name}' if artifact_path else name
+        self._artifacts[digest] = f'runs:/{run.run_id}/{path}'
+        return None
+
+    def _send_model(self, run, flavor, model, artifact_path):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            flavor.save_model(model, os.path.join(tmp_dir, artifact_path))
+            self.client.log_artifacts(run.run_id, tmp_dir)
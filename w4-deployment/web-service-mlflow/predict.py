@@ -1,5 +1,11 @@
+import bisect
 import logging
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
 
 import mlflow
 from flask import Flask, jsonify, request
@@ -13,6 +19,246 @@ MLFLOW_TRACKING_IP = os.getenv("MLFLOW_TRACKING_IP")
 MLFLOW_EXP_NAME = os.getenv("MLFLOW_EXP_NAME")
 MLFLOW_RUN_ID = os.getenv("MLFLOW_RUN_ID")
 MLFLOW_MODEL_URI = os.getenv("MLFLOW_MODEL_URI")
+# how often a registry stage URI, e.g. models:/<name>/Production,
+# is checked for a new version
+MODEL_REFRESH_SEC = float(os.getenv("MODEL_REFRESH_SEC", "60"))
+# dynamic batching of concurrent /predict requests; off unless
+# BATCH_MAX_SIZE > 1. Needs a threaded server, e.g. gunicorn --threads
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "1"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+# a batched request predicts inline if its batch is not scored in time
+BATCH_RESULT_TIMEOUT_SEC = float(os.getenv("BATCH_RESULT_TIMEOUT_SEC", "5"))
+
+
+class ModelCache:
+    """
+    Process-wide cache for the pyfunc model, keyed by the resolved model URI.
+
+    Registry stage URIs are resolved to a concrete version at most every
+    refresh_sec; when the version changes, the new model is loaded while
+    other requests keep using the old one, then swapped in with a single
+    assignment so no request sees a half-loaded model. If the new version
+    fails to load, the old one is kept until the next check
+    """
+
+    def __init__(self, model_uri, refresh_sec=MODEL_REFRESH_SEC):
+        self.model_uri = model_uri
+        self.refresh_sec = refresh_sec
+        # (resolved model uri, model)
+        self._current = None
+        self._next_check = 0.0
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load_time_sec = {}
+
+    def resolve(self):
+        """Pins models:/<name>/<stage> (or latest) to models:/<name>/<version>"""
+        if not self.model_uri.startswith("models:/"):
+            return self.model_uri
+        name, _, stage = self.model_uri[len("models:/") :].strip("/").partition("/")
+        if stage.isdigit():
+            return self.model_uri
+
+        stages = None if stage.lower() == "latest" else [stage]
+        versions = MlflowClient().get_latest_versions(name, stages=stages)
+        if not versions:
+            # nothing to pin; let load_model report the bad uri
+            return self.model_uri
+        latest = max(versions, key=lambda version: int(version.version))
+        return f"models:/{name}/{latest.version}"
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self):
+        current = self._current
+        if current is not None and time.monotonic() < self._next_check:
+            self._count(hit=True)
+            return current[1]
+
+        with self._load_lock:
+            current = self._current
+            if current is not None and time.monotonic() < self._next_check:
+                self._count(hit=True)
+                return current[1]
+
+            # requests arriving during the check/load below keep
+            # using the current model
+            self._next_check = time.monotonic() + self.refresh_sec
+            try:
+                resolved = self.resolve()
+            except Exception:
+                if current is None:
+                    raise
+                logging.exception("Could not resolve %s", self.model_uri)
+                self._count(hit=True)
+                return current[1]
+
+            if current is not None and current[0] == resolved:
+                self._count(hit=True)
+                return current[1]
+
+            self._count(hit=False)
+            print(f"loading model {resolved}")
+            start = time.perf_counter()
+            try:
+                model = mlflow.pyfunc.load_model(model_uri=resolved)
+            except Exception:
+                if current is None:
+                    raise
+                logging.exception("Could not load %s", resolved)
+                return current[1]
+            self.load_time_sec[resolved] = time.perf_counter() - start
+            self._current = (resolved, model)
+            return model
+
+    def model_version(self):
+        """Run id of the model being served, or its resolved uri if the
+        model has no run id; None before the first load"""
+        current = self._current
+        if current is None:
+            return None
+        resolved, model = current
+        return getattr(model.metadata, "run_id", None) or resolved
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "model_uri": self.model_uri,
+                "loaded_model_uri": self._current[0] if self._current else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "load_time_sec": dict(self.load_time_sec),
+            }
+
+
+model_cache = ModelCache(MLFLOW_MODEL_URI)
+
+
+class Histogram:
+    """Cumulative bucket counts, Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def stats(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = {}
+        running = 0
+        for bound, count in zip(self.buckets + ["+Inf"], counts):
+            running += count
+            cumulative[str(bound)] = running
+        return {"buckets": cumulative, "count": running, "sum": total}
+
+
+class MicroBatcher:
+    """
+    Collects single-ride predictions from concurrent requests and runs
+    them as one model.predict call: a batch is closed once it holds
+    max_size rides or max_wait_ms after its first ride was queued.
+    Each caller blocks on its own future until the batch is scored, or
+    for at most result_timeout_sec before predicting its ride inline
+    """
+
+    def __init__(
+        self,
+        predict_batch,
+        max_size,
+        max_wait_ms,
+        result_timeout_sec=BATCH_RESULT_TIMEOUT_SEC,
+    ):
+        self.predict_batch = predict_batch
+        self.max_size = max_size
+        self.max_wait_sec = max_wait_ms / 1000
+        self.result_timeout_sec = result_timeout_sec
+        self.batch_size = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256])
+        self.queue_wait_ms = Histogram([0.5, 1, 2, 5, 10, 25, 50, 100, 250])
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="micro-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, features):
+        if self._worker.is_alive():
+            future = Future()
+            self._queue.put((features, time.monotonic(), future))
+            try:
+                return future.result(timeout=self.result_timeout_sec)
+            except FutureTimeout:
+                # the worker skips the ride if it has not taken it yet
+                future.cancel()
+                logging.warning(
+                    "batch not scored within %ss, predicting inline",
+                    self.result_timeout_sec,
+                )
+        else:
+            logging.error("batching thread is not running, predicting inline")
+        return float(self.predict_batch([features])[0])
+
+    def _next_batch(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.max_size:
+            if deadline is None:
+                item = self._queue.get()
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            # false if the caller timed out and predicts inline; once
+            # running, the future can no longer be cancelled
+            if not item[2].set_running_or_notify_cancel():
+                continue
+            if deadline is None:
+                deadline = item[1] + self.max_wait_sec
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            for _, queued_at, _ in batch:
+                self.queue_wait_ms.observe((started - queued_at) * 1000)
+            self.batch_size.observe(len(batch))
+
+            try:
+                preds = self.predict_batch([features for features, _, _ in batch])
+            except Exception as error:
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, _, future), pred in zip(batch, preds):
+                future.set_result(float(pred))
+
+    def stats(self):
+        return {
+            "max_size": self.max_size,
+            "max_wait_ms": self.max_wait_sec * 1000,
+            "batch_size": self.batch_size.stats(),
+            "queue_wait_ms": self.queue_wait_ms.stats(),
+        }
 
 
 def prepare_features(ride):
@@ -29,16 +275,31 @@ def predict(features):
     as well as the random forest model
     """
 
+    if batcher is not None:
+        return batcher.submit(features)
+
     # full s3 path: s3://bucket_name/<exp_id>/run_id/artifacts/model
-    model_uri = MLFLOW_MODEL_URI
-    print("loading model")
-    model = mlflow.pyfunc.load_model(model_uri=model_uri)
+    # loaded once per process, see ModelCache
+    model = model_cache.get()
     preds = model.predict(features)
     # casts from numpy to regular python type
     # to allow serialization
     return float(preds[0])
 
 
+def predict_many(features_list):
+    """One vectorized prediction for a list of feature dicts"""
+    model = model_cache.get()
+    return model.predict(features_list)
+
+
+batcher = (
+    MicroBatcher(predict_many, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+    if BATCH_MAX_SIZE > 1
+    else None
+)
+
+
 def save_to_db():
     """Save prediction metadata to a DB for batch monitoring"""
     pass
@@ -52,6 +313,10 @@ def send_to_evidently():
 # name of our flask app
 app = Flask("duration-prediction")
 
+# load at startup rather than on the first request
+if MLFLOW_MODEL_URI:
+    model_cache.get()
+
 # name our route something different than our app
 # i.e. what actions it's doing
 @app.route("/predict", methods=["POST"])
@@ -69,7 +334,7 @@ def predict_endpoint():
     preds = predict(features)
     result = {
         "duration": preds,
-        "model_version": MLFLOW_RUN_ID,
+        "model_version": model_cache.model_version(),
     }
     logging.info("Duration prediction made")
 
@@ -80,6 +345,20 @@ def predict_endpoint():
     return jsonify(result)
 
 
+@app.route("/model", methods=["GET"])
+def model_endpoint():
+    """Model cache status: loaded version, hit/miss counts and load times"""
+    return jsonify(model_cache.stats())
+
+
+@app.route("/batching", methods=["GET"])
+def batching_endpoint():
+    """Batch-size and queue-wait histograms of the /predict micro-batcher"""
+    if batcher is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **batcher.stats()})
+
+
 if __name__ == "__main__":
     app.run(
         debug=True,
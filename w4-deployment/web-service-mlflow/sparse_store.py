@@ -0,0 +1,51 @@
+"""
+Preprocessed datasets as plain .npy arrays, one folder per split:
+
+    <data_path>/<name>/data.npy, indices.npy, indptr.npy, y.npy, meta.json
+
+np.load(mmap_mode='r') maps the files instead of reading them, so any
+number of training or search processes on one machine share a single
+copy of the matrices through the page cache, where unpickling gave every
+process its own.
+
+Each week's folder is deployed on its own, so identical copies of this
+file live in w2-mlflow and w4-deployment/web-service-mlflow; keep them in
+sync, w4-deployment/batch/tests/test_trip_cleaning.py checks they match.
+"""
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+ARRAYS = ('data', 'indices', 'indptr')
+# the random forest fits on float32 CSC and predicts on float32 CSR
+# matrices; stored that way, sklearn uses the mapped arrays without a copy
+DTYPE = np.float32
+
+
+def save_dataset(X, y, dest_path: str, name: str, layout: str = 'csr'):
+    path = os.path.join(dest_path, name)
+    os.makedirs(path, exist_ok=True)
+    X = X.asformat(layout).astype(DTYPE)
+    X.sort_indices()
+    for array in ARRAYS:
+        np.save(os.path.join(path, f'{array}.npy'), getattr(X, array))
+    np.save(os.path.join(path, 'y.npy'), np.asarray(y))
+    with open(os.path.join(path, 'meta.json'), 'w') as f_out:
+        json.dump({'layout': layout, 'shape': list(X.shape)}, f_out)
+
+
+def load_dataset(data_path: str, name: str, mmap_mode: str = 'r'):
+    """(X, y) of a split; with mmap_mode=None the arrays are read into memory"""
+    path = os.path.join(data_path, name)
+    with open(os.path.join(path, 'meta.json')) as f_in:
+        meta = json.load(f_in)
+    arrays = tuple(
+        np.load(os.path.join(path, f'{array}.npy'), mmap_mode=mmap_mode)
+        for array in ARRAYS
+    )
+    matrix = sparse.csc_matrix if meta['layout'] == 'csc' else sparse.csr_matrix
+    X = matrix(arrays, shape=tuple(meta['shape']))
+    y = np.load(os.path.join(path, 'y.npy'), mmap_mode=mmap_mode)
+    return X, y
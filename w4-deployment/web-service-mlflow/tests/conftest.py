@@ -0,0 +1,5 @@
+import os
+
+# predict.py loads the model and starts a batcher at import when these are set
+for name in ("MLFLOW_MODEL_URI", "BATCH_MAX_SIZE"):
+    os.environ.pop(name, None)
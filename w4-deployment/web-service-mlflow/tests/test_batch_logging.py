@@ -0,0 +1,126 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import batch_logging
+from batch_logging import BatchLogger
+
+
+class FakeClient:
+    """Records the MlflowClient calls BatchLogger makes"""
+
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on
+        self.n_runs = 0
+        self.lock = threading.Lock()
+
+    def _record(self, name, run_id, **kwargs):
+        with self.lock:
+            self.calls.append((name, run_id, kwargs))
+        if name == self.fail_on:
+            raise RuntimeError(f"{name} failed")
+
+    def get_experiment_by_name(self, name):
+        return None
+
+    def create_experiment(self, name):
+        return "1"
+
+    def create_run(self, experiment_id, tags=None):
+        self.n_runs += 1
+        run_id = f"run-{self.n_runs}"
+        self._record("create_run", run_id, tags=tags)
+        return SimpleNamespace(info=SimpleNamespace(run_id=run_id))
+
+    def log_batch(self, run_id, metrics=(), params=(), tags=()):
+        self._record("log_batch", run_id, metrics=metrics, params=params, tags=tags)
+
+    def set_terminated(self, run_id, status=None):
+        self._record("set_terminated", run_id, status=status)
+
+    def calls_of(self, run_id):
+        return [
+            (name, kwargs)
+            for name, call_run_id, kwargs in self.calls
+            if call_run_id == run_id
+        ]
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+def test_params_are_split_across_log_batch_calls(client):
+    params = {f"param_{i}": i for i in range(250)}
+    with BatchLogger("experiment", client=client, flush_interval=0.01) as logger:
+        run = logger.start_run()
+        logger.log_params(run, params)
+        logger.log_metric(run, "rmse", 6.5)
+        logger.end_run(run)
+
+    batches = [
+        kwargs for name, kwargs in client.calls_of(run.run_id) if name == "log_batch"
+    ]
+    assert [len(batch["params"]) for batch in batches] == [100, 100, 50]
+    assert all(len(batch["params"]) <= batch_logging.MAX_PARAMS for batch in batches)
+    sent = [param for batch in batches for param in batch["params"]]
+    assert {param.key: param.value for param in sent} == {
+        key: str(value) for key, value in params.items()
+    }
+    assert [metric.key for batch in batches for metric in batch["metrics"]] == ["rmse"]
+
+
+def test_calls_keep_their_order_per_run(client):
+    logger = BatchLogger("experiment", client=client, flush_interval=0.01)
+    runs = [logger.start_run(tags={"trial": str(i)}) for i in range(3)]
+    for i, run in enumerate(runs):
+        logger.log_params(run, {"max_depth": i})
+    # the first run ends while the others still log
+    logger.end_run(runs[0])
+    for i, run in enumerate(runs[1:]):
+        logger.log_metric(run, "rmse", i)
+        logger.end_run(run, status="FAILED" if i else "FINISHED")
+    logger.close()
+
+    for run in runs:
+        names = [name for name, _ in client.calls_of(run.run_id)]
+        assert names[0] == "create_run"
+        assert names[-1] == "set_terminated"
+        assert set(names[1:-1]) == {"log_batch"}
+    statuses = [
+        kwargs["status"]
+        for name, kwargs in client.calls_of(runs[2].run_id)
+        if name == "set_terminated"
+    ]
+    assert statuses == ["FAILED"]
+
+
+def test_errors_are_raised_on_flush(client):
+    client.fail_on = "log_batch"
+    logger = BatchLogger("experiment", client=client, flush_interval=0.01)
+    run = logger.start_run()
+    logger.log_params(run, {"max_depth": 4})
+    logger.end_run(run)
+
+    with pytest.raises(RuntimeError, match="log_batch failed"):
+        logger.flush()
+    # nothing is sent after the error, and later calls raise it too
+    assert "set_terminated" not in [name for name, _, _ in client.calls]
+    with pytest.raises(RuntimeError, match="log_batch failed"):
+        logger.log_metric(run, "rmse", 6.5)
+    with pytest.raises(RuntimeError, match="log_batch failed"):
+        logger.close()
+    assert not logger._thread.is_alive()
+
+
+def test_errors_are_raised_on_close(client):
+    client.fail_on = "create_run"
+    logger = BatchLogger("experiment", client=client, flush_interval=0.01)
+    logger.start_run()
+
+    with pytest.raises(RuntimeError, match="create_run failed"):
+        logger.close()
+    assert not logger._thread.is_alive()
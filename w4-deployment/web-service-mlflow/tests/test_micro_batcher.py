@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from predict import MicroBatcher
+
+
+class StandInModel:
+    """predict_batch of a model predicting twice the distance; records the
+    batches the worker thread scores and can hold them until released"""
+
+    def __init__(self):
+        self.worker_batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def predict_batch(self, features_list):
+        if threading.current_thread().name == "micro-batcher":
+            self.worker_batches.append(
+                [features["trip_distance"] for features in features_list]
+            )
+            self.release.wait()
+        return [2 * features["trip_distance"] for features in features_list]
+
+
+@pytest.fixture
+def model():
+    return StandInModel()
+
+
+def submit_concurrently(batcher, distances):
+    results = {}
+
+    def submit(distance):
+        results[distance] = batcher.submit({"trip_distance": distance})
+
+    threads = [threading.Thread(target=submit, args=(d,)) for d in distances]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_batch_is_closed_at_max_size(model):
+    batcher = MicroBatcher(model.predict_batch, max_size=4, max_wait_ms=10_000)
+
+    start = time.monotonic()
+    results = submit_concurrently(batcher, [1.0, 2.0, 3.0, 4.0])
+
+    # well before max_wait_ms
+    assert time.monotonic() - start < 5
+    assert results == {1.0: 2.0, 2.0: 4.0, 3.0: 6.0, 4.0: 8.0}
+    assert [sorted(batch) for batch in model.worker_batches] == [[1.0, 2.0, 3.0, 4.0]]
+
+
+def test_batch_is_closed_at_max_wait(model):
+    batcher = MicroBatcher(model.predict_batch, max_size=100, max_wait_ms=200)
+
+    start = time.monotonic()
+    results = submit_concurrently(batcher, [1.0, 2.0, 3.0])
+
+    assert time.monotonic() - start >= 0.2
+    assert results == {1.0: 2.0, 2.0: 4.0, 3.0: 6.0}
+    assert [sorted(batch) for batch in model.worker_batches] == [[1.0, 2.0, 3.0]]
+    assert batcher.stats()["batch_size"]["count"] == 1
+
+
+def test_timeout_predicts_inline_and_skips_the_ride(model):
+    batcher = MicroBatcher(
+        model.predict_batch, max_size=10, max_wait_ms=1, result_timeout_sec=0.1
+    )
+    model.release.clear()
+
+    # the worker takes the first ride and hangs on it
+    assert batcher.submit({"trip_distance": 1.0}) == 2.0
+    # the second ride waits in the queue until its caller gives up
+    assert batcher.submit({"trip_distance": 2.0}) == 4.0
+
+    model.release.set()
+    assert batcher.submit({"trip_distance": 3.0}) == 6.0
+    # the cancelled ride was never scored by the worker
+    assert model.worker_batches == [[1.0], [3.0]]
+
+
+def test_dead_worker_predicts_inline(model):
+    def predict_batch(features_list):
+        if threading.current_thread().name == "micro-batcher":
+            # not an Exception: ends the worker thread
+            raise SystemExit
+        return model.predict_batch(features_list)
+
+    batcher = MicroBatcher(
+        predict_batch, max_size=10, max_wait_ms=1, result_timeout_sec=0.1
+    )
+
+    # the ride that killed the worker times out
+    assert batcher.submit({"trip_distance": 1.0}) == 2.0
+    batcher._worker.join(timeout=5)
+    assert not batcher._worker.is_alive()
+
+    # later rides are not queued at all
+    assert batcher.submit({"trip_distance": 2.0}) == 4.0
+    assert batcher._queue.empty()
@@ -0,0 +1,149 @@
+import time
+from types import SimpleNamespace
+
+import mlflow
+import pytest
+
+import predict
+from predict import ModelCache
+
+
+class FakeRegistry:
+    """Stands in for MlflowClient().get_latest_versions"""
+
+    def __init__(self):
+        # stage -> version numbers currently in it
+        self.stages = {"Production": ["3"], "Staging": ["4", "2"], "None": ["5"]}
+        self.error = None
+
+    def get_latest_versions(self, name, stages=None):
+        if self.error is not None:
+            raise self.error
+        return [
+            SimpleNamespace(name=name, version=version)
+            for stage in stages or self.stages
+            for version in self.stages.get(stage, [])
+        ]
+
+
+class FakeLoader:
+    """Stands in for mlflow.pyfunc.load_model; records the loaded uris"""
+
+    def __init__(self):
+        self.uris = []
+        self.error = None
+
+    def __call__(self, model_uri):
+        self.uris.append(model_uri)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(uri=model_uri, metadata=SimpleNamespace(run_id=None))
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = FakeRegistry()
+    monkeypatch.setattr(predict, "MlflowClient", lambda: registry)
+    return registry
+
+
+@pytest.fixture
+def loader(monkeypatch):
+    loader = FakeLoader()
+    # mlflow.pyfunc is imported lazily; import it before patching
+    assert mlflow.pyfunc.load_model
+    monkeypatch.setattr(mlflow.pyfunc, "load_model", loader)
+    return loader
+
+
+@pytest.mark.parametrize(
+    "model_uri,resolved",
+    [
+        ("models:/duration/Production", "models:/duration/3"),
+        ("models:/duration/Staging", "models:/duration/4"),
+        ("models:/duration/latest", "models:/duration/5"),
+        ("models:/duration/7", "models:/duration/7"),
+        # no version in the stage: left for load_model to report
+        ("models:/duration/Archived", "models:/duration/Archived"),
+        ("runs:/abc123/model", "runs:/abc123/model"),
+        (
+            "s3://bucket/1/abc123/artifacts/model",
+            "s3://bucket/1/abc123/artifacts/model",
+        ),
+    ],
+)
+def test_resolve(registry, model_uri, resolved):
+    assert ModelCache(model_uri).resolve() == resolved
+
+
+def test_version_uris_skip_the_registry(registry):
+    registry.error = AssertionError("the registry should not be asked")
+    assert ModelCache("models:/duration/7").resolve() == "models:/duration/7"
+
+
+def test_get_loads_once_until_refresh(registry, loader):
+    cache = ModelCache("models:/duration/Production", refresh_sec=3600)
+
+    model = cache.get()
+    assert model.uri == "models:/duration/3"
+    # a new version within refresh_sec is not picked up
+    registry.stages["Production"] = ["6"]
+    assert cache.get() is model
+    assert cache.get() is model
+
+    assert loader.uris == ["models:/duration/3"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["loaded_model_uri"] == "models:/duration/3"
+    assert list(stats["load_time_sec"]) == ["models:/duration/3"]
+
+
+def test_get_refreshes_after_refresh_sec(registry, loader):
+    cache = ModelCache("models:/duration/Production", refresh_sec=0.05)
+    first = cache.get()
+
+    # same version: checked again, but not reloaded
+    time.sleep(0.06)
+    assert cache.get() is first
+    assert loader.uris == ["models:/duration/3"]
+
+    registry.stages["Production"] = ["6"]
+    time.sleep(0.06)
+    assert cache.get().uri == "models:/duration/6"
+    assert loader.uris == ["models:/duration/3", "models:/duration/6"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_get_keeps_the_model_when_resolve_fails(registry, loader):
+    cache = ModelCache("models:/duration/Production", refresh_sec=0)
+    model = cache.get()
+
+    registry.error = ConnectionError("registry down")
+    assert cache.get() is model
+    assert loader.uris == ["models:/duration/3"]
+
+
+def test_get_keeps_the_model_when_load_fails(registry, loader):
+    cache = ModelCache("models:/duration/Production", refresh_sec=0)
+    model = cache.get()
+
+    registry.stages["Production"] = ["6"]
+    loader.error = OSError("artifact store down")
+    assert cache.get() is model
+    assert cache.stats()["loaded_model_uri"] == "models:/duration/3"
+
+    # tried again at the next check
+    loader.error = None
+    assert cache.get().uri == "models:/duration/6"
+
+
+def test_first_get_raises(registry, loader):
+    registry.error = ConnectionError("registry down")
+    with pytest.raises(ConnectionError):
+        ModelCache("models:/duration/Production").get()
+
+    registry.error = None
+    loader.error = OSError("artifact store down")
+    with pytest.raises(OSError):
+        ModelCache("models:/duration/Production").get()
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+import sparse_store
+
+
+def is_mapped(array):
+    """Whether the array is a view of a memory-mapped file"""
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+@pytest.fixture
+def dataset():
+    X = sparse.random(
+        50, 30, density=0.2, format="coo", dtype=np.float64, random_state=0
+    )
+    y = np.random.default_rng(0).normal(15, 5, size=50)
+    return X, y
+
+
+@pytest.mark.parametrize("layout", ["csr", "csc"])
+def test_save_then_load_round_trip(tmp_path, dataset, layout):
+    X, y = dataset
+    sparse_store.save_dataset(X, y, str(tmp_path), "train", layout=layout)
+
+    loaded_X, loaded_y = sparse_store.load_dataset(str(tmp_path), "train")
+
+    assert loaded_X.format == layout
+    assert loaded_X.shape == X.shape
+    assert loaded_X.dtype == np.float32
+    assert loaded_X.has_sorted_indices
+    np.testing.assert_array_equal(loaded_X.toarray(), X.toarray().astype(np.float32))
+    np.testing.assert_array_equal(loaded_y, y)
+    # the matrices use the mapped files without a copy
+    for array in sparse_store.ARRAYS:
+        assert is_mapped(getattr(loaded_X, array))
+    assert is_mapped(loaded_y)
+
+
+def test_load_into_memory(tmp_path, dataset):
+    X, y = dataset
+    sparse_store.save_dataset(X, y, str(tmp_path), "val")
+
+    loaded_X, loaded_y = sparse_store.load_dataset(str(tmp_path), "val", mmap_mode=None)
+
+    assert loaded_X.dtype == np.float32
+    np.testing.assert_array_equal(loaded_X.toarray(), X.toarray().astype(np.float32))
+    assert not any(is_mapped(getattr(loaded_X, a)) for a in sparse_store.ARRAYS)
+    assert not is_mapped(loaded_y)
@@ -10,7 +10,11 @@ from hyperopt.pyll import scope
 
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
-  
+
+from batch_logging import BatchLogger
+from sparse_store import load_dataset
+
+
 def load_pickle(filename: str):
     with open(filename, "rb") as f_in:
         return pickle.load(f_in)
@@ -19,8 +23,8 @@ def load_pickle(filename: str):
 def run(data_path, tracking_uri, num_trials):
 
     dv = load_pickle(data_path / 'dv.pkl')
-    X_train, y_train = load_pickle(data_path / 'train.pkl')
-    X_valid, y_valid = load_pickle(data_path / 'valid.pkl')
+    X_train, y_train = load_dataset(data_path, 'train')
+    X_valid, y_valid = load_dataset(data_path, 'valid')
 
     if tracking_uri:
         mlflow.set_tracking_uri(tracking_uri)
@@ -28,29 +32,33 @@ def run(data_path, tracking_uri, num_trials):
         mlflow.set_tracking_uri("sqlite:///mlflow.db")
 
     mlflow.set_experiment("nyc-taxi-experiment")
-    
+    # trial runs are sent to MLflow in batches, from a background thread
+    logger = BatchLogger("nyc-taxi-experiment")
+
+    # the same for every trial: written once, and uploaded with the first run
+    with open(data_path / 'dict_vectorizer.bin', 'wb') as f_out:
+        pickle.dump(dv, f_out)
+
     # mlflow.sklearn.autolog()
     def objective(params):
-        with mlflow.start_run():
-            mlflow.set_tags(
-                {'estimator_name':'RandomForestRegressor',
-                 'estimator_class':'sklearn.ensemble._forest.RandomForestRegressor'}
-            )
-            mlflow.log_params(params)
-
-            rf = RandomForestRegressor(**params)
-            rf.fit(X_train, y_train)
-
-            mlflow.sklearn.log_model(rf, artifact_path='model')
-            y_pred = rf.predict(X_valid)
-            rmse = mean_squared_error(y_valid, y_pred, squared=False)
-            mlflow.log_metric('rmse', rmse)
-
-            with open(data_path / 'dict_vectorizer.bin', 'wb') as f_out:
-                pickle.dump(dv, f_out)
-            
-            # accepts str path only
-            mlflow.log_artifact(str(data_path / 'dict_vectorizer.bin'))
+        run = logger.start_run(tags={
+            'estimator_name':'RandomForestRegressor',
+            'estimator_class':'sklearn.ensemble._forest.RandomForestRegressor'
+        })
+        logger.log_params(run, params)
+
+        rf = RandomForestRegressor(**params)
+        rf.fit(X_train, y_train)
+
+        # saved and uploaded in the background
+        logger.log_model(run, mlflow.sklearn, rf, artifact_path='model')
+        y_pred = rf.predict(X_valid)
+        rmse = mean_squared_error(y_valid, y_pred, squared=False)
+        logger.log_metric(run, 'rmse', rmse)
+
+        # accepts str path only
+        logger.log_artifact_once(run, str(data_path / 'dict_vectorizer.bin'))
+        logger.end_run(run)
 
         return {'loss': rmse, 'status': STATUS_OK}
 
@@ -64,14 +72,15 @@ def run(data_path, tracking_uri, num_trials):
 
     rstate = np.random.default_rng(42)  # for reproducible results
 
-    fmin(
-        fn=objective,
-        space=search_space,
-        algo=tpe.suggest,
-        max_evals=num_trials,
-        trials=Trials(),
-        rstate=rstate
-    )
+    with logger:
+        fmin(
+            fn=objective,
+            space=search_space,
+            algo=tpe.suggest,
+            max_evals=num_trials,
+            trials=Trials(),
+            rstate=rstate
+        )
 
 if __name__ == '__main__':
 
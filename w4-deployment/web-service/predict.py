@@ -1,3 +1,4 @@
+import json
 import pickle
 
 import logging
@@ -20,6 +21,22 @@ def predict(features):
     # to allow serialization
     return float(preds[0])
 
+def predict_batch(features):
+    # one transform/predict call for the whole list of rides
+    X = dv.transform(features)
+    preds = model.predict(X)
+    return [float(pred) for pred in preds]
+
+def read_rides():
+    '''Rides from a JSON array or a newline-delimited JSON request body'''
+    rides = request.get_json(silent=True)
+    if rides is None:
+        body = request.get_data(as_text=True)
+        rides = [json.loads(line) for line in body.splitlines() if line.strip()]
+    elif isinstance(rides, dict):
+        rides = [rides]
+    return rides
+
 # name of our flask app
 app = Flask('duration-prediction')
 
@@ -47,6 +64,22 @@ def predict_endpoint():
     # jsonify improves upon json.dumps
     return jsonify(result)
 
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch_endpoint():
+    '''Same as /predict for many rides at once;
+    durations are returned in the order the rides were sent
+    '''
+    rides = read_rides()
+    logging.info('Received batch of %d rides', len(rides))
+
+    features = [prepare_features(ride) for ride in rides]
+    preds = predict_batch(features) if features else []
+    result = {
+        'durations': preds
+    }
+
+    return jsonify(result)
+
 if __name__ == '__main__':
     app.run(debug=True, 
             host='0.0.0.0', # expose port on all interfaces
@@ -0,0 +1,218 @@
+"""
+MongoDB, reference scoring and Evidently steps shared by the batch
+monitoring flows, prefect_example.py and
+homework/prefect-monitoring/prefect_monitoring.py. They take a
+collection, files or pipeline objects rather than addresses, so they
+can be tested with mongomock, temporary files and stand-in pipelines.
+"""
+import hashlib
+import os
+import pickle
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bson import ObjectId
+from pymongo import UpdateOne
+
+# target updates per bulk_write round trip
+UPLOAD_BATCH_SIZE = 5000
+# documents per cursor batch, and per Arrow record batch
+FETCH_BATCH_SIZE = 10000
+# the prediction fields run_evidently reads; nothing else leaves MongoDB
+MONITORED_SCHEMA = pa.schema(
+    [
+        ("PULocationID", pa.int64()),
+        ("DOLocationID", pa.int64()),
+        ("trip_distance", pa.float64()),
+        ("prediction", pa.float64()),
+        ("target", pa.float64()),
+    ]
+)
+
+
+def to_record_batch(documents, schema):
+    columns = [
+        # inferred first, so e.g. an int trip_distance still casts to double
+        pa.array([document.get(field.name) for document in documents]).cast(field.type)
+        for field in schema
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def fetch_predictions(
+    collection, start, end, schema=MONITORED_SCHEMA, batch_size=FETCH_BATCH_SIZE
+):
+    """
+    Predictions inserted in [start, end) as an Arrow table with `schema`.
+    The window is a range on _id, which is always indexed and whose
+    ObjectId embeds the insertion time; only the schema's fields are
+    projected, and at most batch_size documents are held as dicts at once
+    """
+    query = {
+        "_id": {
+            "$gte": ObjectId.from_datetime(start),
+            "$lt": ObjectId.from_datetime(end),
+        }
+    }
+    projection = {name: 1 for name in schema.names}
+    projection["_id"] = 0
+    cursor = collection.find(query, projection, batch_size=batch_size)
+
+    batches = []
+    documents = []
+    for document in cursor:
+        documents.append(document)
+        if len(documents) == batch_size:
+            batches.append(to_record_batch(documents, schema))
+            documents = []
+    if documents:
+        batches.append(to_record_batch(documents, schema))
+    return pa.Table.from_batches(batches, schema=schema)
+
+
+def upload_targets(collection, filename, batch_size=UPLOAD_BATCH_SIZE):
+    """
+    Sets `target` on the prediction documents listed in an `id,duration`
+    csv. The file is streamed and sent as unordered UpdateOne batches of
+    batch_size, one round trip each; returns the number of rows
+    """
+    # without it, every update scans the whole collection
+    collection.create_index("id")
+    start = time.perf_counter()
+    n_rows = 0
+    operations = []
+    with open(filename) as f_target:
+        for line in f_target:
+            if not line.strip():
+                continue
+            ride_id, target = line.rstrip("\n").split(",")
+            operations.append(
+                UpdateOne({"id": ride_id}, {"$set": {"target": float(target)}})
+            )
+            if len(operations) == batch_size:
+                collection.bulk_write(operations, ordered=False)
+                n_rows += len(operations)
+                operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        n_rows += len(operations)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"uploaded {n_rows} targets in {elapsed:.1f}s"
+        f" ({n_rows / max(elapsed, 1e-9):.0f} rows/s)"
+    )
+    return n_rows
+
+
+def calculate_pipelines(pipelines, reference_data, current_data, column_mapping):
+    """
+    Same as calling .calculate on each Evidently pipeline (Profile,
+    Dashboard), but every analyzer runs once and all pipelines' sections
+    and tabs are built from the shared results, as Pipeline.execute does
+    within one pipeline. Returns the seconds spent per analyzer and section.
+
+    The analyzers are shared, so the pipelines must be built with the same
+    options; otherwise a ValueError is raised and they should be calculated
+    separately. Relies on Pipeline internals of evidently 0.1.5x
+    """
+    options_provider = pipelines[0].options_provider
+    for pipeline in pipelines[1:]:
+        # OptionsProvider has no __eq__, its options are dataclasses
+        # pylint: disable=protected-access
+        if pipeline.options_provider._options != options_provider._options:
+            raise ValueError(
+                f"{type(pipeline).__name__} has different options than"
+                f" {type(pipelines[0]).__name__}, calculate them separately"
+            )
+
+    timings = {}
+    rdata = reference_data.copy()
+    cdata = current_data.copy()
+    # dict keeps the first-seen order, unlike a set
+    analyzers = dict.fromkeys(
+        analyzer for pipeline in pipelines for analyzer in pipeline.get_analyzers()
+    )
+    results = {}
+    for analyzer in analyzers:
+        start = time.perf_counter()
+        instance = analyzer()
+        instance.options_provider = options_provider
+        results[analyzer] = instance.calculate(rdata, cdata, column_mapping)
+        timings[analyzer.__name__] = time.perf_counter() - start
+
+    for pipeline in pipelines:
+        pipeline.analyzers_results = results
+        for stage in pipeline.stages:
+            start = time.perf_counter()
+            stage.options_provider = pipeline.options_provider
+            stage.calculate(rdata.copy(), cdata.copy(), column_mapping, results)
+            name = f"{type(pipeline).__name__}.{type(stage).__name__}"
+            timings[name] = time.perf_counter() - start
+    return timings
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f_in:
+        for chunk in iter(lambda: f_in.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scored_reference_path(filename, model_file, cache_dir, *params):
+    """Cache file for the reference scored by model_file; either file, or
+    a preparation parameter, changing gives a new name, so stale
+    predictions are never reused"""
+    digest = hashlib.sha256()
+    digest.update(file_sha256(filename).encode())
+    digest.update(file_sha256(model_file).encode())
+    digest.update(repr(params).encode())
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, f"{name}-{digest.hexdigest()[:16]}.parquet")
+
+
+def score_reference(filename, model_file, sample_size=None):
+    """Reference rides with the duration target and the model's
+    predictions; sample_size rows are drawn with a fixed seed if given"""
+    with open(model_file, "rb") as f_in:
+        dv, model = pickle.load(f_in)
+    reference_data = pq.read_table(filename).to_pandas()
+    if sample_size is not None:
+        reference_data = reference_data.sample(n=sample_size, random_state=42)
+    # Create features
+    reference_data["PU_DO"] = (
+        reference_data["PULocationID"].astype(str)
+        + "_"
+        + reference_data["DOLocationID"].astype(str)
+    )
+
+    # add target column
+    reference_data["target"] = (
+        reference_data.lpep_dropoff_datetime - reference_data.lpep_pickup_datetime
+    ).dt.total_seconds() / 60
+    reference_data = reference_data[
+        (reference_data.target >= 1) & (reference_data.target <= 60)
+    ]
+    features = ["PU_DO", "PULocationID", "DOLocationID", "trip_distance"]
+    x_pred = dv.transform(reference_data[features].to_dict(orient="records"))
+    reference_data["prediction"] = model.predict(x_pred)
+    return reference_data
+
+
+def load_scored_reference(filename, model_file, cache_dir, sample_size=None):
+    """score_reference, cached in cache_dir until the reference file, the
+    model file or sample_size changes"""
+    path = scored_reference_path(filename, model_file, cache_dir, sample_size)
+    if os.path.exists(path):
+        print(f"using scored reference {path}")
+        return pd.read_parquet(path)
+
+    reference_data = score_reference(filename, model_file, sample_size)
+    os.makedirs(cache_dir, exist_ok=True)
+    # renamed into place, so an interrupted run leaves no partial file
+    reference_data.to_parquet(f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    return reference_data
@@ -9,12 +9,18 @@ The service gets a reference dataset from reference.csv file and process current
 
 Metrics calculation results are available with `GET /metrics` HTTP method in Prometheus compatible format.
 """
+import atexit
 import dataclasses
-import datetime
+import glob
 import hashlib
+import itertools
 import logging
+import multiprocessing
 import os
-from typing import Dict, List, Optional
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
 
 import flask
 import pandas as pd
@@ -33,9 +39,15 @@ from evidently.model_monitoring import (
 from evidently.pipeline.column_mapping import ColumnMapping
 from evidently.runner.loader import DataLoader, DataOptions
 from flask import Flask
-from pyarrow import parquet as pq
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 
+from drift_stats import FeatureSketch, IncrementalDrift, build_sketches
+from reference_cache import CACHE_SUBDIR, load_reference, prepare_reference
+from ring_buffer import RingBuffer, window_columns
+from sampling import DEFAULT_STRATA, sample_reference
+
 app = Flask(__name__)
 
 logging.basicConfig(
@@ -44,10 +56,24 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()],
 )
 
+# set in the environment to run one worker process per dataset, see
+# `worker_processes`; prometheus_client reads it when it is imported
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# /iterate batches queued per worker process before requests block
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "100"))
+
+
+def metrics_app():
+    if PROMETHEUS_MULTIPROC_DIR is None:
+        return prometheus_client.make_wsgi_app()
+    # aggregates the metric files of every process at scrape time
+    registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return prometheus_client.make_wsgi_app(registry)
+
+
 # Add prometheus wsgi middleware to route /metrics requests
-app.wsgi_app = DispatcherMiddleware(
-    app.wsgi_app, {"/metrics": prometheus_client.make_wsgi_app()}
-)
+app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {"/metrics": metrics_app()})
 
 
 @dataclasses.dataclass
@@ -58,6 +84,25 @@ class MonitoringServiceOptions:
     moving_reference: bool
     window_size: int
     calculation_period_sec: int
+    # "evidently" runs DataDriftMonitor over the full frames every period,
+    # "incremental" computes the same data drift metrics from drift_stats sketches
+    drift_engine: str = "evidently"
+    # keep prepared references under <datasets_path>/.reference_cache,
+    # see reference_cache.py
+    reference_cache: bool = True
+    # one worker process per dataset instead of one thread each in the
+    # Flask process; requires PROMETHEUS_MULTIPROC_DIR
+    worker_processes: bool = False
+    # "full", or "reservoir" / "stratified" samples of reference_sample_size
+    # rows, so the calculation cost does not grow with the reference file
+    reference_sample: str = "full"
+    reference_sample_size: int = 50000
+    # with moving_reference, rows that left the window the reference keeps
+    moving_reference_size: int = 50000
+    # columns the stratified sample keeps in proportion
+    reference_strata: List[str] = dataclasses.field(
+        default_factory=lambda: list(DEFAULT_STRATA)
+    )
 
 
 @dataclasses.dataclass
@@ -66,6 +111,8 @@ class LoadedDataset:
     references: pd.DataFrame
     monitors: List[str]
     column_mapping: ColumnMapping
+    # reference sketches, set when the incremental drift engine is used
+    sketches: Optional[List[FeatureSketch]] = None
 
 
 EVIDENTLY_MONITORS_MAPPING = {
@@ -79,88 +126,247 @@ EVIDENTLY_MONITORS_MAPPING = {
 }
 
 
+class StalenessCollector:
+    """Seconds since each dataset's exported metrics last matched its window,
+    computed at scrape time so it keeps growing while a calculation hangs"""
+
+    def __init__(self, service: "MonitoringService"):
+        self.service = service
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            "evidently_metrics_staleness_seconds",
+            "Seconds since the metrics of a dataset last reflected its current window",
+            labels=["dataset_name"],
+        )
+        now = time.time()
+        for dataset_name, fresh_at in self.service.fresh_at.items():
+            if fresh_at is not None:
+                gauge.add_metric([dataset_name], now - fresh_at)
+        yield gauge
+
+
 class MonitoringService:
     # names of monitoring datasets
     datasets: List[str]
     metric: Dict[str, prometheus_client.Gauge]
-    last_run: Optional[datetime.datetime]
-    # collection of reference data
-    reference: Dict[str, pd.DataFrame]
-    # collection of current data
-    current: Dict[str, Optional[pd.DataFrame]]
+    # collection of reference data; a RingBuffer of the rows that left the
+    # current window when the reference is moving
+    reference: Dict[str, Union[pd.DataFrame, RingBuffer]]
+    # collection of current data windows
+    current: Dict[str, RingBuffer]
     # collection of monitoring objects
-    monitoring: Dict[str, ModelMonitoring]
-    calculation_period_sec: float = 15
+    monitoring: Dict[str, Optional[ModelMonitoring]]
+    # incremental data drift, for datasets using that engine
+    drift: Dict[str, IncrementalDrift]
+    # guards the window and drift counts of each dataset; /iterate holds it
+    # while appending, the calculation thread only while taking a snapshot
+    locks: Dict[str, threading.Lock]
+    # rows appended so far, to skip calculations when nothing changed
+    rows_seen: Dict[str, int]
+    # time.time() at which the exported metrics last matched the window
+    fresh_at: Dict[str, Optional[float]]
+    calculation_period_sec: float
     window_size: int
+    # no calculation while the reference has fewer rows
+    min_reference_size: int
 
-    def __init__(self, datasets: Dict[str, LoadedDataset], window_size: int):
+    def __init__(
+        self,
+        datasets: Dict[str, LoadedDataset],
+        window_size: int,
+        calculation_period_sec: float = 15,
+        min_reference_size: int = 0,
+        moving_reference_size: Optional[int] = None,
+    ):
         self.reference = {}
         self.monitoring = {}
+        self.drift = {}
         self.current = {}
         self.column_mapping = {}
+        self.locks = {}
+        self.rows_seen = {}
+        self.fresh_at = {}
         self.window_size = window_size
+        self.calculation_period_sec = calculation_period_sec
+        self.min_reference_size = min_reference_size
 
         for dataset_info in datasets.values():
+            columns = window_columns(dataset_info.column_mapping)
             self.reference[dataset_info.name] = dataset_info.references
-            self.monitoring[dataset_info.name] = ModelMonitoring(
-                monitors=[
-                    EVIDENTLY_MONITORS_MAPPING[k]() for k in dataset_info.monitors
-                ],
-                options=[],
+            if moving_reference_size is not None:
+                # bounded: the oldest reference rows make way for newer ones
+                reference = RingBuffer(columns, moving_reference_size)
+                reference.append(dataset_info.references)
+                self.reference[dataset_info.name] = reference
+            monitors = list(dataset_info.monitors)
+            if dataset_info.sketches is not None:
+                # data drift comes from the sketches instead of Evidently
+                if "data_drift" in monitors:
+                    monitors.remove("data_drift")
+                self.drift[dataset_info.name] = IncrementalDrift(
+                    dataset_info.sketches,
+                    window_size,
+                    moving_reference_size=moving_reference_size,
+                    reference=dataset_info.references,
+                )
+            self.monitoring[dataset_info.name] = (
+                ModelMonitoring(
+                    monitors=[EVIDENTLY_MONITORS_MAPPING[k]() for k in monitors],
+                    options=[],
+                )
+                if monitors
+                else None
             )
             self.column_mapping[dataset_info.name] = dataset_info.column_mapping
+            self.current[dataset_info.name] = RingBuffer(columns, window_size)
+            self.locks[dataset_info.name] = threading.Lock()
+            self.rows_seen[dataset_info.name] = 0
+            self.fresh_at[dataset_info.name] = None
 
         self.metrics = {}
-        self.next_run_time = {}
-
-    def iterate(self, dataset_name: str, new_rows: pd.DataFrame):
-        """Add data to current dataset for specified dataset"""
-        window_size = self.window_size
+        self._metrics_lock = threading.Lock()
+        # livesum: every dataset is written by a single process, and the
+        # values of processes that exited are dropped
+        self.calculation_duration = prometheus_client.Gauge(
+            "evidently_calculation_duration_seconds",
+            "Wall time of the last metrics calculation",
+            ["dataset_name"],
+            multiprocess_mode="livesum",
+        )
+        self.staleness = None
+        if PROMETHEUS_MULTIPROC_DIR is None:
+            prometheus_client.REGISTRY.register(StalenessCollector(self))
+        else:
+            # collectors are not shared between processes; set by export_staleness
+            self.staleness = prometheus_client.Gauge(
+                "evidently_metrics_staleness_seconds",
+                "Seconds since the metrics of a dataset last reflected its current window",
+                ["dataset_name"],
+                multiprocess_mode="livesum",
+            )
 
-        if dataset_name in self.current:
-            current_data = self.current[dataset_name].append(
-                new_rows, ignore_index=True
+        self._stop = threading.Event()
+        self._workers = [
+            threading.Thread(
+                target=self._run,
+                args=(dataset_name,),
+                name=f"{dataset_name}-metrics",
+                daemon=True,
             )
+            for dataset_name in self.current
+        ]
 
-        else:
-            current_data = new_rows
+    def start(self):
+        """Starts one calculation thread per dataset"""
+        for worker in self._workers:
+            worker.start()
 
-        current_size = current_data.shape[0]
+    def stop(self):
+        self._stop.set()
+        for worker in self._workers:
+            worker.join()
 
-        if current_size > self.window_size:
-            # cut current_size by window size value
-            current_data.drop(
-                index=list(range(0, current_size - self.window_size)), inplace=True
+    def iterate(self, dataset_name: str, new_rows: pd.DataFrame):
+        """Add data to current dataset for specified dataset; metrics are
+        calculated separately, every calculation_period_sec"""
+        # O(len(new_rows)); the oldest rows past window_size are overwritten
+        with self.locks[dataset_name]:
+            evicted = self.current[dataset_name].append(new_rows)
+            reference = self.reference[dataset_name]
+            if evicted is not None and isinstance(reference, RingBuffer):
+                reference.append(pd.DataFrame(evicted))
+            if dataset_name in self.drift:
+                self.drift[dataset_name].update(new_rows)
+            self.rows_seen[dataset_name] += len(new_rows)
+
+    def _snapshot(self, dataset_name: str):
+        """Copy of the reference, the window and the incremental drift metrics,
+        taken under the dataset lock; None if the window is not full yet or
+        the reference is smaller than min_reference_size"""
+        with self.locks[dataset_name]:
+            current = self.current[dataset_name]
+            if current.size < self.window_size:
+                logging.info(
+                    f"Not enough data for measurement: {current.size} of {self.window_size}."
+                    f" Waiting more data"
+                )
+                return None
+            reference = self.reference[dataset_name]
+            reference_size = (
+                reference.size if isinstance(reference, RingBuffer) else len(reference)
             )
-            current_data.reset_index(drop=True, inplace=True)
-
-        self.current[dataset_name] = current_data
-
-        if current_size < window_size:
-            logging.info(
-                f"Not enough data for measurement: {current_size} of {window_size}."
-                f" Waiting more data"
+            if reference_size < self.min_reference_size:
+                logging.info(
+                    "Not enough reference data for %s: %s of %s",
+                    dataset_name,
+                    reference_size,
+                    self.min_reference_size,
+                )
+                return None
+
+            window = None
+            if self.monitoring[dataset_name] is not None:
+                # the buffers keep changing once the lock is released
+                window = current.window().copy()
+                if isinstance(reference, RingBuffer):
+                    reference = reference.window().copy()
+            drift_metrics = []
+            if dataset_name in self.drift:
+                drift_metrics = list(self.drift[dataset_name].metrics())
+            return self.rows_seen[dataset_name], reference, window, drift_metrics
+
+    def calculate(self, dataset_name: str, rows_seen: Optional[int] = None):
+        """Runs the monitors on a snapshot of the window and exports the results.
+        Returns the number of rows appended up to that snapshot"""
+        started = time.time()
+        snapshot = self._snapshot(dataset_name)
+        if snapshot is None:
+            return rows_seen
+        snapshot_rows_seen, reference, window, drift_metrics = snapshot
+        if snapshot_rows_seen == rows_seen:
+            # no new rows, the exported metrics are still current
+            self.fresh_at[dataset_name] = started
+            return rows_seen
+
+        metrics = [drift_metrics]
+        monitoring = self.monitoring[dataset_name]
+        if monitoring is not None:
+            monitoring.execute(
+                reference,
+                window,
+                self.column_mapping[dataset_name],
             )
-            return
+            metrics.append(monitoring.metrics())
+        self._export_metrics(dataset_name, itertools.chain(*metrics))
 
-        next_run_time = self.next_run_time.get(dataset_name)
+        self.calculation_duration.labels(dataset_name=dataset_name).set(
+            time.time() - started
+        )
+        self.fresh_at[dataset_name] = started
+        return snapshot_rows_seen
 
-        if next_run_time is not None and next_run_time > datetime.datetime.now():
-            logging.info("Next run for dataset %s at %s", dataset_name, next_run_time)
+    def export_staleness(self):
+        """Updates the staleness gauge when metrics go through multiprocess files"""
+        if self.staleness is None:
             return
+        now = time.time()
+        for dataset_name, fresh_at in self.fresh_at.items():
+            if fresh_at is not None:
+                self.staleness.labels(dataset_name=dataset_name).set(now - fresh_at)
+
+    def _run(self, dataset_name: str):
+        rows_seen = None
+        while not self._stop.wait(self.calculation_period_sec):
+            try:
+                rows_seen = self.calculate(dataset_name, rows_seen)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Metrics calculation failed for %s", dataset_name)
+            self.export_staleness()
 
-        self.next_run_time[dataset_name] = datetime.datetime.now() + datetime.timedelta(
-            seconds=self.calculation_period_sec
-        )
-        self.monitoring[dataset_name].execute(
-            self.reference[dataset_name],
-            current_data,
-            self.column_mapping[dataset_name],
-        )
-
-        for metric, value, labels in self.monitoring[dataset_name].metrics():
+    def _export_metrics(self, dataset_name: str, metrics):
+        for metric, value, labels in metrics:
             metric_key = f"evidently:{metric.name}"
-            found = self.metrics.get(metric_key)
 
             if not labels:
                 labels = {}
@@ -170,11 +376,16 @@ class MonitoringService:
             if isinstance(value, str):
                 continue
 
-            if found is None:
-                found = prometheus_client.Gauge(
-                    metric_key, "", list(sorted(labels.keys()))
-                )
-                self.metrics[metric_key] = found
+            with self._metrics_lock:
+                found = self.metrics.get(metric_key)
+                if found is None:
+                    found = prometheus_client.Gauge(
+                        metric_key,
+                        "",
+                        list(sorted(labels.keys())),
+                        multiprocess_mode="livesum",
+                    )
+                    self.metrics[metric_key] = found
 
             try:
                 found.labels(**labels).set(value)
@@ -185,9 +396,128 @@ class MonitoringService:
 
 
 SERVICE: Optional[MonitoringService] = None
+# dataset name -> (worker process, queue of new rows), with worker_processes
+WORKERS: Dict[str, Tuple[multiprocessing.Process, multiprocessing.Queue]] = {}
+
+
+def load_dataset(
+    dataset_name: str, dataset_options: dict, options: MonitoringServiceOptions
+) -> LoadedDataset:
+    reference_file = dataset_options["reference_file"]
+    logging.info(
+        f"Load reference data for dataset {dataset_name} from {reference_file}"
+    )
+    column_mapping = ColumnMapping(**dataset_options["column_mapping"])
+    if options.reference_cache:
+        reference_data, sketches = load_reference(
+            reference_file,
+            column_mapping,
+            os.path.join(options.datasets_path, CACHE_SUBDIR),
+        )
+    else:
+        reference_data = prepare_reference(reference_file, column_mapping)
+        sketches = build_sketches(reference_data, column_mapping)
+    if options.drift_engine != "incremental":
+        sketches = None
+
+    if not options.use_reference:
+        # the moving reference starts empty and fills from the window
+        reference_data = reference_data.iloc[:0]
+    # sketches keep the full reference; only the frames Evidently compares
+    # are sampled, never below min_reference_size rows
+    reference_data = sample_reference(
+        reference_data,
+        options.reference_sample,
+        max(options.reference_sample_size, options.min_reference_size),
+        options.reference_strata,
+    )
+    # columns only needed for the sampling
+    columns = window_columns(column_mapping)
+    reference_data = reference_data[[c for c in reference_data if c in columns]]
+    logging.info(
+        "Reference is loaded for dataset %s: %s rows",
+        dataset_name,
+        len(reference_data),
+    )
+    return LoadedDataset(
+        name=dataset_name,
+        references=reference_data,
+        monitors=dataset_options["monitors"],
+        column_mapping=column_mapping,
+        sketches=sketches,
+    )
+
+
+def create_service(
+    datasets: Dict[str, LoadedDataset], options: MonitoringServiceOptions
+) -> MonitoringService:
+    return MonitoringService(
+        datasets=datasets,
+        window_size=options.window_size,
+        calculation_period_sec=options.calculation_period_sec,
+        min_reference_size=options.min_reference_size,
+        moving_reference_size=(
+            options.moving_reference_size if options.moving_reference else None
+        ),
+    )
+
+
+def run_worker(
+    dataset_name: str,
+    dataset_options: dict,
+    options: MonitoringServiceOptions,
+    rows: multiprocessing.Queue,
+):
+    """Worker process of one dataset: its own window, monitors and
+    calculation thread, fed with the rows /iterate puts on `rows`"""
+    service = create_service(
+        {dataset_name: load_dataset(dataset_name, dataset_options, options)}, options
+    )
+    service.start()
+    while True:
+        try:
+            new_rows = rows.get(timeout=1)
+        except queue.Empty:
+            service.export_staleness()
+            continue
+        if new_rows is None:
+            break
+        service.iterate(dataset_name=dataset_name, new_rows=new_rows)
+    service.stop()
+
+
+def start_workers(config: dict, options: MonitoringServiceOptions):
+    if PROMETHEUS_MULTIPROC_DIR is None:
+        exit("worker_processes needs PROMETHEUS_MULTIPROC_DIR in the environment")
+
+    # metric files of a previous run would be aggregated too; only the
+    # *.db files prometheus_client writes are removed
+    for path in glob.glob(os.path.join(PROMETHEUS_MULTIPROC_DIR, "*.db")):
+        os.remove(path)
+
+    # fork, so the workers do not import this module (and start workers) again
+    context = multiprocessing.get_context("fork")
+    for dataset_name, dataset_options in config["datasets"].items():
+        rows = context.Queue(maxsize=WORKER_QUEUE_SIZE)
+        worker = context.Process(
+            target=run_worker,
+            args=(dataset_name, dataset_options, options, rows),
+            name=f"{dataset_name}-worker",
+            daemon=True,
+        )
+        worker.start()
+        WORKERS[dataset_name] = (worker, rows)
+    atexit.register(stop_workers)
+
+
+def stop_workers(timeout: float = 10):
+    for _, rows in WORKERS.values():
+        rows.put(None)
+    for worker, _ in WORKERS.values():
+        worker.join(timeout)
+        multiprocess.mark_process_dead(worker.pid)
 
 
-@app.before_first_request
 def configure_service():
     # pylint: disable=global-statement
     global SERVICE
@@ -206,47 +536,49 @@ def configure_service():
         config = yaml.safe_load(config_file)
 
     options = MonitoringServiceOptions(**config["service"])
-    datasets = {}
+    if not options.use_reference and not options.moving_reference:
+        exit("use_reference: false needs moving_reference: true")
+    if (
+        options.moving_reference
+        and options.moving_reference_size < options.min_reference_size
+    ):
+        exit("moving_reference_size must be at least min_reference_size")
+    if options.worker_processes:
+        start_workers(config, options)
+        return
+
+    datasets = {
+        dataset_name: load_dataset(dataset_name, dataset_options, options)
+        for dataset_name, dataset_options in config["datasets"].items()
+    }
+    SERVICE = create_service(datasets, options)
+    SERVICE.start()
 
-    for dataset_name, dataset_options in config["datasets"].items():
-        reference_file = dataset_options["reference_file"]
-        logging.info(
-            f"Load reference data for dataset {dataset_name} from {reference_file}"
-        )
-        reference_data = pq.read_table(reference_file).to_pandas()
-        reference_data["duration"] = (
-            reference_data.lpep_dropoff_datetime - reference_data.lpep_pickup_datetime
-        )
-        reference_data.duration = reference_data.duration.apply(
-            lambda td: td.total_seconds() / 60
-        )
-        reference_data = reference_data[
-            (reference_data.duration >= 1) & (reference_data.duration <= 60)
-        ]
-        datasets[dataset_name] = LoadedDataset(
-            name=dataset_name,
-            references=reference_data,
-            monitors=dataset_options["monitors"],
-            column_mapping=ColumnMapping(**dataset_options["column_mapping"]),
-        )
-        logging.info(
-            "Reference is loaded for dataset %s: %s rows",
-            dataset_name,
-            len(reference_data),
-        )
 
-    SERVICE = MonitoringService(datasets=datasets, window_size=options.window_size)
+# load the references at startup rather than on the first request
+configure_service()
 
 
 @app.route("/iterate/<dataset>", methods=["POST"])
 def iterate(dataset: str):
     item = flask.request.json
 
+    new_rows = pd.DataFrame.from_dict(item)
+    if WORKERS:
+        if dataset not in WORKERS:
+            return f"Not Found: unknown dataset {dataset}", 404
+        worker, rows = WORKERS[dataset]
+        if not worker.is_alive():
+            return f"Service Unavailable: worker for {dataset} exited", 503
+        # only routes the rows; the worker process does the rest
+        rows.put(new_rows)
+        return "ok"
+
     global SERVICE
     if SERVICE is None:
         return "Internal Server Error: service not found", 500
 
-    SERVICE.iterate(dataset_name=dataset, new_rows=pd.DataFrame.from_dict(item))
+    SERVICE.iterate(dataset_name=dataset, new_rows=new_rows)
     return "ok"
 
 
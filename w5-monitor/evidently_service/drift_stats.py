@@ -0,0 +1,264 @@
+"""
+Incremental data drift statistics.
+
+Reference-side histograms (numerical features) and category counts
+(categorical features) are computed once. The current window keeps
+running counts that are updated as rows enter and leave it, so each
+calculation only compares two count vectors instead of re-reading both
+frames. The metrics mirror Evidently's DataDriftMonitor, so they end up
+in the same `evidently:*` gauges; p-values come from binned data and are
+close to, not identical with, Evidently's.
+"""
+import dataclasses
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from evidently.model_monitoring.monitoring import MetricsType, ModelMonitoringMetric
+from evidently.model_monitoring.monitors.data_drift import DataDriftMonitorMetrics
+from evidently.pipeline.column_mapping import ColumnMapping
+from scipy.stats import chi2_contingency, kstwobign
+
+from ring_buffer import RingBuffer
+
+# numerical features are binned at reference quantiles
+N_BINS = 50
+# floor for empty bins in PSI, as Evidently uses
+MIN_SHARE = 0.0001
+PSI_METRIC = ModelMonitoringMetric("data_drift:psi", ["feature", "feature_type"])
+
+
+@dataclasses.dataclass
+class FeatureSketch:
+    name: str
+    # "num" or "cat", as in Evidently
+    feature_type: str
+    reference_counts: np.ndarray
+    # numerical features: inner bin edges; the outer bins are open-ended
+    edges: np.ndarray = None
+    # categorical features: reference categories; one extra trailing
+    # bucket collects categories the reference has never seen
+    categories: pd.Index = None
+
+    @classmethod
+    def numerical(cls, name: str, values: pd.Series, n_bins: int = N_BINS):
+        values = values.to_numpy(dtype="float64")
+        values = values[np.isfinite(values)]
+        # quantile edges keep the binned KS statistic close to the exact one
+        # on skewed features such as trip_distance
+        edges = np.array([])
+        if len(values):
+            edges = np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1]))
+        sketch = cls(name, "num", np.zeros(len(edges) + 1, dtype=np.int64), edges)
+        sketch.reference_counts = sketch.count(sketch.encode(values))
+        return sketch
+
+    @classmethod
+    def categorical(cls, name: str, values: pd.Series):
+        categories = pd.Index(values.dropna().unique())
+        sketch = cls(
+            name,
+            "cat",
+            np.zeros(len(categories) + 1, dtype=np.int64),
+            categories=categories,
+        )
+        sketch.reference_counts = sketch.count(sketch.encode(values))
+        return sketch
+
+    @property
+    def n_buckets(self) -> int:
+        return len(self.reference_counts)
+
+    def encode(self, values) -> np.ndarray:
+        """Bucket index of every value; -1 for missing values"""
+        if self.feature_type == "num":
+            values = np.asarray(values, dtype="float64")
+            codes = np.searchsorted(self.edges, values, side="right")
+            codes[np.isnan(values)] = -1
+            return codes
+
+        values = pd.Series(values)
+        codes = self.categories.get_indexer(values)
+        codes[codes == -1] = len(self.categories)
+        codes[values.isna().to_numpy()] = -1
+        return codes
+
+    def count(self, codes: np.ndarray) -> np.ndarray:
+        return np.bincount(codes[codes >= 0], minlength=self.n_buckets)
+
+
+def _shares(counts: np.ndarray) -> np.ndarray:
+    shares = counts / max(counts.sum(), 1)
+    return np.maximum(shares, MIN_SHARE)
+
+
+def ks_p_value(reference_counts: np.ndarray, current_counts: np.ndarray) -> float:
+    """Two-sample Kolmogorov-Smirnov test on binned data (asymptotic p-value)"""
+    n_ref, n_cur = reference_counts.sum(), current_counts.sum()
+    if n_ref == 0 or n_cur == 0:
+        return 1.0
+    statistic = np.abs(
+        np.cumsum(reference_counts) / n_ref - np.cumsum(current_counts) / n_cur
+    ).max()
+    effective_n = np.sqrt(n_ref * n_cur / (n_ref + n_cur))
+    return float(kstwobign.sf(statistic * effective_n))
+
+
+def chi_square_p_value(
+    reference_counts: np.ndarray, current_counts: np.ndarray
+) -> float:
+    """Chi-square test of homogeneity between the two samples"""
+    table = np.stack([reference_counts, current_counts])
+    # categories neither sample has carry no information
+    table = table[:, table.sum(axis=0) > 0]
+    if table.shape[1] < 2 or (table.sum(axis=1) == 0).any():
+        return 1.0
+    return float(chi2_contingency(table, correction=False)[1])
+
+
+def psi(reference_counts: np.ndarray, current_counts: np.ndarray) -> float:
+    reference_shares = _shares(reference_counts)
+    current_shares = _shares(current_counts)
+    return float(
+        np.sum(
+            (reference_shares - current_shares)
+            * np.log(reference_shares / current_shares)
+        )
+    )
+
+
+def build_sketches(
+    reference: pd.DataFrame, column_mapping: ColumnMapping
+) -> List[FeatureSketch]:
+    """Sketches of the mapped features, plus the prediction if the reference
+    has it, which DataDriftMonitor also treats as a feature"""
+    sketches = []
+    for column in column_mapping.categorical_features or []:
+        sketches.append(FeatureSketch.categorical(column, reference[column]))
+    for column in column_mapping.numerical_features or []:
+        sketches.append(FeatureSketch.numerical(column, reference[column]))
+
+    prediction = column_mapping.prediction
+    if isinstance(prediction, str) and prediction in reference:
+        if reference[prediction].nunique() > 5:
+            sketches.append(FeatureSketch.numerical(prediction, reference[prediction]))
+        else:
+            sketches.append(
+                FeatureSketch.categorical(prediction, reference[prediction])
+            )
+    return sketches
+
+
+class IncrementalDrift:
+    """
+    Drift of the current window against the sketched reference. With
+    moving_reference_size, the reference is instead the last
+    moving_reference_size rows that left the window, seeded with
+    `reference` (bucketed with the sketches' edges and categories)
+    """
+
+    def __init__(
+        self,
+        sketches: List[FeatureSketch],
+        window_size: int,
+        threshold: float = 0.05,
+        drift_share: float = 0.5,
+        moving_reference_size: Optional[int] = None,
+        reference: Optional[pd.DataFrame] = None,
+    ):
+        self.sketches = sketches
+        self.threshold = threshold
+        self.drift_share = drift_share
+        columns = {sketch.name: np.dtype("int64") for sketch in sketches}
+        self.current_counts = {
+            sketch.name: np.zeros(sketch.n_buckets, dtype=np.int64)
+            for sketch in sketches
+        }
+        # bucket codes of the rows in the window, to un-count evicted rows
+        self._codes = RingBuffer(columns, window_size)
+
+        self.reference_counts = {
+            sketch.name: sketch.reference_counts.copy() for sketch in sketches
+        }
+        self._reference_codes = None
+        if moving_reference_size is not None:
+            self._reference_codes = RingBuffer(columns, moving_reference_size)
+            for counts in self.reference_counts.values():
+                counts[:] = 0
+            if reference is not None:
+                self._add_reference(self._encode(reference))
+
+    def _encode(self, rows: pd.DataFrame) -> pd.DataFrame:
+        codes = {}
+        for sketch in self.sketches:
+            if sketch.name in rows:
+                codes[sketch.name] = sketch.encode(rows[sketch.name])
+            else:
+                codes[sketch.name] = np.full(len(rows), -1, dtype=np.int64)
+        return pd.DataFrame(codes)
+
+    def _add(self, buffer: RingBuffer, counts: Dict[str, np.ndarray], codes):
+        """Appends codes to buffer and moves the counts along; returns the
+        codes the buffer evicted"""
+        # rows the buffer drops right away must not be counted either
+        codes = codes.iloc[max(0, len(codes) - buffer.capacity) :]
+        evicted = buffer.append(codes)
+        for sketch in self.sketches:
+            counts[sketch.name] += sketch.count(codes[sketch.name].to_numpy())
+            if evicted is not None:
+                counts[sketch.name] -= sketch.count(evicted[sketch.name])
+        return evicted
+
+    def _add_reference(self, codes: pd.DataFrame):
+        self._add(self._reference_codes, self.reference_counts, codes)
+
+    def update(self, new_rows: pd.DataFrame):
+        codes = self._encode(new_rows)
+        evicted = self._add(self._codes, self.current_counts, codes)
+        if self._reference_codes is None:
+            return
+        if evicted is not None:
+            self._add_reference(pd.DataFrame(evicted))
+        # rows of an update longer than the window leave it straight away
+        skipped = codes.iloc[: max(0, len(codes) - self._codes.capacity)]
+        if len(skipped):
+            self._add_reference(skipped)
+
+    def feature_stats(self) -> Dict[str, dict]:
+        stats = {}
+        for sketch in self.sketches:
+            reference_counts = self.reference_counts[sketch.name]
+            current_counts = self.current_counts[sketch.name]
+            if sketch.feature_type == "num":
+                p_value = ks_p_value(reference_counts, current_counts)
+            else:
+                p_value = chi_square_p_value(reference_counts, current_counts)
+            stats[sketch.name] = dict(
+                feature_type=sketch.feature_type,
+                p_value=p_value,
+                psi=psi(reference_counts, current_counts),
+            )
+        return stats
+
+    def metrics(self) -> Iterator[MetricsType]:
+        """Same (metric, value, labels) triples as ModelMonitoring.metrics()"""
+        features = self.feature_stats()
+        n_drifted = sum(
+            feature["p_value"] < self.threshold for feature in features.values()
+        )
+        share_drifted = n_drifted / len(features) if features else 0.0
+        yield DataDriftMonitorMetrics.share_drifted_features.create(share_drifted)
+        yield DataDriftMonitorMetrics.n_drifted_features.create(n_drifted)
+        yield DataDriftMonitorMetrics.dataset_drift.create(
+            bool(share_drifted >= self.drift_share)
+        )
+
+        for name, feature in features.items():
+            # fresh dicts: consumers add their own labels in place
+            yield DataDriftMonitorMetrics.p_value.create(
+                feature["p_value"],
+                dict(feature=name, feature_type=feature["feature_type"]),
+            )
+            yield PSI_METRIC.create(
+                feature["psi"], dict(feature=name, feature_type=feature["feature_type"])
+            )
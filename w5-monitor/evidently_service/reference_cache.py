@@ -0,0 +1,131 @@
+"""
+Prepared reference datasets for the Evidently service.
+
+Preparing a reference means reading the TLC parquet file, computing the
+ride duration, filtering and keeping the mapped columns, plus building
+the drift_stats sketches. The result is written once to a compact
+parquet file and a pickle next to it, named after a hash of the source
+file's content and of the column mapping, so a new reference file or a
+changed mapping is prepared again while every other start only loads.
+
+    python reference_cache.py [config.yaml]
+
+prepares every dataset in the config ahead of the service start.
+"""
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+from typing import List, Tuple
+
+import pandas as pd
+import yaml
+from evidently.pipeline.column_mapping import ColumnMapping
+from pyarrow import parquet as pq
+
+from drift_stats import N_BINS, FeatureSketch, build_sketches
+from ring_buffer import window_columns
+from sampling import PICKUP_HOUR
+from trip_cleaning import DROPOFF_COLUMN, PICKUP_COLUMN, clean_trips, read_trips
+
+# bump when the preparation below changes, to invalidate existing files
+CACHE_VERSION = 2
+# cache location, relative to the service's datasets_path
+CACHE_SUBDIR = ".reference_cache"
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f_in:
+        for chunk in iter(lambda: f_in.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(reference_file: str, column_mapping: ColumnMapping) -> str:
+    mapping = json.dumps(
+        dataclasses.asdict(column_mapping), sort_keys=True, default=str
+    )
+    digest = hashlib.sha256()
+    digest.update(file_sha256(reference_file).encode())
+    digest.update(mapping.encode())
+    digest.update(f"v{CACHE_VERSION}-bins{N_BINS}".encode())
+    return digest.hexdigest()
+
+
+def prepare_reference(
+    reference_file: str, column_mapping: ColumnMapping
+) -> pd.DataFrame:
+    """Mapped columns of the 1-60 minute rides, with numeric columns as float64,
+    plus the pickup hour for stratified sampling; location ids stay numeric,
+    as in the rows posted to /iterate"""
+    mapped = window_columns(column_mapping)
+    available = pq.read_schema(reference_file).names
+    columns = [
+        column
+        for column in available
+        if column in mapped or column in (PICKUP_COLUMN, DROPOFF_COLUMN)
+    ]
+    # the duration filter runs in pyarrow; rows with unknown locations are kept
+    reference = read_trips(reference_file, columns=columns, location_cols=None)
+    reference = clean_trips(reference, categorical=None)
+
+    prepared = {}
+    for column, dtype in mapped.items():
+        if column not in reference:
+            continue
+        values = reference[column]
+        if dtype.kind in "fM":
+            values = values.astype(dtype)
+        prepared[column] = values
+    prepared[PICKUP_HOUR] = reference[PICKUP_COLUMN].dt.hour.astype("int8")
+    return pd.DataFrame(prepared).reset_index(drop=True)
+
+
+def load_reference(
+    reference_file: str, column_mapping: ColumnMapping, cache_dir: str
+) -> Tuple[pd.DataFrame, List[FeatureSketch]]:
+    """Prepared reference and its sketches, from cache_dir when present"""
+    key = cache_key(reference_file, column_mapping)
+    name = os.path.splitext(os.path.basename(reference_file))[0]
+    base = os.path.join(cache_dir, f"{name}-{key[:16]}")
+    data_path, sketches_path = f"{base}.parquet", f"{base}.sketches.pkl"
+
+    if os.path.exists(data_path) and os.path.exists(sketches_path):
+        logging.info("Loading prepared reference %s", data_path)
+        with open(sketches_path, "rb") as f_in:
+            sketches = pickle.load(f_in)
+        return pd.read_parquet(data_path), sketches
+
+    logging.info("Preparing reference %s into %s", reference_file, data_path)
+    reference = prepare_reference(reference_file, column_mapping)
+    sketches = build_sketches(reference, column_mapping)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # written under temporary names first, so a crash never leaves a
+    # half-written file behind that the next start would load
+    reference.to_parquet(f"{data_path}.tmp", index=False)
+    with open(f"{sketches_path}.tmp", "wb") as f_out:
+        pickle.dump(sketches, f_out)
+    os.replace(f"{sketches_path}.tmp", sketches_path)
+    os.replace(f"{data_path}.tmp", data_path)
+    return reference, sketches
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    config_path = sys.argv[1] if len(sys.argv) > 1 else "config.yaml"
+    with open(config_path, "rb") as config_file:
+        config = yaml.safe_load(config_file)
+
+    cache_dir = os.path.join(config["service"]["datasets_path"], CACHE_SUBDIR)
+    for dataset_name, dataset_options in config["datasets"].items():
+        reference, _ = load_reference(
+            dataset_options["reference_file"],
+            ColumnMapping(**dataset_options["column_mapping"]),
+            cache_dir,
+        )
+        print(f"{dataset_name}: {len(reference)} reference rows")
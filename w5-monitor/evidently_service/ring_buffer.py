@@ -0,0 +1,115 @@
+"""
+Fixed-size columnar window of the most recent rows.
+
+Each column is a preallocated numpy array of twice the window size and
+every row is written at both i and i + capacity. The latest `capacity`
+rows are therefore always one contiguous slice, so appending costs
+O(rows added) and reading the window needs no copy or reordering.
+"""
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from evidently.pipeline.column_mapping import ColumnMapping
+
+
+def window_columns(column_mapping: ColumnMapping) -> Dict[str, np.dtype]:
+    """numpy dtype of every column the monitors read, from the column mapping"""
+    columns = {}
+    for column in column_mapping.numerical_features or []:
+        columns[column] = np.dtype("float64")
+    for column in column_mapping.categorical_features or []:
+        columns[column] = np.dtype("object")
+    for column in column_mapping.datetime_features or []:
+        columns[column] = np.dtype("datetime64[ns]")
+
+    if isinstance(column_mapping.datetime, str):
+        columns[column_mapping.datetime] = np.dtype("datetime64[ns]")
+    if isinstance(column_mapping.prediction, str):
+        columns[column_mapping.prediction] = np.dtype("float64")
+    if isinstance(column_mapping.target, str):
+        is_classification = column_mapping.task == "classification"
+        columns[column_mapping.target] = np.dtype(
+            "object" if is_classification else "float64"
+        )
+    return columns
+
+
+def _missing_value(dtype: np.dtype):
+    if dtype.kind in "iu":
+        # integer columns hold codes, where -1 means missing
+        return -1
+    if dtype.kind == "f":
+        return np.nan
+    if dtype.kind == "M":
+        return np.datetime64("NaT")
+    return None
+
+
+class RingBuffer:
+    def __init__(self, columns: Dict[str, np.dtype], capacity: int):
+        self.columns = columns
+        self.capacity = capacity
+        self.size = 0
+        # index where the next row goes, in [0, capacity)
+        self._head = 0
+        # columns that appeared in at least one appended frame; the
+        # others are left out of the window like absent DataFrame columns
+        self._seen = set()
+        self._data = {
+            column: np.full(2 * capacity, _missing_value(dtype), dtype=dtype)
+            for column, dtype in columns.items()
+        }
+
+    def append(self, rows: pd.DataFrame) -> Optional[Dict[str, np.ndarray]]:
+        """Adds rows, evicting the oldest ones past capacity.
+        Returns the evicted values of the columns seen so far, or None if
+        nothing was evicted.
+        """
+        n_rows = len(rows)
+        if n_rows == 0:
+            return None
+        if n_rows > self.capacity:
+            rows = rows.iloc[n_rows - self.capacity :]
+            n_rows = self.capacity
+
+        positions = (self._head + np.arange(n_rows)) % self.capacity
+        n_evicted = max(0, self.size + n_rows - self.capacity)
+        evicted = None
+        if n_evicted:
+            # the slots past the free ones hold the oldest rows, in order
+            evicted = {
+                column: data[positions[n_rows - n_evicted :]].copy()
+                for column, data in self._data.items()
+                if column in self._seen
+            }
+
+        for column, data in self._data.items():
+            if column in rows:
+                self._seen.add(column)
+                values = rows[column]
+                if data.dtype.kind == "M":
+                    values = pd.to_datetime(values)
+                values = values.to_numpy(dtype=data.dtype)
+            else:
+                values = _missing_value(data.dtype)
+            data[positions] = values
+            data[positions + self.capacity] = values
+
+        self._head = (self._head + n_rows) % self.capacity
+        self.size = min(self.size + n_rows, self.capacity)
+        return evicted
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Views (not copies) of the current window, oldest row first"""
+        end = self._head + self.capacity
+        return {
+            column: data[end - self.size : end] for column, data in self._data.items()
+        }
+
+    def window(self) -> pd.DataFrame:
+        arrays = self.arrays()
+        return pd.DataFrame(
+            {column: arrays[column] for column in self.columns if column in self._seen},
+            copy=False,
+        )
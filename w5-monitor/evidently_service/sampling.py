@@ -0,0 +1,63 @@
+"""
+Reference sampling, so the drift calculation runs on a fixed number of
+reference rows however large the reference file is.
+
+Both samplers give every row a uniform random key and keep the rows with
+the smallest keys, which is what a reservoir filled row by row would
+hold, in O(n) without sorting the whole frame.
+"""
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# derived from the pickup timestamp when the reference is prepared
+PICKUP_HOUR = "pickup_hour"
+DEFAULT_STRATA = [PICKUP_HOUR, "PULocationID"]
+SAMPLING_METHODS = ["full", "reservoir", "stratified"]
+# fixed, so restarts compare against the same sample
+SEED = 1
+
+
+def reservoir_sample(df: pd.DataFrame, size: int, seed: int = SEED) -> pd.DataFrame:
+    if len(df) <= size:
+        return df
+    keys = np.random.default_rng(seed).random(len(df))
+    keep = np.sort(np.argpartition(keys, size)[:size])
+    return df.iloc[keep]
+
+
+def stratified_sample(
+    df: pd.DataFrame, size: int, strata: List[str], seed: int = SEED
+) -> pd.DataFrame:
+    """Sample with every stratum (e.g. pickup hour x pickup location) in
+    the same proportion as in df; rounding uses largest remainders, so the
+    sample has exactly `size` rows"""
+    if len(df) <= size:
+        return df
+    stratum = df.groupby(strata, dropna=False, sort=False).ngroup().to_numpy()
+    counts = np.bincount(stratum)
+    quota = counts * size / len(df)
+    allocated = np.floor(quota).astype(np.int64)
+    remainder_order = np.argsort(-(quota - allocated), kind="stable")
+    allocated[remainder_order[: size - allocated.sum()]] += 1
+
+    keys = np.random.default_rng(seed).random(len(df))
+    # rank of every row within its stratum, by key
+    order = np.lexsort((keys, stratum))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.empty(len(df), dtype=np.int64)
+    rank[order] = np.arange(len(df)) - starts[stratum[order]]
+    return df[rank < allocated[stratum]]
+
+
+def sample_reference(
+    df: pd.DataFrame, method: str, size: int, strata: List[str] = DEFAULT_STRATA
+) -> pd.DataFrame:
+    if method not in SAMPLING_METHODS:
+        raise ValueError(f"reference_sample must be one of {SAMPLING_METHODS}")
+    if method == "reservoir":
+        return reservoir_sample(df, size)
+    if method == "stratified":
+        return stratified_sample(df, size, strata)
+    return df
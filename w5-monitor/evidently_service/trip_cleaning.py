@@ -0,0 +1,149 @@
+"""
+Vectorized loading and cleaning steps shared by the trip data loaders:
+column-projected reads, ride duration, the 1-60 minute filter and
+categorical casting.
+
+Each week's folder is deployed on its own (prefect storage, docker build
+context), so identical copies of this file live in w2-mlflow, w3-prefect,
+w4-deployment/batch and w5-monitor/evidently_service; keep them in sync,
+w4-deployment/batch/tests/test_trip_cleaning.py checks they match.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+PICKUP_COLUMN = "lpep_pickup_datetime"
+DROPOFF_COLUMN = "lpep_dropoff_datetime"
+CATEGORICAL = ["PULocationID", "DOLocationID"]
+MIN_DURATION = 1
+MAX_DURATION = 60
+# the only columns the duration models use
+TRIP_COLUMNS = [PICKUP_COLUMN, DROPOFF_COLUMN, *CATEGORICAL, "trip_distance"]
+
+
+def trip_filter(
+    pickup_col: str = PICKUP_COLUMN,
+    dropoff_col: str = DROPOFF_COLUMN,
+    location_cols=CATEGORICAL,
+):
+    """pyarrow expression keeping 1-60 minute rides with known locations"""
+    duration = pc.subtract(ds.field(dropoff_col), ds.field(pickup_col))
+    expr = (duration >= timedelta(minutes=MIN_DURATION)) & (
+        duration <= timedelta(minutes=MAX_DURATION)
+    )
+    for col in location_cols or []:
+        expr = expr & ds.field(col).is_valid()
+    return expr
+
+
+def read_trips(
+    filename: str,
+    columns=TRIP_COLUMNS,
+    pickup_col: str = PICKUP_COLUMN,
+    dropoff_col: str = DROPOFF_COLUMN,
+    location_cols=CATEGORICAL,
+    storage_options=None,
+):
+    """Reads only `columns` from a TLC parquet file; the duration and
+    non-null location filters are evaluated by pyarrow while scanning,
+    so rejected rows and unused columns never reach pandas.
+    The result has a fresh RangeIndex.
+    """
+    return pd.read_parquet(
+        filename,
+        engine="pyarrow",
+        columns=columns,
+        filters=trip_filter(pickup_col, dropoff_col, location_cols),
+        storage_options=storage_options,
+    )
+
+
+def resolve_filesystem(uri: str):
+    """(filesystem, path) for a local path or a remote URL such as s3://...
+    pyarrow's own URI parser rejects the space in the TLC bucket's
+    'trip data' prefix, so remote URLs are resolved through fsspec,
+    the same way pandas does in read_trips
+    """
+    from fsspec.core import url_to_fs
+
+    return url_to_fs(uri)
+
+
+def iter_trips(
+    filename: str,
+    chunk_rows: int,
+    columns=TRIP_COLUMNS,
+    pickup_col: str = PICKUP_COLUMN,
+    dropoff_col: str = DROPOFF_COLUMN,
+    location_cols=CATEGORICAL,
+):
+    """Streams a TLC parquet file as DataFrames of at most `chunk_rows` rows,
+    with the same projection and filters as read_trips. Read-ahead is kept
+    to a single batch so memory is bounded by the chunk, not the file.
+    """
+    filesystem, path = resolve_filesystem(filename)
+    dataset = ds.dataset(path, format="parquet", filesystem=filesystem)
+    scanner = dataset.scanner(
+        columns=columns,
+        filter=trip_filter(pickup_col, dropoff_col, location_cols),
+        batch_size=chunk_rows,
+        batch_readahead=1,
+        fragment_readahead=1,
+    )
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def compute_duration(
+    df: pd.DataFrame,
+    pickup_col: str = PICKUP_COLUMN,
+    dropoff_col: str = DROPOFF_COLUMN,
+):
+    """Ride duration in minutes as a float array; NaN if a timestamp is missing"""
+    delta = (df[dropoff_col] - df[pickup_col]).to_numpy()
+    return delta / np.timedelta64(1, "m")
+
+
+def filter_duration(
+    df: pd.DataFrame,
+    column: str = "duration",
+    min_duration: float = MIN_DURATION,
+    max_duration: float = MAX_DURATION,
+):
+    duration = df[column].to_numpy()
+    return df[(duration >= min_duration) & (duration <= max_duration)]
+
+
+def cast_categorical(df: pd.DataFrame, categorical=CATEGORICAL):
+    """Same result as df[categorical].astype(str), but only the distinct
+    values are converted to strings; rows are filled with a numpy take
+    """
+    for col in categorical:
+        codes, uniques = pd.factorize(df[col])
+        # code -1 marks a missing value, which astype(str) renders as 'nan'
+        labels = np.append(np.asarray(uniques.astype(str), dtype=object), "nan")
+        df[col] = labels[codes]
+    return df
+
+
+def clean_trips(
+    df: pd.DataFrame,
+    target: str = "duration",
+    pickup_col: str = PICKUP_COLUMN,
+    dropoff_col: str = DROPOFF_COLUMN,
+    categorical=CATEGORICAL,
+):
+    """Adds the duration target, keeps 1-60 minute rides and casts the
+    categorical columns to str; pass categorical=None to skip the cast
+    """
+    df[target] = compute_duration(df, pickup_col, dropoff_col)
+    df = filter_duration(df, column=target).copy()
+
+    if categorical:
+        df = cast_categorical(df, categorical)
+
+    return df
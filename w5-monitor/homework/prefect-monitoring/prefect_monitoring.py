@@ -1,9 +1,8 @@
 import json
 import os
-import pickle
+import sys
+from datetime import datetime, timedelta, timezone
 
-import pandas
-import pyarrow.parquet as pq
 from evidently import ColumnMapping
 from evidently.dashboard import Dashboard
 from evidently.dashboard.tabs import DataDriftTab, RegressionPerformanceTab
@@ -15,6 +14,16 @@ from evidently.model_profile.sections import (
 from prefect import flow, task
 from pymongo import MongoClient
 
+# batch_monitoring.py is shared with w5-monitor/prefect_example.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+# pylint: disable=wrong-import-position
+from batch_monitoring import (  # noqa: E402
+    calculate_pipelines,
+    fetch_predictions,
+    load_scored_reference,
+    upload_targets,
+)
+
 MONGO_CLIENT_ADDRESS = "mongodb://localhost:27017/"
 MONGO_DATABASE = "prediction_service"
 PREDICTION_COLLECTION = "data"
@@ -24,6 +33,11 @@ TARGET_DATA_FILE = "target.csv"
 MODEL_FILE = os.getenv(
     "MODEL_FILE", "../prediction_service/lin_reg.bin"
 )  # Modify this for Q7
+# predictions inserted this long before the run are monitored
+MONITORING_WINDOW = timedelta(days=int(os.getenv("MONITORING_WINDOW_DAYS", "7")))
+REFERENCE_SAMPLE_SIZE = 5000
+# scored references, named after the reference and model file hashes
+SCORED_REFERENCE_DIR = os.getenv("SCORED_REFERENCE_DIR", "scored_reference")
 
 
 @task
@@ -32,60 +46,34 @@ def upload_target(filename):
     collection = client.get_database(MONGO_DATABASE).get_collection(
         PREDICTION_COLLECTION
     )
-    with open(filename) as f_target:
-        for line in f_target.readlines():
-            row = line.split(",")
-            collection.update_one({"id": row[0]}, {"$set": {"target": float(row[1])}})
+    upload_targets(collection, filename)
 
 
 @task
 def load_reference_data(filename):
-
-    with open(MODEL_FILE, "rb") as f_in:
-        dv, model = pickle.load(f_in)
-    reference_data = (
-        pq.read_table(filename).to_pandas().sample(n=5000, random_state=42)
-    )  # Monitoring for 1st 5000 records
-    # Create features
-    reference_data["PU_DO"] = (
-        reference_data["PULocationID"].astype(str)
-        + "_"
-        + reference_data["DOLocationID"].astype(str)
-    )
-
-    # add target column
-    reference_data["target"] = (
-        reference_data.lpep_dropoff_datetime - reference_data.lpep_pickup_datetime
+    return load_scored_reference(
+        filename, MODEL_FILE, SCORED_REFERENCE_DIR, REFERENCE_SAMPLE_SIZE
     )
-    reference_data.target = reference_data.target.apply(
-        lambda td: td.total_seconds() / 60
-    )
-    reference_data = reference_data[
-        (reference_data.target >= 1) & (reference_data.target <= 60)
-    ]
-    features = ["PU_DO", "PULocationID", "DOLocationID", "trip_distance"]
-    x_pred = dv.transform(reference_data[features].to_dict(orient="records"))
-    reference_data["prediction"] = model.predict(x_pred)
-    return reference_data
 
 
 @task
-def fetch_data():
+def fetch_data(start=None, end=None):
+    end = end or datetime.now(timezone.utc)
+    start = start or end - MONITORING_WINDOW
     client = MongoClient(MONGO_CLIENT_ADDRESS)
-    data = (
-        client.get_database(MONGO_DATABASE).get_collection(PREDICTION_COLLECTION).find()
+    collection = client.get_database(MONGO_DATABASE).get_collection(
+        PREDICTION_COLLECTION
     )
-    df = pandas.DataFrame(list(data))
-    return df
+    table = fetch_predictions(collection, start, end)
+    return table.to_pandas()
 
 
 @task
 def run_evidently(ref_data, data):
 
+    # drop empty column (until Evidently will work with it properly);
+    # fetch_data only returns the monitored columns
     ref_data.drop(["ehail_fee"], axis=1, inplace=True)
-    data.drop(
-        "ehail_fee", axis=1, inplace=True
-    )  # drop empty column (until Evidently will work with it properly)
 
     profile = Profile(
         sections=[DataDriftProfileSection(), RegressionPerformanceProfileSection()]
@@ -96,13 +84,17 @@ def run_evidently(ref_data, data):
         categorical_features=["PULocationID", "DOLocationID"],
         datetime_features=[],
     )
-    profile.calculate(ref_data, data, mapping)
-
     dashboard = Dashboard(
         tabs=[DataDriftTab(), RegressionPerformanceTab(verbose_level=0)]
     )
-    dashboard.calculate(ref_data, data, mapping)
-    return json.loads(profile.json()), dashboard
+    # drift and regression statistics are computed once for both
+    timings = calculate_pipelines([profile, dashboard], ref_data, data, mapping)
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.2f}s")
+
+    result = json.loads(profile.json())
+    result["timing_sec"] = timings
+    return result, dashboard
 
 
 @task
@@ -125,4 +117,5 @@ def batch_analyze():
     save_html_report(dashboard)
 
 
-batch_analyze()
+if __name__ == "__main__":
+    batch_analyze()
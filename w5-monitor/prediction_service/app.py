@@ -1,3 +1,4 @@
+import json
 import os
 import pickle
 
@@ -5,10 +6,16 @@ import requests
 from flask import Flask, jsonify, request
 from pymongo import MongoClient
 
+from sinks import BackgroundSink
+
 MODEL_FILE = os.getenv("MODEL_FILE", "lin_reg.bin")
 
 EVIDENTLY_SERVICE_ADDRESS = os.getenv("EVIDENTLY_SERVICE", "http://127.0.0.1:5000")
 MONGODB_ADDRESS = os.getenv("MONGODB_ADDRESS", "mongodb://127.0.0.1:27017")
+# monitoring writes are batched in the background, see sinks.py
+SINK_BATCH_SIZE = int(os.getenv("SINK_BATCH_SIZE", "100"))
+SINK_FLUSH_SEC = float(os.getenv("SINK_FLUSH_SEC", "1"))
+SINK_MAX_QUEUED = int(os.getenv("SINK_MAX_QUEUED", "10000"))
 
 with open(MODEL_FILE, "rb") as f_in:
     dv, model = pickle.load(f_in)
@@ -20,6 +27,27 @@ db = mongo_client.get_database("prediction_service")
 collection = db.get_collection("data")
 
 
+def insert_records(records):
+    collection.insert_many(records)
+
+
+def post_records(records):
+    response = requests.post(
+        f"{EVIDENTLY_SERVICE_ADDRESS}/iterate/taxi", json=records, timeout=10
+    )
+    # surfaces HTTP errors to the sink, which logs the failed batch
+    response.raise_for_status()
+
+
+sink_options = dict(
+    batch_size=SINK_BATCH_SIZE,
+    flush_interval_sec=SINK_FLUSH_SEC,
+    max_queued=SINK_MAX_QUEUED,
+)
+mongo_sink = BackgroundSink("mongo", insert_records, **sink_options)
+evidently_sink = BackgroundSink("evidently", post_records, **sink_options)
+
+
 @app.route("/predict", methods=["POST"])
 def predict():
     record = request.get_json()
@@ -27,27 +55,61 @@ def predict():
     record["PU_DO"] = "%s_%s" % (record["PULocationID"], record["DOLocationID"])
 
     X = dv.transform([record])
-    y_pred = model.predict(X)
+    y_pred = float(model.predict(X)[0])
 
     result = {
-        "duration": float(y_pred),
+        "duration": y_pred,
     }
 
-    save_to_db(record, float(y_pred))
-    send_to_evidently_service(record, float(y_pred))
+    save_to_db([record], [y_pred])
+    send_to_evidently_service([record], [y_pred])
     return jsonify(result)
 
 
-def save_to_db(record, prediction):
-    rec = record.copy()
-    rec["prediction"] = prediction
-    collection.insert_one(rec)
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """Rides as a JSON array or newline-delimited JSON; the durations
+    are returned in the same order"""
+    records = read_records()
+    if not records:
+        return jsonify({"durations": []})
+
+    for record in records:
+        record["PU_DO"] = "%s_%s" % (record["PULocationID"], record["DOLocationID"])
+
+    X = dv.transform(records)
+    y_pred = [float(pred) for pred in model.predict(X)]
+
+    save_to_db(records, y_pred)
+    send_to_evidently_service(records, y_pred)
+    return jsonify({"durations": y_pred})
+
+
+def read_records():
+    records = request.get_json(silent=True)
+    if records is None:
+        body = request.get_data(as_text=True)
+        records = [json.loads(line) for line in body.splitlines() if line.strip()]
+    elif isinstance(records, dict):
+        records = [records]
+    return records
+
+
+def with_predictions(records, predictions):
+    recs = []
+    for record, prediction in zip(records, predictions):
+        rec = record.copy()
+        rec["prediction"] = prediction
+        recs.append(rec)
+    return recs
+
+
+def save_to_db(records, predictions):
+    mongo_sink.put(with_predictions(records, predictions))
 
 
-def send_to_evidently_service(record, prediction):
-    rec = record.copy()
-    rec["prediction"] = prediction
-    requests.post(f"{EVIDENTLY_SERVICE_ADDRESS}/iterate/taxi", json=[rec])
+def send_to_evidently_service(records, predictions):
+    evidently_sink.put(with_predictions(records, predictions))
 
 
 if __name__ == "__main__":
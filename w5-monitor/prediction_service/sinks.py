@@ -0,0 +1,125 @@
+"""
+Background sinks for the monitoring side of the prediction service.
+
+Predictions are queued and written in batches from a worker thread, so
+a slow or unavailable MongoDB / Evidently service never adds latency to
+/predict: once the bounded queue is full, records are dropped after a
+short wait instead of blocking the request.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+
+class BackgroundSink:
+    def __init__(
+        self,
+        name,
+        write,
+        batch_size=100,
+        flush_interval_sec=1.0,
+        max_queued=10000,
+        put_timeout_sec=0.01,
+    ):
+        self.name = name
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.put_timeout_sec = put_timeout_sec
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._stop = threading.Event()
+        self._drain_deadline = None
+        self._worker = threading.Thread(
+            target=self._run, name=f"{name}-sink", daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.close)
+
+    def put(self, records):
+        """Queues records; put_timeout_sec bounds the whole call, not each
+        record, so a full queue costs a batch request one short wait"""
+        deadline = time.monotonic() + self.put_timeout_sec
+        dropped = 0
+        for record in records:
+            try:
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    self._queue.put(record, timeout=timeout)
+                else:
+                    self._queue.put_nowait(record)
+            except queue.Full:
+                dropped += 1
+        if dropped:
+            self.dropped += dropped
+            logging.warning(
+                "%s sink is full, dropped %d records so far",
+                self.name,
+                self.dropped,
+            )
+
+    def close(self, timeout=10):
+        """Flushes whatever is queued and stops the worker, giving up on
+        the records still queued after `timeout` seconds"""
+        if self._stop.is_set():
+            return
+        self._drain_deadline = time.monotonic() + timeout
+        self._stop.set()
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            logging.warning(
+                "%s sink did not flush within %ss, %d records left",
+                self.name,
+                timeout,
+                self._queue.qsize(),
+            )
+
+    def _draining_expired(self):
+        return self._stop.is_set() and time.monotonic() >= self._drain_deadline
+
+    def _next_batch(self):
+        """Waits for a first record, then collects more until the batch is
+        full or flush_interval_sec has passed; returns None once the sink
+        is closed and the queue is empty or the close timeout has passed"""
+        while True:
+            if self._draining_expired():
+                return None
+            try:
+                first = self._queue.get(timeout=self.flush_interval_sec)
+                break
+            except queue.Empty:
+                if self._stop.is_set():
+                    return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval_sec
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                if self._stop.is_set():
+                    record = self._queue.get_nowait()
+                else:
+                    record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(record)
+        return batch
+
+    def _flush(self, batch):
+        try:
+            self.write(batch)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception(
+                "%s sink failed to write %d records", self.name, len(batch)
+            )
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            self._flush(batch)
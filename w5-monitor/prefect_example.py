@@ -1,9 +1,7 @@
 import json
 import os
-import pickle
+from datetime import datetime, timedelta, timezone
 
-import pandas
-import pyarrow.parquet as pq
 from evidently import ColumnMapping
 from evidently.dashboard import Dashboard
 from evidently.dashboard.tabs import DataDriftTab, RegressionPerformanceTab
@@ -15,61 +13,49 @@ from evidently.model_profile.sections import (
 from prefect import flow, task
 from pymongo import MongoClient
 
+from batch_monitoring import (
+    calculate_pipelines,
+    fetch_predictions,
+    load_scored_reference,
+    upload_targets,
+)
+
+MODEL_FILE = os.getenv("MODEL_FILE", "./prediction_service/lin_reg.bin")
+# predictions inserted this long before the run are monitored
+MONITORING_WINDOW = timedelta(days=int(os.getenv("MONITORING_WINDOW_DAYS", "7")))
+# scored references, named after the reference and model file hashes
+SCORED_REFERENCE_DIR = os.getenv("SCORED_REFERENCE_DIR", "scored_reference")
+
 
 @task
 def upload_target(filename):
     client = MongoClient("mongodb://localhost:27018/")
     collection = client.get_database("prediction_service").get_collection("data")
-    with open(filename) as f_target:
-        for line in f_target.readlines():
-            row = line.split(",")
-            collection.update_one({"id": row[0]}, {"$set": {"target": float(row[1])}})
+    upload_targets(collection, filename)
     client.close()
 
 
 @task
 def load_reference_data(filename):
-    MODEL_FILE = os.getenv("MODEL_FILE", "./prediction_service/lin_reg.bin")
-    with open(MODEL_FILE, "rb") as f_in:
-        dv, model = pickle.load(f_in)
-    reference_data = pq.read_table(filename).to_pandas()
-    # Create features
-    reference_data["PU_DO"] = (
-        reference_data["PULocationID"].astype(str)
-        + "_"
-        + reference_data["DOLocationID"].astype(str)
-    )
-
-    # add target column
-    reference_data["target"] = (
-        reference_data.lpep_dropoff_datetime - reference_data.lpep_pickup_datetime
-    )
-    reference_data.target = reference_data.target.apply(
-        lambda td: td.total_seconds() / 60
-    )
-    reference_data = reference_data[
-        (reference_data.target >= 1) & (reference_data.target <= 60)
-    ]
-    features = ["PU_DO", "PULocationID", "DOLocationID", "trip_distance"]
-    x_pred = dv.transform(reference_data[features].to_dict(orient="records"))
-    reference_data["prediction"] = model.predict(x_pred)
-    return reference_data
+    return load_scored_reference(filename, MODEL_FILE, SCORED_REFERENCE_DIR)
 
 
 @task
-def fetch_data():
+def fetch_data(start=None, end=None):
+    end = end or datetime.now(timezone.utc)
+    start = start or end - MONITORING_WINDOW
     client = MongoClient("mongodb://localhost:27018/")
-    data = client.get_database("prediction_service").get_collection("data").find()
-    df = pandas.DataFrame(list(data))
-    return df
+    collection = client.get_database("prediction_service").get_collection("data")
+    table = fetch_predictions(collection, start, end)
+    client.close()
+    return table.to_pandas()
 
 
 @task
 def run_evidently(ref_data, data):
-    ref_data.drop("ehail_fee", axis=1, inplace=True)
-    data.drop(
-        "ehail_fee", axis=1, inplace=True
-    )  # drop empty column (until Evidently will work with it properly)
+    # drop empty column (until Evidently will work with it properly);
+    # fetch_data only returns the monitored columns
+    ref_data.drop(["ehail_fee"], axis=1, inplace=True)
     profile = Profile(
         sections=[DataDriftProfileSection(), RegressionPerformanceProfileSection()]
     )
@@ -79,13 +65,17 @@ def run_evidently(ref_data, data):
         categorical_features=["PULocationID", "DOLocationID"],
         datetime_features=[],
     )
-    profile.calculate(ref_data, data, mapping)
-
     dashboard = Dashboard(
         tabs=[DataDriftTab(), RegressionPerformanceTab(verbose_level=0)]
     )
-    dashboard.calculate(ref_data, data, mapping)
-    return json.loads(profile.json()), dashboard
+    # drift and regression statistics are computed once for both
+    timings = calculate_pipelines([profile, dashboard], ref_data, data, mapping)
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.2f}s")
+
+    result = json.loads(profile.json())
+    result["timing_sec"] = timings
+    return result, dashboard
 
 
 @task
@@ -113,4 +103,5 @@ def batch_analyze():
     save_html_report(result)
 
 
-batch_analyze()
+if __name__ == "__main__":
+    batch_analyze()
@@ -1,11 +1,13 @@
 import json
 import uuid
 from datetime import datetime
-from time import sleep
 
 import pyarrow.parquet as pq
 import requests
 
+# rides sent per /predict/batch request
+BATCH_SIZE = 1000
+
 table = pq.read_table("green_tripdata_2022-01.parquet")
 data = table.to_pylist()
 
@@ -18,17 +20,19 @@ class DateTimeEncoder(json.JSONEncoder):
 
 
 with open("target.csv", "w") as f_target:
-    for row in data:
-        row["id"] = str(uuid.uuid4())
-        duration = (
-            row["lpep_dropoff_datetime"] - row["lpep_pickup_datetime"]
-        ).total_seconds() / 60
-        if duration != 0.0:
-            f_target.write(f"{row['id']},{duration}\n")
+    for start in range(0, len(data), BATCH_SIZE):
+        batch = data[start : start + BATCH_SIZE]
+        for row in batch:
+            row["id"] = str(uuid.uuid4())
+            duration = (
+                row["lpep_dropoff_datetime"] - row["lpep_pickup_datetime"]
+            ).total_seconds() / 60
+            if duration != 0.0:
+                f_target.write(f"{row['id']},{duration}\n")
+        # newline-delimited JSON, one ride per line
         resp = requests.post(
-            "http://127.0.0.1:9696/predict",
-            headers={"Content-Type": "application/json"},
-            data=json.dumps(row, cls=DateTimeEncoder),
+            "http://127.0.0.1:9696/predict/batch",
+            headers={"Content-Type": "application/x-ndjson"},
+            data="\n".join(json.dumps(row, cls=DateTimeEncoder) for row in batch),
         ).json()
-        print(f"prediction: {resp['duration']}")
-        sleep(1)
+        print(f"predictions {start}-{start + len(batch)}: {resp['durations'][:5]}...")
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# the services are deployed from their own folders and import their
+# modules top-level; their app.py modules share a name, so tests import
+# the other modules only
+W5_MONITOR = Path(__file__).resolve().parents[1]
+for service in ("evidently_service", "prediction_service"):
+    sys.path.insert(0, str(W5_MONITOR / service))
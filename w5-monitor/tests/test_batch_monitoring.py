@@ -0,0 +1,282 @@
+import pickle
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import pandas as pd
+import pytest
+from bson import ObjectId
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.linear_model import LinearRegression
+
+import batch_monitoring
+
+NOW = datetime(2022, 7, 1, tzinfo=timezone.utc)
+
+
+def prediction(inserted_at, **fields):
+    document = {
+        "_id": ObjectId.from_datetime(inserted_at),
+        "id": "ride",
+        "PULocationID": 10,
+        "DOLocationID": 50,
+        "trip_distance": 4,
+        "prediction": 12.5,
+        "ehail_fee": None,
+    }
+    document.update(fields)
+    return document
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.collection
+
+
+def test_fetch_predictions_window_and_projection(collection):
+    collection.insert_many(
+        [
+            prediction(NOW - timedelta(days=8)),  # before the window
+            prediction(NOW - timedelta(days=3), target=14.0),
+            prediction(NOW - timedelta(days=1)),
+            prediction(NOW + timedelta(hours=1)),  # after the window
+        ]
+    )
+
+    table = batch_monitoring.fetch_predictions(collection, NOW - timedelta(days=7), NOW)
+
+    assert table.schema == batch_monitoring.MONITORED_SCHEMA
+    df = table.to_pandas()
+    assert len(df) == 2
+    assert df["trip_distance"].tolist() == [4.0, 4.0]
+    assert df["target"].tolist()[0] == 14.0
+    assert df["target"].isna().tolist() == [False, True]
+
+
+def test_fetch_predictions_in_batches(collection):
+    collection.insert_many(
+        [
+            prediction(NOW - timedelta(minutes=minute), trip_distance=minute)
+            for minute in range(1, 8)
+        ]
+    )
+
+    table = batch_monitoring.fetch_predictions(
+        collection, NOW - timedelta(days=1), NOW, batch_size=3
+    )
+
+    assert [batch.num_rows for batch in table.to_batches()] == [3, 3, 1]
+    assert sorted(table.column("trip_distance").to_pylist()) == list(range(1, 8))
+
+
+def test_fetch_predictions_empty_window(collection):
+    table = batch_monitoring.fetch_predictions(collection, NOW - timedelta(days=7), NOW)
+
+    assert table.num_rows == 0
+    assert table.schema == batch_monitoring.MONITORED_SCHEMA
+
+
+def test_upload_targets(collection, tmp_path, monkeypatch):
+    collection.insert_many(
+        [prediction(NOW + timedelta(seconds=i), id=f"ride-{i}") for i in range(7)]
+        + [prediction(NOW - timedelta(seconds=1), id="no-target")]
+    )
+    target_file = tmp_path / "target.csv"
+    target_file.write_text("".join(f"ride-{i},{i + 0.5}\n" for i in range(7)) + "\n")
+    batch_sizes = []
+    bulk_write = collection.bulk_write
+
+    def counting_bulk_write(operations, **kwargs):
+        batch_sizes.append(len(operations))
+        return bulk_write(operations, **kwargs)
+
+    monkeypatch.setattr(collection, "bulk_write", counting_bulk_write)
+
+    n_rows = batch_monitoring.upload_targets(collection, target_file, batch_size=3)
+
+    assert n_rows == 7
+    assert batch_sizes == [3, 3, 1]
+    targets = {doc["id"]: doc.get("target") for doc in collection.find()}
+    assert targets == {**{f"ride-{i}": i + 0.5 for i in range(7)}, "no-target": None}
+    assert any(
+        index["key"] == [("id", 1)] for index in collection.index_information().values()
+    )
+
+
+class StandInOptions:
+    """Holds options by type, like evidently's OptionsProvider"""
+
+    def __init__(self, *options):
+        self._options = {type(option): option for option in options}
+
+
+class StandInAnalyzer:
+    calls = 0
+
+    def calculate(self, reference_data, current_data, column_mapping):
+        type(self).calls += 1
+        return {"options": self.options_provider, "rows": len(current_data)}
+
+
+class DriftAnalyzer(StandInAnalyzer):
+    pass
+
+
+class RegressionAnalyzer(StandInAnalyzer):
+    pass
+
+
+class Stage:
+    def __init__(self, *analyzers):
+        self._analyzers = analyzers
+        self.results = None
+
+    def calculate(self, reference_data, current_data, column_mapping, results):
+        self.results = {analyzer: results[analyzer] for analyzer in self._analyzers}
+
+
+class StandInPipeline:
+    def __init__(self, stages, options_provider):
+        self.stages = stages
+        self.options_provider = options_provider
+        self.analyzers_results = {}
+
+    def get_analyzers(self):
+        return [analyzer for stage in self.stages for analyzer in stage._analyzers]
+
+
+def test_calculate_pipelines_runs_each_analyzer_once():
+    DriftAnalyzer.calls = RegressionAnalyzer.calls = 0
+    profile = StandInPipeline(
+        [Stage(DriftAnalyzer), Stage(RegressionAnalyzer)], StandInOptions(0.05)
+    )
+    dashboard = StandInPipeline(
+        [Stage(DriftAnalyzer, RegressionAnalyzer)], StandInOptions(0.05)
+    )
+    data = pd.DataFrame({"trip_distance": [1.0, 2.0, 3.0]})
+
+    timings = batch_monitoring.calculate_pipelines(
+        [profile, dashboard], data, data, column_mapping=None
+    )
+
+    assert DriftAnalyzer.calls == RegressionAnalyzer.calls == 1
+    assert profile.analyzers_results is dashboard.analyzers_results
+    assert dashboard.stages[0].results[DriftAnalyzer]["rows"] == 3
+    assert set(timings) == {
+        "DriftAnalyzer",
+        "RegressionAnalyzer",
+        "StandInPipeline.Stage",
+    }
+
+
+def test_calculate_pipelines_rejects_different_options():
+    profile = StandInPipeline([Stage(DriftAnalyzer)], StandInOptions(0.05))
+    dashboard = StandInPipeline([Stage(DriftAnalyzer)], StandInOptions(0.1))
+    data = pd.DataFrame({"trip_distance": [1.0]})
+
+    with pytest.raises(ValueError):
+        batch_monitoring.calculate_pipelines(
+            [profile, dashboard], data, data, column_mapping=None
+        )
+
+
+@pytest.fixture
+def reference_file(tmp_path):
+    pickup = pd.Timestamp("2021-01-01 10:00")
+    reference = pd.DataFrame(
+        {
+            "lpep_pickup_datetime": [pickup] * 4,
+            "lpep_dropoff_datetime": pickup
+            + pd.to_timedelta([10, 20, 0.5, 90], unit="min"),
+            "PULocationID": [1, 2, 3, 4],
+            "DOLocationID": [5, 6, 7, 8],
+            "trip_distance": [1.0, 2.5, 0.1, 30.0],
+        }
+    )
+    path = tmp_path / "green_tripdata_2021-01.parquet"
+    reference.to_parquet(path)
+    return path
+
+
+def write_model(path, intercept):
+    dv = DictVectorizer()
+    X = dv.fit_transform([{"PU_DO": "1_5", "trip_distance": 1.0}])
+    model = LinearRegression().fit(X, [0.0])
+    model.coef_[:] = 0
+    model.intercept_ = intercept
+    with open(path, "wb") as f_out:
+        pickle.dump((dv, model), f_out)
+    return path
+
+
+@pytest.fixture
+def scorings(monkeypatch):
+    calls = []
+    score_reference = batch_monitoring.score_reference
+
+    def counting_score_reference(*args):
+        calls.append(args)
+        return score_reference(*args)
+
+    monkeypatch.setattr(batch_monitoring, "score_reference", counting_score_reference)
+    return calls
+
+
+def test_scored_reference_is_cached(reference_file, tmp_path, scorings):
+    model_file = write_model(tmp_path / "model.bin", intercept=12.0)
+    cache_dir = tmp_path / "cache"
+
+    first = batch_monitoring.load_scored_reference(
+        reference_file, model_file, cache_dir
+    )
+    second = batch_monitoring.load_scored_reference(
+        reference_file, model_file, cache_dir
+    )
+
+    assert len(scorings) == 1
+    # only the 1-60 minute rides are kept
+    assert first["target"].tolist() == [10.0, 20.0]
+    assert first["prediction"].tolist() == [12.0, 12.0]
+    pd.testing.assert_frame_equal(second, first)
+
+
+def test_new_model_rescores_reference(reference_file, tmp_path, scorings):
+    model_file = write_model(tmp_path / "model.bin", intercept=12.0)
+    cache_dir = tmp_path / "cache"
+    batch_monitoring.load_scored_reference(reference_file, model_file, cache_dir)
+
+    write_model(model_file, intercept=15.0)
+    rescored = batch_monitoring.load_scored_reference(
+        reference_file, model_file, cache_dir
+    )
+
+    assert len(scorings) == 2
+    assert rescored["prediction"].tolist() == [15.0, 15.0]
+
+
+def test_new_reference_rescores(reference_file, tmp_path, scorings):
+    model_file = write_model(tmp_path / "model.bin", intercept=12.0)
+    cache_dir = tmp_path / "cache"
+    batch_monitoring.load_scored_reference(reference_file, model_file, cache_dir)
+
+    reference = pd.read_parquet(reference_file)
+    reference["trip_distance"] *= 2
+    reference.to_parquet(reference_file)
+    rescored = batch_monitoring.load_scored_reference(
+        reference_file, model_file, cache_dir
+    )
+
+    assert len(scorings) == 2
+    assert rescored["trip_distance"].tolist() == [2.0, 5.0]
+
+
+def test_sample_size_is_part_of_the_cache_key(reference_file, tmp_path, scorings):
+    model_file = write_model(tmp_path / "model.bin", intercept=12.0)
+    cache_dir = tmp_path / "cache"
+
+    batch_monitoring.load_scored_reference(reference_file, model_file, cache_dir)
+    sampled = batch_monitoring.load_scored_reference(
+        reference_file, model_file, cache_dir, sample_size=3
+    )
+
+    assert len(scorings) == 2
+    assert len(sampled) <= 3
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+from evidently.model_monitoring.monitors.data_drift import DataDriftMonitorMetrics
+from scipy.stats import chi2_contingency, ks_2samp
+
+import drift_stats
+
+WINDOW_SIZE = 50
+MOVING_REFERENCE_SIZE = 30
+
+
+def trips(n, seed, distance_scale=1.0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "trip_distance": rng.lognormal(sigma=1.0, size=n) * distance_scale,
+            "PULocationID": rng.choice([10, 43, 74, 75, 166], size=n),
+        }
+    )
+
+
+@pytest.fixture
+def sketches():
+    reference = trips(500, seed=0)
+    return [
+        drift_stats.FeatureSketch.numerical(
+            "trip_distance", reference["trip_distance"], n_bins=10
+        ),
+        # location 1 is missing from the reference: the unseen bucket
+        drift_stats.FeatureSketch.categorical(
+            "PULocationID", reference["PULocationID"].replace(166, 1)
+        ),
+    ]
+
+
+def expected_counts(sketches, rows):
+    return {
+        sketch.name: sketch.count(sketch.encode(rows[sketch.name]))
+        for sketch in sketches
+    }
+
+
+def assert_counts_equal(counts, expected):
+    assert counts.keys() == expected.keys()
+    for name in counts:
+        np.testing.assert_array_equal(counts[name], expected[name])
+
+
+# the last update is longer than the window
+UPDATE_SIZES = [23, 23, 23, 40, 7, 80]
+
+
+def test_current_counts_follow_the_window(sketches):
+    drift = drift_stats.IncrementalDrift(sketches, WINDOW_SIZE)
+    seen = []
+    for seed, size in enumerate(UPDATE_SIZES, start=1):
+        rows = trips(size, seed)
+        drift.update(rows)
+        seen.append(rows)
+        window = pd.concat(seen, ignore_index=True).tail(WINDOW_SIZE)
+        assert_counts_equal(drift.current_counts, expected_counts(sketches, window))
+        # the reference stays the sketched one
+        assert_counts_equal(
+            drift.reference_counts,
+            {sketch.name: sketch.reference_counts for sketch in sketches},
+        )
+
+
+def test_moving_reference_follows_evicted_rows(sketches):
+    seed_reference = trips(40, seed=100)
+    drift = drift_stats.IncrementalDrift(
+        sketches,
+        WINDOW_SIZE,
+        moving_reference_size=MOVING_REFERENCE_SIZE,
+        reference=seed_reference,
+    )
+    assert_counts_equal(
+        drift.reference_counts,
+        expected_counts(sketches, seed_reference.tail(MOVING_REFERENCE_SIZE)),
+    )
+
+    seen = []
+    for seed, size in enumerate(UPDATE_SIZES, start=1):
+        rows = trips(size, seed)
+        drift.update(rows)
+        seen.append(rows)
+        stream = pd.concat(seen, ignore_index=True)
+        window = stream.tail(WINDOW_SIZE)
+        left_window = stream.iloc[: len(stream) - len(window)]
+        reference = pd.concat([seed_reference, left_window]).tail(MOVING_REFERENCE_SIZE)
+        assert_counts_equal(drift.current_counts, expected_counts(sketches, window))
+        assert_counts_equal(
+            drift.reference_counts, expected_counts(sketches, reference)
+        )
+
+
+def test_binned_ks_p_value_is_close_to_scipy():
+    reference = trips(5000, seed=0)["trip_distance"]
+    sketch = drift_stats.FeatureSketch.numerical("trip_distance", reference)
+    for seed, distance_scale in [(1, 1.0), (2, 1.05), (3, 1.08), (4, 1.15)]:
+        current = trips(1000, seed, distance_scale)["trip_distance"]
+        binned = drift_stats.ks_p_value(
+            sketch.reference_counts, sketch.count(sketch.encode(current))
+        )
+        exact = ks_2samp(reference, current, method="asymp").pvalue
+        # binning can only shrink the KS statistic, by at most one bin
+        assert exact <= binned <= exact + 0.1
+        assert (binned < 0.05) == (exact < 0.05)
+
+
+def test_chi_square_p_value_matches_scipy():
+    reference = trips(500, seed=0)["PULocationID"]
+    current = trips(200, seed=1)["PULocationID"].replace(43, 1)
+    sketch = drift_stats.FeatureSketch.categorical("PULocationID", reference)
+
+    p_value = drift_stats.chi_square_p_value(
+        sketch.reference_counts, sketch.count(sketch.encode(current))
+    )
+
+    samples = pd.DataFrame(
+        {
+            "sample": ["reference"] * len(reference) + ["current"] * len(current),
+            "PULocationID": pd.concat([reference, current], ignore_index=True),
+        }
+    )
+    table = pd.crosstab(samples["sample"], samples["PULocationID"])
+    assert p_value == pytest.approx(chi2_contingency(table, correction=False)[1])
+
+
+def test_metrics_match_data_drift_monitor(sketches):
+    drift = drift_stats.IncrementalDrift(sketches, WINDOW_SIZE)
+    drift.update(trips(WINDOW_SIZE, seed=1, distance_scale=3.0))
+
+    metrics = list(drift.metrics())
+
+    names = [metric.name for metric, _, _ in metrics]
+    assert names[:3] == [
+        DataDriftMonitorMetrics.share_drifted_features.name,
+        DataDriftMonitorMetrics.n_drifted_features.name,
+        DataDriftMonitorMetrics.dataset_drift.name,
+    ]
+    p_values = [
+        (metric, labels)
+        for metric, _, labels in metrics
+        if metric.name == DataDriftMonitorMetrics.p_value.name
+    ]
+    assert [labels for _, labels in p_values] == [
+        {"feature": "trip_distance", "feature_type": "num"},
+        {"feature": "PULocationID", "feature_type": "cat"},
+    ]
+    for metric, labels in p_values:
+        assert list(labels) == DataDriftMonitorMetrics.p_value.labels
+    values = {metric.name: value for metric, value, _ in metrics[:3]}
+    assert values[DataDriftMonitorMetrics.dataset_drift.name] is True
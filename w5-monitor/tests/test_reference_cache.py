@@ -0,0 +1,123 @@
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from evidently.pipeline.column_mapping import ColumnMapping
+
+import reference_cache
+
+COLUMN_MAPPING = ColumnMapping(
+    numerical_features=["trip_distance"],
+    categorical_features=["PULocationID", "DOLocationID"],
+    prediction=None,
+    target=None,
+)
+
+
+def write_trips(path, distances=(1.5, 7.0, 3.2, 2.4, 30.0)):
+    pickup = datetime(2021, 1, 1, 5)
+    data = [
+        (
+            pickup.replace(hour=i),
+            pickup.replace(hour=i, minute=10 + i),
+            10 + i,
+            None if i == 2 else 50,
+            distance,
+        )
+        for i, distance in enumerate(distances)
+    ]
+    # one ride too long to be kept
+    data.append((pickup, pickup.replace(hour=7), 1, 2, 9.0))
+    columns = [
+        "lpep_pickup_datetime",
+        "lpep_dropoff_datetime",
+        "PULocationID",
+        "DOLocationID",
+        "trip_distance",
+    ]
+    pd.DataFrame(data, columns=columns).to_parquet(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def reference_file(tmp_path):
+    return write_trips(tmp_path / "green_tripdata_2021-01.parquet")
+
+
+def test_cache_key_follows_file_content(tmp_path, reference_file):
+    key = reference_cache.cache_key(reference_file, COLUMN_MAPPING)
+    assert reference_cache.cache_key(reference_file, COLUMN_MAPPING) == key
+
+    # same content under another name: same key
+    copy = tmp_path / "copy.parquet"
+    shutil.copy(reference_file, copy)
+    assert reference_cache.cache_key(str(copy), COLUMN_MAPPING) == key
+
+    write_trips(reference_file, distances=(1.5, 7.0, 3.2, 2.4, 31.0))
+    assert reference_cache.cache_key(reference_file, COLUMN_MAPPING) != key
+
+
+def test_cache_key_follows_column_mapping(reference_file):
+    key = reference_cache.cache_key(reference_file, COLUMN_MAPPING)
+    fewer_features = ColumnMapping(
+        numerical_features=["trip_distance"],
+        categorical_features=["PULocationID"],
+        prediction=None,
+        target=None,
+    )
+    with_prediction = ColumnMapping(
+        numerical_features=["trip_distance"],
+        categorical_features=["PULocationID", "DOLocationID"],
+        prediction="prediction",
+        target=None,
+    )
+    assert reference_cache.cache_key(reference_file, fewer_features) != key
+    assert reference_cache.cache_key(reference_file, with_prediction) != key
+
+
+def test_cached_reference_loads_back_the_same(tmp_path, reference_file, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    prepared, sketches = reference_cache.load_reference(
+        reference_file, COLUMN_MAPPING, cache_dir
+    )
+    assert len(prepared) == 5
+    key = reference_cache.cache_key(reference_file, COLUMN_MAPPING)
+    assert sorted(os.listdir(cache_dir)) == [
+        f"green_tripdata_2021-01-{key[:16]}.parquet",
+        f"green_tripdata_2021-01-{key[:16]}.sketches.pkl",
+    ]
+
+    def no_preparation(*args):
+        raise AssertionError("the cached reference should be loaded")
+
+    monkeypatch.setattr(reference_cache, "prepare_reference", no_preparation)
+    cached, cached_sketches = reference_cache.load_reference(
+        reference_file, COLUMN_MAPPING, cache_dir
+    )
+
+    pd.testing.assert_frame_equal(cached, prepared)
+    assert dict(cached.dtypes) == dict(prepared.dtypes)
+    assert cached["trip_distance"].dtype == np.float64
+    assert [sketch.name for sketch in cached_sketches] == [
+        sketch.name for sketch in sketches
+    ]
+    for cached_sketch, sketch in zip(cached_sketches, sketches):
+        np.testing.assert_array_equal(
+            cached_sketch.reference_counts, sketch.reference_counts
+        )
+
+
+def test_changed_reference_is_prepared_again(tmp_path, reference_file):
+    cache_dir = str(tmp_path / "cache")
+    reference_cache.load_reference(reference_file, COLUMN_MAPPING, cache_dir)
+
+    write_trips(reference_file, distances=(1.5, 7.0, 3.2, 2.4, 31.0))
+    prepared, _ = reference_cache.load_reference(
+        reference_file, COLUMN_MAPPING, cache_dir
+    )
+
+    assert prepared["trip_distance"].max() == 31.0
+    assert len(os.listdir(cache_dir)) == 4
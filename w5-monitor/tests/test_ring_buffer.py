@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+from evidently.pipeline.column_mapping import ColumnMapping
+
+from ring_buffer import RingBuffer, window_columns
+
+CAPACITY = 5
+COLUMN_MAPPING = ColumnMapping(
+    numerical_features=["trip_distance"],
+    categorical_features=["PULocationID"],
+    datetime="tpep_pickup_datetime",
+    prediction="prediction",
+    target=None,
+)
+
+
+def rows(start, n):
+    ids = np.arange(start, start + n)
+    return pd.DataFrame(
+        {
+            "trip_distance": ids * 1.5,
+            "PULocationID": np.array([f"loc-{i}" for i in ids], dtype=object),
+            "tpep_pickup_datetime": pd.Timestamp("2022-01-01")
+            + pd.to_timedelta(ids, unit="min").astype("timedelta64[ns]"),
+            "prediction": ids + 0.25,
+        }
+    )
+
+
+@pytest.fixture
+def buffer():
+    return RingBuffer(window_columns(COLUMN_MAPPING), CAPACITY)
+
+
+def assert_rows(arrays, expected):
+    assert arrays.keys() == set(expected.columns)
+    for column, values in arrays.items():
+        assert values.dtype == window_columns(COLUMN_MAPPING)[column]
+        np.testing.assert_array_equal(values, expected[column].to_numpy())
+
+
+def assert_window(buffer, expected):
+    window = buffer.window()
+    assert_rows(buffer.arrays(), expected)
+    # the installed pandas may infer a string dtype for object columns
+    pd.testing.assert_frame_equal(
+        window,
+        expected[list(window.columns)].reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_smaller_appends_fill_then_evict_oldest(buffer):
+    assert buffer.append(rows(0, 3)) is None
+    assert_window(buffer, rows(0, 3))
+    assert buffer.size == 3
+
+    # 2 free slots, so one row is evicted
+    evicted = buffer.append(rows(3, 3))
+    assert_rows(evicted, rows(0, 1))
+    assert_window(buffer, rows(1, 5))
+    assert buffer.size == CAPACITY
+
+
+def test_append_equal_to_capacity_evicts_the_whole_window(buffer):
+    assert buffer.append(rows(0, CAPACITY)) is None
+    assert_window(buffer, rows(0, CAPACITY))
+
+    evicted = buffer.append(rows(CAPACITY, CAPACITY))
+    assert_rows(evicted, rows(0, CAPACITY))
+    assert_window(buffer, rows(CAPACITY, CAPACITY))
+
+
+def test_append_larger_than_capacity_keeps_the_latest_rows(buffer):
+    buffer.append(rows(0, 2))
+
+    # only the window's previous rows are returned, not the new rows that
+    # never made it into the window
+    evicted = buffer.append(rows(2, 3 * CAPACITY))
+    assert_rows(evicted, rows(0, 2))
+    assert_window(buffer, rows(2 + 2 * CAPACITY, CAPACITY))
+
+
+def test_window_after_wrapping_many_times(buffer):
+    start = 0
+    window = rows(0, 0)
+    for n in [3, 4, 1, 5, 2, 7, 3]:
+        n_kept = min(n, CAPACITY)
+        n_evicted = max(0, len(window) + n_kept - CAPACITY)
+
+        evicted = buffer.append(rows(start, n))
+        if n_evicted:
+            assert_rows(evicted, window.head(n_evicted).reset_index(drop=True))
+        else:
+            assert evicted is None
+
+        window = pd.concat([window, rows(start, n)]).tail(CAPACITY)
+        start += n
+        assert_window(buffer, window)
+    assert buffer.size == CAPACITY
+
+
+def test_columns_missing_from_appended_rows(buffer):
+    partial = rows(0, 2).drop(columns=["prediction"])
+    buffer.append(partial)
+    # never seen: left out of the window and of the evicted rows
+    assert "prediction" not in buffer.window()
+    evicted = buffer.append(rows(2, 4))
+    assert "prediction" not in evicted
+
+    window = buffer.window()
+    assert np.isnan(window["prediction"][0])
+    np.testing.assert_array_equal(window["prediction"][1:], rows(2, 4)["prediction"])
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sampling
+
+
+@pytest.fixture
+def reference():
+    rng = np.random.default_rng(0)
+    n = 10000
+    return pd.DataFrame(
+        {
+            # skewed strata, so proportions are not kept by chance
+            sampling.PICKUP_HOUR: rng.choice([8, 17, 3], size=n, p=[0.6, 0.3, 0.1]),
+            "PULocationID": rng.choice([10, 74, 166], size=n, p=[0.7, 0.2, 0.1]),
+            "trip_distance": rng.lognormal(size=n),
+        }
+    )
+
+
+def shares(df):
+    return df.groupby(sampling.DEFAULT_STRATA).size() / len(df)
+
+
+def test_stratified_sample_keeps_stratum_proportions(reference):
+    sample = sampling.stratified_sample(reference, 1000, sampling.DEFAULT_STRATA)
+
+    assert len(sample) == 1000
+    assert sample.index.is_unique and sample.index.isin(reference.index).all()
+    # largest remainders: every stratum within one row of its exact quota
+    quota = shares(reference) * len(sample)
+    counts = sample.groupby(sampling.DEFAULT_STRATA).size()
+    counts = counts.reindex(quota.index, fill_value=0)
+    assert (np.abs(counts - quota) < 1).all()
+
+
+def test_reservoir_sample_size_and_rows(reference):
+    sample = sampling.reservoir_sample(reference, 1000)
+
+    assert len(sample) == 1000
+    assert sample.index.is_unique and sample.index.is_monotonic_increasing
+    pd.testing.assert_frame_equal(sample, reference.loc[sample.index])
+
+
+@pytest.mark.parametrize("method", ["reservoir", "stratified"])
+def test_samples_are_reproducible(reference, method):
+    first = sampling.sample_reference(reference, method, 500)
+    second = sampling.sample_reference(reference.copy(), method, 500)
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_seed_changes_the_sample(reference):
+    first = sampling.reservoir_sample(reference, 500, seed=1)
+    second = sampling.reservoir_sample(reference, 500, seed=2)
+    assert not first.index.equals(second.index)
+
+    first = sampling.stratified_sample(reference, 500, sampling.DEFAULT_STRATA, 1)
+    second = sampling.stratified_sample(reference, 500, sampling.DEFAULT_STRATA, 2)
+    assert not first.index.equals(second.index)
+
+
+@pytest.mark.parametrize("method", sampling.SAMPLING_METHODS)
+def test_small_references_are_kept_whole(reference, method):
+    small = reference.head(100)
+    pd.testing.assert_frame_equal(sampling.sample_reference(small, method, 500), small)
+
+
+def test_unknown_method(reference):
+    with pytest.raises(ValueError, match="reference_sample"):
+        sampling.sample_reference(reference, "systematic", 500)
@@ -0,0 +1,89 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from sinks import BackgroundSink
+
+
+class Writer:
+    """write callable recording the batches; blocks while `paused` is clear
+    and raises for the records listed in `failing`"""
+
+    def __init__(self):
+        self.batches = []
+        self.started = threading.Event()
+        self.paused = threading.Event()
+        self.paused.set()
+        self.failing = set()
+
+    def __call__(self, batch):
+        self.started.set()
+        self.paused.wait()
+        if self.failing.intersection(batch):
+            raise ConnectionError("database unavailable")
+        self.batches.append(list(batch))
+
+    @property
+    def records(self):
+        return [record for batch in self.batches for record in batch]
+
+
+@pytest.fixture
+def writer():
+    return Writer()
+
+
+def test_close_flushes_every_queued_record(writer):
+    sink = BackgroundSink("test", writer, batch_size=100, flush_interval_sec=0.05)
+    writer.paused.clear()
+    sink.put(range(250))
+    writer.paused.set()
+
+    sink.close()
+
+    assert writer.records == list(range(250))
+    assert all(len(batch) <= 100 for batch in writer.batches)
+    assert not sink._worker.is_alive()
+    assert sink.dropped == 0
+
+
+def test_full_queue_drops_records_without_blocking(writer):
+    sink = BackgroundSink(
+        "test",
+        writer,
+        batch_size=1,
+        flush_interval_sec=0.05,
+        max_queued=5,
+        put_timeout_sec=0.1,
+    )
+    writer.paused.clear()
+    sink.put(["first"])
+    # the worker holds the first record in write, the queue is empty
+    assert writer.started.wait(5)
+
+    start = time.monotonic()
+    sink.put(range(10))
+    # one put_timeout_sec for the whole call, not one per dropped record
+    assert time.monotonic() - start < 0.5
+    assert sink.dropped == 5
+    sink.put(range(10, 13))
+    assert sink.dropped == 8
+
+    writer.paused.set()
+    sink.close()
+    assert writer.records == ["first", 0, 1, 2, 3, 4]
+
+
+def test_write_errors_do_not_stop_the_worker(writer, caplog):
+    sink = BackgroundSink("test", writer, batch_size=1, flush_interval_sec=0.05)
+    writer.failing = {"lost"}
+
+    with caplog.at_level(logging.ERROR):
+        sink.put(["lost", "kept"])
+        sink.close()
+
+    assert writer.records == ["kept"]
+    assert "test sink failed to write 1 records" in caplog.text
+    assert "ConnectionError" in caplog.text
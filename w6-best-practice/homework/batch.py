@@ -7,6 +7,8 @@ import sys
 
 import pandas as pd
 
+COLUMNS = ["PUlocationID", "DOlocationID", "pickup_datetime", "dropOff_datetime"]
+
 
 ## parametrize the input and output paths
 def get_input_path(year, month):
@@ -31,7 +33,9 @@ def read_data(filename, S3_ENDPOINT_URL=None):
     else:
         options = None
 
-    df = pd.read_parquet(filename, storage_options=options)
+    # only fetch the columns prepare_data uses; rows are kept as-is since
+    # ride_id is built from the row position in the original file
+    df = pd.read_parquet(filename, columns=COLUMNS, storage_options=options)
 
     return df
 
@@ -2,6 +2,7 @@ from datetime import datetime
 
 import batch
 import pandas as pd
+import pytest
 
 
 def dt(hour, minute, second=0):
@@ -28,3 +29,29 @@ def test_read():
     print(actual_df.to_json())
     # expected_df =
     assert len(actual_df) == 2
+
+
+def test_read_data_projects_columns(tmp_path):
+    data = [
+        (1, 1, dt(1, 2), dt(1, 10), "B00001"),
+        (None, 2, dt(1, 2), dt(1, 3), "B00002"),
+    ]
+    columns = batch.COLUMNS + ["dispatching_base_num"]
+    input_file = tmp_path / "fhv.parquet"
+    pd.DataFrame(data, columns=columns).to_parquet(input_file, index=False)
+
+    actual_df = batch.read_data(str(input_file))
+
+    assert list(actual_df.columns) == batch.COLUMNS
+    assert len(actual_df) == 2
+
+
+def test_read_data_missing_column(tmp_path):
+    # e.g. a month whose file spells a location column differently
+    data = [(1, dt(1, 2), dt(1, 10))]
+    columns = ["PUlocationID", "pickup_datetime", "dropOff_datetime"]
+    input_file = tmp_path / "fhv.parquet"
+    pd.DataFrame(data, columns=columns).to_parquet(input_file, index=False)
+
+    with pytest.raises(ValueError, match="DOlocationID"):
+        batch.read_data(str(input_file))